@@ -0,0 +1,6 @@
+"""
+LXePETSim: Monte Carlo simulation of the Philips Vereos PET scanner (LYSO or
+liquid xenon crystals) with OpenGATE, coincidence sorting and CASToR list-mode
+conversion. The scripts of this folder are run directly or through the
+'lxepet' command (see cli.py).
+"""
@@ -1,5 +1,9 @@
 #!/bin/bash
 
+# One run per distance; the same sweep in a single run (one Geant4 initialization):
+#   python pet_sim_philips.py --source_dists $(seq 0.0 1.0 15.0)
+# then sim_to_coincidence.py --sources ... and split_sources.py (see README)
+
 # Loop over source distances from 1.0 to 12.0 cm
 for dist in $(seq 0.0 1.0 15.0)
 do
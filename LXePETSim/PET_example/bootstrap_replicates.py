@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Noise replicates of one list-mode dataset.
+
+Writes N resampled copies of a CASToR dataset (.cdh/.cdf), each with its own
+header, optionally reconstructs each one, and accumulates the voxel-wise mean
+and variance of the reconstructed images with Welford's algorithm, so only
+one replicate image is held in memory at a time.
+
+  bootstrap : N events drawn with replacement out of the N events
+  poisson   : every event kept k ~ Poisson(1) times (total count varies
+              like the one of a new acquisition)
+
+The events are resampled chunk by chunk on the memory-mapped .cdf as repeat
+counts per event, so the replicates stay time-ordered and the dataset is
+never loaded at once.
+"""
+
+import os
+import sys
+import glob
+import shlex
+import argparse
+import subprocess
+import numpy as np
+
+if __package__:
+    from .castor_io import CONFIG_DIR, read_cdf, write_cdh, read_interfile_image, write_interfile_image
+else:  # run as a script from this folder
+    from castor_io import CONFIG_DIR, read_cdf, write_cdh, read_interfile_image, write_interfile_image
+
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# ==============================================
+# 1. Command-line argument parsing
+# ==============================================
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Resample a list-mode dataset and compute the mean and variance images of the replicates."
+    )
+    parser.add_argument("--datafile", type=str, required=True,
+                        help="CASToR list-mode header (.cdh) to resample.")
+    parser.add_argument("--n_replicates", type=int, default=20,
+                        help="Number of replicates.")
+    parser.add_argument("--method", type=str, default="bootstrap", choices=["bootstrap", "poisson"],
+                        help="Resampling method.")
+    parser.add_argument("--output_dir", type=str, default="replicates",
+                        help="Output folder of the replicates, their images and the mean/variance images.")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Random seed (replicate k uses the k-th child seed).")
+    parser.add_argument("--chunk_size", type=int, default=10_000_000,
+                        help="Number of input events resampled at once.")
+    parser.add_argument("--recon", action="store_true",
+                        help="Reconstruct every replicate with quick_osem_recon.py.")
+    parser.add_argument("--recon_args", type=str, default="",
+                        help="Extra arguments of quick_osem_recon.py, e.g. '--it 2:28 --dim 300,150,1'.")
+    parser.add_argument("--recon_command", type=str, default=None,
+                        help="Reconstruction command instead of quick_osem_recon.py, with {datafile} and {fout} "
+                             "placeholders, e.g. 'castor-recon -df {datafile} -fout {fout} ...'. It must write "
+                             "{fout}_it<N>.hdr.")
+    parser.add_argument("--lut", type=str,
+                        default=os.path.join(CONFIG_DIR, "philips_vereos_virtual_crystals_binary.lut"),
+                        help="Binary LUT passed to quick_osem_recon.py.")
+    parser.add_argument("--remove_data", action="store_true",
+                        help="Delete each replicate .cdf once it is reconstructed.")
+    args = parser.parse_args()
+    if args.recon_command:
+        args.recon = True
+    if args.remove_data and not args.recon:
+        parser.error("--remove_data requires --recon")
+    return args
+
+
+# ==============================================
+# 2. Resampling
+# ==============================================
+def resample_counts(n_chunk, n_remaining, n_draws, method, rng):
+    """
+    Repeat counts of the next n_chunk events out of the n_remaining not yet
+    visited. For bootstrap, n_draws draws are left; the chunk gets a binomial
+    share of them, spread uniformly over its events, which makes the counts of
+    all chunks one multinomial(N, 1/N) vector.
+    """
+    if method == "poisson":
+        return rng.poisson(1.0, n_chunk)
+    n_chunk_draws = rng.binomial(n_draws, n_chunk / n_remaining) if n_remaining > n_chunk else n_draws
+    return np.bincount(rng.integers(0, n_chunk, n_chunk_draws), minlength=n_chunk)
+
+
+def write_replicate(events, header, cdh_path, method, rng, chunk_size):
+    """Write one resampled copy of the events with its header. Returns the number of events."""
+    n_total = len(events)
+    cdf_path = cdh_path[:-len(".cdh")] + ".cdf"
+    n_written, n_draws = 0, n_total
+    with open(cdf_path, "wb") as out:
+        for start in range(0, n_total, chunk_size):
+            stop = min(start + chunk_size, n_total)
+            counts = resample_counts(stop - start, n_total - start, n_draws, method, rng)
+            n_draws -= int(counts.sum())
+            idx = np.repeat(np.arange(start, stop), counts)
+            events[idx].tofile(out)
+            n_written += len(idx)
+
+    replicate_header = dict(header)
+    replicate_header["Data filename"] = cdf_path
+    replicate_header["Number of events"] = str(n_written)
+    write_cdh(cdh_path, replicate_header)
+    return n_written
+
+
+# ==============================================
+# 3. Reconstruction and running moments
+# ==============================================
+class WelfordImage:
+    """Running voxel-wise mean and variance of a sequence of images (Welford's algorithm)."""
+
+    def __init__(self):
+        self.n = 0
+        self.mean = None
+        self.m2 = None
+
+    def update(self, image):
+        image = np.asarray(image, dtype=np.float64)
+        if self.mean is None:
+            self.mean = np.zeros_like(image)
+            self.m2 = np.zeros_like(image)
+        elif image.shape != self.mean.shape:
+            raise ValueError(f"Image shape {image.shape} differs from the previous ones {self.mean.shape}")
+        self.n += 1
+        delta = image - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (image - self.mean)
+
+    def variance(self):
+        """Unbiased (n - 1) variance."""
+        if self.n < 2:
+            raise ValueError("The variance needs at least two images")
+        return self.m2 / (self.n - 1)
+
+
+def reconstruct(args, cdh_path):
+    """Reconstruct a replicate; returns the header of its last-iteration image."""
+    fout = cdh_path[:-len(".cdh")]
+    if args.recon_command:
+        command = shlex.split(args.recon_command.format(datafile=cdh_path, fout=fout))
+    else:
+        command = [sys.executable, os.path.join(SCRIPT_DIR, "quick_osem_recon.py"), "--datafile", cdh_path,
+                   "--lut", args.lut, "--fout", fout, *shlex.split(args.recon_args)]
+    subprocess.run(command, check=True)
+
+    images = glob.glob(f"{fout}_it*.hdr")
+    if not images:
+        raise FileNotFoundError(f"The reconstruction of {cdh_path} did not write {fout}_it<N>.hdr")
+    return max(images, key=lambda p: int(p[len(f"{fout}_it"):-len(".hdr")]))
+
+
+def main():
+    args = parse_args()
+    header, events = read_cdf(args.datafile)
+    os.makedirs(args.output_dir, exist_ok=True)
+    base = os.path.basename(args.datafile)[:-len(".cdh")]
+    print(f"[INFO] {args.datafile}: {len(events):,} events, {args.n_replicates} {args.method} replicates")
+
+    seeds = np.random.SeedSequence(args.seed).spawn(args.n_replicates)
+    moments = WelfordImage()
+    voxel_size = None
+    for k, seed in enumerate(seeds):
+        cdh_path = os.path.join(args.output_dir, f"{base}_{args.method}{k:03d}.cdh")
+        n = write_replicate(events, header, cdh_path, args.method, np.random.default_rng(seed), args.chunk_size)
+        print(f"[REPLICATE] {k + 1}/{args.n_replicates}: {n:,} events -> {cdh_path}")
+        if not args.recon:
+            continue
+
+        image_hdr = reconstruct(args, cdh_path)
+        image, voxel_size = read_interfile_image(image_hdr)
+        moments.update(image)
+        if args.remove_data:
+            os.remove(cdh_path[:-len(".cdh")] + ".cdf")
+
+    if args.recon and moments.n >= 2:
+        prefix = os.path.join(args.output_dir, f"{base}_{args.method}")
+        write_interfile_image(f"{prefix}_mean.hdr", moments.mean, voxel_size)
+        write_interfile_image(f"{prefix}_variance.hdr", moments.variance(), voxel_size)
+        print(f"[DONE] Mean and variance of {moments.n} replicate images: {prefix}_mean.hdr, "
+              f"{prefix}_variance.hdr")
+
+
+# ==============================================
+# Entry point
+# ==============================================
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Small readers/writers for the CASToR files used in this project:
+list-mode headers (.cdh), list-mode data (.cdf) and their time index,
+binary LUTs and Interfile images (.hdr/.img).
+"""
+
+import os
+import numpy as np
+
+
+def default_config_dir():
+    """
+    Folder of the CASToR scanner configurations (LUTs, .hscan): shipped inside
+    the installed package, or castor_reconstruction/castor_configs in the repository.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    for path in (os.path.join(here, "castor_configs"),
+                 os.path.join(here, "..", "castor_reconstruction", "castor_configs")):
+        if os.path.isdir(path):
+            return os.path.normpath(path)
+    return os.path.normpath(os.path.join(here, "..", "castor_reconstruction", "castor_configs"))
+
+
+CONFIG_DIR = default_config_dir()
+
+
+def default_cache_dir():
+    """Writable folder for derived tables (e.g. crystal efficiencies): $XDG_CACHE_HOME/lxepetsim."""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "lxepetsim")
+
+
+CACHE_DIR = default_cache_dir()
+
+
+# ==============================================
+# 1. List-mode header / data
+# ==============================================
+def read_cdh(cdh_path):
+    """Read a CASToR header into a {key: value-string} dict."""
+    header = {}
+    with open(cdh_path, "r") as f:
+        for line in f:
+            if ":" not in line:
+                continue
+            key, value = line.split(":", 1)
+            header[key.strip()] = value.strip()
+    return header
+
+
+def write_cdh(cdh_path, header):
+    """Write a {key: value} header (e.g. from read_cdh, with updated entries) back to a .cdh file."""
+    with open(cdh_path, "w") as f:
+        for key, value in header.items():
+            f.write(f"{key}: {value}\n")
+
+
+def cdf_event_dtype(header):
+    """
+    Build the numpy record dtype of one list-mode event from the header flags.
+    The field order follows the CASToR list-mode PET format.
+    """
+    fields = [("time", "<u4")]
+    if header.get("Attenuation correction flag", "0") == "1":
+        fields.append(("attenuation", "<f4"))
+    if header.get("Scatter correction flag", "0") == "1":
+        fields.append(("scatter", "<f4"))
+    if header.get("Random correction flag", "0") == "1":
+        fields.append(("random", "<f4"))
+    if header.get("Normalization correction flag", "0") == "1":
+        fields.append(("normalization", "<f4"))
+    if header.get("TOF information flag", "0") == "1":
+        fields.append(("tof", "<f4"))
+        if header.get("Per event TOF resolution flag", "0") == "1":
+            fields.append(("tof_resolution", "<f4"))
+    fields.append(("crystal1", "<u4"))
+    fields.append(("crystal2", "<u4"))
+    return np.dtype(fields)
+
+
+def resolve_cdf_path(cdh_path, header):
+    """
+    Return the .cdf path referenced by a header. Headers written on another
+    machine keep an absolute path, so fall back to the header's directory.
+    """
+    data_file = header["Data filename"]
+    if os.path.isfile(data_file):
+        return data_file
+    local = os.path.join(os.path.dirname(os.path.abspath(cdh_path)), os.path.basename(data_file))
+    if os.path.isfile(local):
+        return local
+    raise FileNotFoundError(f"Cannot find data file '{data_file}' referenced by {cdh_path}")
+
+
+def read_cdf(cdh_path, mode="r"):
+    """Memory-map the events of a list-mode dataset. Returns (header, events)."""
+    header = read_cdh(cdh_path)
+    cdf_path = resolve_cdf_path(cdh_path, header)
+    events = np.memmap(cdf_path, dtype=cdf_event_dtype(header), mode=mode)
+    n_header = int(header.get("Number of events", len(events)))
+    if n_header != len(events):
+        print(f"[WARN] Header announces {n_header} events, data file holds {len(events)}")
+    return header, events
+
+
+def time_index_path(cdf_path):
+    return cdf_path[:-len(".cdf")] + "_time_index.npz"
+
+
+def write_time_index(cdf_path, times_ms, start_ms, bin_ms=1000):
+    """
+    Write the sidecar time index of a time-ordered .cdf: offsets[k] is the
+    first event with time >= start_ms + k * bin_ms (the last entry is the
+    number of events).
+    """
+    times_ms = np.asarray(times_ms)
+    n_bins = max(1, int(np.ceil((int(times_ms[-1]) + 1 - start_ms) / bin_ms))) if len(times_ms) else 1
+    edges = start_ms + bin_ms * np.arange(n_bins + 1, dtype=np.int64)
+    offsets = np.searchsorted(times_ms, edges, side="left").astype(np.int64)
+    offsets[-1] = len(times_ms)
+    path = time_index_path(cdf_path)
+    np.savez(path, start_ms=start_ms, bin_ms=bin_ms, offsets=offsets)
+    return path
+
+
+def load_time_index(cdf_path):
+    """Returns (start_ms, bin_ms, offsets) of a .cdf, or None if it has no time index."""
+    path = time_index_path(cdf_path)
+    if not os.path.isfile(path):
+        return None
+    with np.load(path) as index:
+        return int(index["start_ms"]), int(index["bin_ms"]), index["offsets"]
+
+
+def event_range(events, t0_ms, t1_ms, index=None):
+    """
+    [first, last) event numbers with t0_ms <= time < t1_ms in a time-ordered
+    event array. With a time index only the events of the two boundary bins
+    are read.
+    """
+    def first_at(t_ms):
+        if index is None:
+            return int(np.searchsorted(events["time"], t_ms, side="left"))
+        start_ms, bin_ms, offsets = index
+        k = (t_ms - start_ms) // bin_ms
+        if k < 0:
+            return 0
+        if k >= len(offsets) - 1:
+            return int(offsets[-1])
+        lo, hi = int(offsets[k]), int(offsets[k + 1])
+        return lo + int(np.searchsorted(events["time"][lo:hi], t_ms, side="left"))
+
+    return first_at(t0_ms), first_at(t1_ms)
+
+
+# ==============================================
+# 2. Scanner LUT
+# ==============================================
+def load_binary_lut(lut_path):
+    """Load a float32 binary LUT as an (N, 6) array of x, y, z, vx, vy, vz."""
+    data = np.fromfile(lut_path, dtype=np.float32)
+    if len(data) % 6 != 0:
+        raise ValueError("The binary .lut file does not contain a multiple of 6 floats per crystal.")
+    return data.reshape((-1, 6))
+
+
+# ==============================================
+# 3. Interfile images
+# ==============================================
+def read_interfile_image(hdr_path):
+    """Read a CASToR Interfile image. Returns (image[z, y, x], voxel sizes (x, y, z) in mm)."""
+    shape = [0, 0, 0]
+    voxel_size = [1.0, 1.0, 1.0]
+    dtype = np.float32
+    byte_order = "<"
+    img_path = hdr_path.replace(".hdr", ".img")
+
+    with open(hdr_path, "r") as f:
+        for line in f:
+            if ":=" not in line:
+                continue
+            key, value = line.split(":=", 1)
+            key = key.strip().lstrip("!").lower()
+            value = value.strip()
+            for axis in range(3):
+                if key == f"matrix size [{axis + 1}]":
+                    shape[axis] = int(value)
+                elif key == f"scaling factor (mm/pixel) [{axis + 1}]":
+                    voxel_size[axis] = float(value)
+            if key == "number format":
+                fmt = value.lower()
+                if "short float" in fmt:
+                    dtype = np.float32
+                elif "long float" in fmt:
+                    dtype = np.float64
+                elif "signed integer" in fmt:
+                    dtype = np.int32
+                elif "unsigned integer" in fmt:
+                    dtype = np.uint32
+            elif key == "imagedata byte order":
+                byte_order = ">" if "big" in value.lower() else "<"
+            elif key == "name of data file":
+                img_path = os.path.join(os.path.dirname(os.path.abspath(hdr_path)), os.path.basename(value))
+
+    data = np.fromfile(img_path, dtype=np.dtype(dtype).newbyteorder(byte_order))
+    return data.reshape(shape[::-1]), voxel_size
+
+
+def write_interfile_image(hdr_path, image, voxel_size):
+    """Write an image[z, y, x] as a float32 little-endian Interfile pair readable by CASToR tools."""
+    img_path = hdr_path.replace(".hdr", ".img")
+    np.ascontiguousarray(image, dtype="<f4").tofile(img_path)
+    nz, ny, nx = image.shape
+    with open(hdr_path, "w") as f:
+        f.write("!INTERFILE :=\n")
+        f.write(f"!name of data file := {os.path.basename(img_path)}\n")
+        f.write("imagedata byte order := LITTLEENDIAN\n")
+        f.write("!number format := short float\n")
+        f.write("!number of bytes per pixel := 4\n")
+        f.write("number of dimensions := 3\n")
+        for axis, n in enumerate((nx, ny, nz)):
+            f.write(f"!matrix size [{axis + 1}] := {n}\n")
+        for axis, v in enumerate(voxel_size):
+            f.write(f"scaling factor (mm/pixel) [{axis + 1}] := {v}\n")
+        f.write("!END OF INTERFILE :=\n")
+    print(f"[IMG] Wrote image to: {hdr_path}")
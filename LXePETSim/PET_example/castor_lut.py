@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Generate the CASToR virtual-crystal LUT and scanner header of the Philips
+Vereos geometry (script version of generate_castor_virtual_crystal.ipynb,
+without building the OpenGATE simulation).
+
+Each physical crystal (19 x 4 x 4 mm) is split into virtual crystals; stacks
+are separated by 0.25 mm gaps. Written to the output folder:
+  <config>.lut / <config>_binary.lut : text and float32 LUT (x, y, z, ux, uy, uz)
+  <config>.hscan                     : scanner header
+  <scanner>.lut / <scanner>.hscan    : the same pair under the scanner name, as CASToR expects
+"""
+
+import os
+import argparse
+import numpy as np
+import pandas as pd
+
+if __package__:
+    from .castor_io import CONFIG_DIR
+else:  # run as a script from this folder
+    from castor_io import CONFIG_DIR
+
+
+# (virtual crystal size radial, tangential, axial in mm, scanner name) of the
+# LUT configurations used by coincidence_to_castor_data.py
+LUT_PRESETS = {
+    "original": ((19.0, 4.0, 4.0), "PET_PHILIPS_VEREOS"),
+    "fine": ((1.0, 2.0, 2.0), "PET_PHILIPS_VEREOS_FINE"),
+}
+CONFIG_NAMES = {
+    "original": "philips_vereos_virtual_crystals",
+    "fine": "philips_vereos_virtual_crystals_fine",
+    "super_fine": "philips_vereos_virtual_crystals_super_fine",
+}
+
+
+# ==============================================
+# 1. Command-line argument parsing
+# ==============================================
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate a CASToR virtual-crystal LUT of the Vereos.")
+    parser.add_argument("--config_option", type=str, default="original",
+                        choices=["original", "fine", "super_fine"],
+                        help="LUT configuration (sets the file names, and the sizes for original/fine).")
+    parser.add_argument("--virtual_size", type=float, nargs=3, default=None,
+                        help="Virtual crystal size (radial, tangential, axial) in mm; required for super_fine.")
+    parser.add_argument("--scanner_name", type=str, default=None,
+                        help="CASToR scanner name (default: from the configuration).")
+    parser.add_argument("--output_dir", type=str, default=CONFIG_DIR,
+                        help="Output folder.")
+    parser.add_argument("--crystal_center_r", type=float, default=391.5,
+                        help="Radius of the crystal centres in mm.")
+    parser.add_argument("--start_angle", type=float, default=190.0,
+                        help="Angle of the first module in degrees.")
+    parser.add_argument("--dry_run", action="store_true",
+                        help="Only print the numbers of virtual crystals.")
+    args = parser.parse_args()
+    preset = LUT_PRESETS.get(args.config_option)
+    if args.virtual_size is None:
+        if preset is None:
+            parser.error(f"--virtual_size is required for --config_option {args.config_option}")
+        args.virtual_size = preset[0]
+    if args.scanner_name is None:
+        args.scanner_name = preset[1] if preset else f"PET_PHILIPS_VEREOS_{args.config_option.upper()}"
+    return args
+
+
+# ==============================================
+# 2. Virtual crystals
+# ==============================================
+def virtual_crystal_lut(virtual_size_mm, crystal_size_mm=(19.0, 4.0, 4.0), crystal_center_r_mm=391.5,
+                        start_angle_deg=190.0, gap_stack_tangential_mm=0.25, gap_stack_axial_mm=0.25):
+    """
+    Positions and orientations of the virtual crystals, ordered axial, then
+    tangential, then radial (fastest). Returns (lut (N, 6), (n_radial, n_tangential, n_axial)).
+    """
+    # Geometry layout
+    n_modules = 18
+    n_stacks_tangential, n_stacks_axial = 4, 5
+    n_crystals_per_stack_tangential = 4 * 2  # dies x crystals per die
+    n_crystals_per_stack_axial = 4 * 2
+
+    split = [c / v for c, v in zip(crystal_size_mm, virtual_size_mm)]
+    if any(abs(s - round(s)) > 1e-9 for s in split):
+        raise ValueError(f"Crystal size {crystal_size_mm} is not a multiple of the virtual size {virtual_size_mm}")
+    n_virtual_radial, n_virtual_tangential, n_virtual_axial = (int(round(s)) for s in split)
+    virtual_radial, virtual_tangential, virtual_axial = virtual_size_mm
+
+    n_radial = n_virtual_radial
+    n_tangential = n_modules * n_stacks_tangential * n_crystals_per_stack_tangential * n_virtual_tangential
+    n_axial = n_stacks_axial * n_crystals_per_stack_axial * n_virtual_axial
+    delta_phi_deg = 360.0 / n_tangential
+
+    i_axial = np.arange(n_axial)
+    axial_gap = gap_stack_axial_mm * (i_axial // (n_virtual_axial * n_crystals_per_stack_axial))
+    z = ((i_axial + 0.5) * virtual_axial + axial_gap
+         - (n_axial * virtual_axial + gap_stack_axial_mm * (n_stacks_axial - 1)) / 2)
+
+    i_tangential = np.arange(n_tangential)
+    tangential_gap = gap_stack_tangential_mm * (i_tangential // (n_virtual_tangential * n_crystals_per_stack_tangential))
+    phi = np.radians(start_angle_deg + i_tangential * delta_phi_deg
+                     + (tangential_gap / (2 * np.pi * crystal_center_r_mm)) * 360.0)
+
+    r = crystal_center_r_mm - crystal_size_mm[0] / 2.0 + (np.arange(n_radial) + 0.5) * virtual_radial
+
+    zz, pp, rr = np.meshgrid(z, phi, r, indexing="ij")
+    x, y = rr * np.cos(pp), rr * np.sin(pp)
+    # orientation: towards the scanner axis
+    norm = np.hypot(x, y)
+    lut = np.stack([x, y, zz, -x / norm, -y / norm, np.zeros_like(x)], axis=-1).reshape(-1, 6)
+    return lut, (n_radial, n_tangential, n_axial)
+
+
+def write_hscan_header(output_path, scanner_name, num_radial, num_transaxial, num_axial, voxel_trans=400,
+                       voxel_axial=196, crystal_size_radial_mm=1.0, crystal_size_tangential_mm=2.0,
+                       crystal_size_axial_mm=2.0, scanner_radius_mm=391.5, axial_fov_mm=392, trans_fov_mm=800):
+    """Write the .hscan header for CASToR reconstruction."""
+    total_num = num_radial * num_transaxial * num_axial
+    with open(output_path, "w") as f:
+        f.write(f"scanner name: {scanner_name}\n")
+        f.write("modality: PET\n")
+        f.write(f"scanner radius: {scanner_radius_mm}\n")
+        f.write("number of layers: 1\n")
+        f.write(f"number of rings: {num_axial}\n")
+        f.write(f"number of elements: {total_num}\n")
+        f.write(f"number of crystals in layer: {total_num}\n")
+        f.write(f"crystals size depth: {crystal_size_radial_mm}\n")
+        f.write(f"crystals size trans: {crystal_size_tangential_mm}\n")
+        f.write(f"crystals size axial: {crystal_size_axial_mm}\n")
+        f.write("mean depth of interaction: -1\n")
+        f.write("min angle difference: 0\n")
+        f.write(f"field of view transaxial: {trans_fov_mm}\n")
+        f.write(f"field of view axial: {axial_fov_mm}\n")
+        f.write(f"voxels number transaxial: {voxel_trans}\n")
+        f.write(f"voxels number axial: {voxel_axial}\n")
+        f.write("description: Custom PET scanner with virtual crystals from OpenGATE sim\n")
+    print(f"[HSCAN] Header saved to: {output_path}")
+
+
+def main():
+    args = parse_args()
+    lut, (n_radial, n_tangential, n_axial) = virtual_crystal_lut(
+        args.virtual_size, crystal_center_r_mm=args.crystal_center_r, start_angle_deg=args.start_angle)
+    print(f"[Info] Virtual crystal size: {' x '.join(f'{v:g}' for v in args.virtual_size)} mm")
+    print(f"[Info] Total virtual crystals: radial={n_radial}, tangential={n_tangential}, axial={n_axial} "
+          f"-> {len(lut):,}")
+    if args.dry_run:
+        return
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    config_name = CONFIG_NAMES[args.config_option]
+    text_lut = os.path.join(args.output_dir, f"{config_name}.lut")
+    df = pd.DataFrame(lut, columns=["x", "y", "z", "u", "v", "w"])
+    df.insert(0, "id", np.arange(len(lut)))
+    df["w"] = 0
+    df.to_csv(text_lut, sep=" ", index=False, header=False)
+    print(f"[LUT] Saved {len(lut):,} virtual crystals to: {text_lut}")
+
+    binary = lut.astype(np.float32)
+    hscan = {"num_radial": n_radial, "num_transaxial": n_tangential, "num_axial": n_axial,
+             "crystal_size_radial_mm": args.virtual_size[0], "crystal_size_tangential_mm": args.virtual_size[1],
+             "crystal_size_axial_mm": args.virtual_size[2], "scanner_radius_mm": args.crystal_center_r}
+    for name in (f"{config_name}_binary", args.scanner_name):
+        binary.tofile(os.path.join(args.output_dir, f"{name}.lut"))
+        print(f"[LUT] Saved binary LUT to: {os.path.join(args.output_dir, f'{name}.lut')}")
+    for name in (config_name, args.scanner_name):
+        write_hscan_header(os.path.join(args.output_dir, f"{name}.hscan"), args.scanner_name, **hscan)
+
+
+# ==============================================
+# Entry point
+# ==============================================
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Unified command line of the PET_example scripts:
+
+  lxepet simulate ...          pet_sim_philips.py
+  lxepet sort ...              sim_to_coincidence.py
+  lxepet convert ...           coincidence_to_castor_data.py
+  lxepet lut castor ...        castor_lut.py
+  lxepet lut optical ...       optical_lut.py
+  lxepet recon ...             quick_osem_recon.py
+  lxepet analyze resolution    resolution_analysis.py
+  lxepet analyze necr          necr_curve.py
+  lxepet analyze physics       validate_physics_preset.py
+  lxepet bootstrap ...         bootstrap_replicates.py
+  lxepet frames ...            split_frames.py
+  lxepet sources ...           split_sources.py
+  lxepet pipeline ...          pipeline.py
+  lxepet sliced ...            sliced_acquisition.py
+  lxepet worker ...            sim_worker.py
+
+The remaining arguments are passed to the script ('lxepet sort --help' shows
+its options). A script module is only imported when its subcommand is run, so
+the post-processing commands never import opengate.
+"""
+
+import sys
+import importlib
+
+
+COMMANDS = {
+    "simulate": ("pet_sim_philips", "Simulate the Vereos scanner with OpenGATE."),
+    "sort": ("sim_to_coincidence", "Sort the singles into coincidences."),
+    "convert": ("coincidence_to_castor_data", "Convert coincidences to CASToR list-mode data."),
+    "lut": ({"castor": "castor_lut", "optical": "optical_lut"}, "Generate a look-up table."),
+    "recon": ("quick_osem_recon", "Quick list-mode OSEM reconstruction."),
+    "analyze": ({"resolution": "resolution_analysis", "necr": "necr_curve",
+                 "physics": "validate_physics_preset"}, "Analyze reconstructions or simulations."),
+    "bootstrap": ("bootstrap_replicates", "Resampled replicates of a dataset and their mean/variance images."),
+    "frames": ("split_frames", "Split a list-mode dataset into time frames."),
+    "sources": ("split_sources", "Split the coincidences of a multi-source run per source distance."),
+    "pipeline": ("pipeline", "Run the simulation-to-reconstruction chain with caching."),
+    "sliced": ("sliced_acquisition", "Time-sliced acquisition with overlapped post-processing."),
+    "worker": ("sim_worker", "Simulate a queue of short runs with one initialization per batch."),
+}
+
+
+def usage():
+    lines = ["usage: lxepet <command> [<subcommand>] [options]", "", "commands:"]
+    for name, (target, description) in COMMANDS.items():
+        if isinstance(target, dict):
+            name = f"{name} {{{','.join(target)}}}"
+        lines.append(f"  {name:<36}{description}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or argv[0] in ("-h", "--help"):
+        print(usage())
+        return 0
+    command, rest = argv[0], argv[1:]
+    if command not in COMMANDS:
+        print(f"lxepet: unknown command '{command}'\n\n{usage()}", file=sys.stderr)
+        return 2
+
+    target = COMMANDS[command][0]
+    prog = f"lxepet {command}"
+    if isinstance(target, dict):
+        if not rest or rest[0] not in target:
+            print(f"usage: {prog} {{{','.join(target)}}} [options]", file=sys.stderr)
+            return 2
+        prog = f"{prog} {rest[0]}"
+        target, rest = target[rest[0]], rest[1:]
+
+    if __package__:
+        module = importlib.import_module(f".{target}", __package__)
+    else:  # run as a script from this folder
+        module = importlib.import_module(target)
+    sys.argv = [prog, *rest]
+    return module.main()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
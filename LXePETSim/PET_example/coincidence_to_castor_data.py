@@ -2,18 +2,38 @@
 """
 Convert a single coincidence CSV file into a CASToR-compatible list-mode dataset (.cdf/.cdh).
 Automatically detects material and source distance from filename.
+
+Events are written in time order with their timestamp in ms (time of the
+first single), with the acquisition start and duration in the header. A
+sidecar time index (<name>_time_index.npz, first event of each time bin) lets
+split_frames.py cut frames without reading the whole file.
+
+Optionally, per-event correction factors are written with the events:
+  --randoms        : randoms rate of the LOR from the singles rates of its
+                     two crystals, 2*tau*S_i*S_j (counts/s), tau being the
+                     time window of sim_to_coincidence.py
+  --normalization  : 1 / (eps_i * eps_j) from a per-crystal efficiency table,
+                     computed once from a uniform-cylinder run and cached per LUT
+                     (in the user cache folder, castor_io.CACHE_DIR)
 """
 
 import os
 import re
 import glob
-import struct
+import hashlib
 import argparse
 import numpy as np
 import pandas as pd
-from tqdm import tqdm
+import uproot
 from scipy.spatial import cKDTree
 
+if __package__:
+    from .castor_io import CONFIG_DIR, CACHE_DIR, cdf_event_dtype, write_time_index
+    from .sim_to_coincidence import TIME_WINDOW
+else:  # run as a script from this folder
+    from castor_io import CONFIG_DIR, CACHE_DIR, cdf_event_dtype, write_time_index
+    from sim_to_coincidence import TIME_WINDOW
+
 
 # ==============================================
 # 1. Command-line argument parsing
@@ -29,27 +49,50 @@ def parse_args():
                         help="Material name (e.g. LYSO, LXe). If not provided, parsed from file name.")
     parser.add_argument("--source_dist", type=float, default=None,
                         help="Source distance (in cm). If not provided, parsed from file name.")
-    parser.add_argument("--input_dir", type=str, default="/Users/yuema/MyCode/LXePETSim/LXePETSim/PET_example/output_radius_plot",
+    parser.add_argument("--input_dir", type=str, default="output_radius_plot",
                         help="Directory containing input CSV coincidence files.")
-    parser.add_argument("--output_dir", type=str, default="/Users/yuema/MyCode/castor_v3.2/LXePET_Radius_Compare",
+    parser.add_argument("--output_dir", type=str, default="castor_data",
                         help="Directory to save .cdf/.cdh files.")
-    parser.add_argument("--config_path", type=str, default="/Users/yuema/MyCode/LXePETSim/LXePETSim/castor_reconstruction/castor_configs",
+    parser.add_argument("--config_path", type=str, default=CONFIG_DIR,
                         help="Path to the LUT configuration files.")
+    parser.add_argument("--randoms", action="store_true",
+                        help="Write the randoms-from-singles rate of each event (needs --singles).")
+    parser.add_argument("--singles", type=str, default=None,
+                        help="Glob pattern (in --input_dir) of the ROOT files holding the singles of the acquisition "
+                             "(default: output_*_<material>_src<dist>cm_*.root, which must match one file).")
+    parser.add_argument("--time_window", type=float, default=TIME_WINDOW,
+                        help="Coincidence time window tau of sim_to_coincidence.py in ns; the randoms rate "
+                             "uses 2*tau.")
+    parser.add_argument("--start_time", type=float, default=0.0,
+                        help="Acquisition start time in s (pet_sim_philips.py --time_start).")
+    parser.add_argument("--duration", type=float, default=None,
+                        help="Acquisition duration in s (default: time span of the singles with --randoms, "
+                             "else up to the last coincidence).")
+    parser.add_argument("--index_bin", type=float, default=1.0,
+                        help="Bin width of the time index in s.")
+    parser.add_argument("--normalization", action="store_true",
+                        help="Write the normalization factor of each event, from the cached crystal "
+                             "efficiencies of the LUT or from --normalization_run.")
+    parser.add_argument("--normalization_run", type=str, nargs="+", default=None,
+                        help="ROOT files of a uniform-cylinder run, to (re)compute the crystal efficiencies.")
+    parser.add_argument("--cache_dir", type=str, default=CACHE_DIR,
+                        help="Folder of the cached crystal efficiencies.")
     return parser.parse_args()
 
 
 # ==============================================
 # 2. Header writer
 # ==============================================
-def write_simple_text_cdh(output_path, data_file_name, num_events, config_name):
+def write_simple_text_cdh(output_path, data_file_name, num_events, config_name,
+                          duration=10, randoms=False, normalization=False, start_time=0):
     """Write CASToR header file (.cdh)."""
     with open(output_path, "w") as f:
         f.write(f"Data filename: {data_file_name}\n")
         f.write(f"Number of events: {num_events}\n")
         f.write("Data mode: list-mode\n")
         f.write("Data type: PET\n")
-        f.write("Start time (s): 0\n")
-        f.write("Duration (s): 10\n")
+        f.write(f"Start time (s): {start_time:g}\n")
+        f.write(f"Duration (s): {duration:g}\n")
 
         if "super_fine" in config_name:
             f.write("Scanner name: PET_PHILIPS_VEREOS_SUPER_FINE\n")
@@ -64,16 +107,91 @@ def write_simple_text_cdh(output_path, data_file_name, num_events, config_name):
         f.write("Isotope: F-18\n")
         f.write("TOF information flag: 0\n")
         f.write("Attenuation correction flag: 0\n")
-        f.write("Normalization correction flag: 0\n")
+        f.write(f"Normalization correction flag: {int(normalization)}\n")
         f.write("Scatter correction flag: 0\n")
-        f.write("Random correction flag: 0\n")
+        f.write(f"Random correction flag: {int(randoms)}\n")
         f.write("Maximum number of lines per event: 1\n")
 
     print(f"[CDH] Wrote header to: {output_path}")
 
 
 # ==============================================
-# 3. Main function
+# 3. Per-crystal singles and correction factors
+# ==============================================
+def crystal_singles(root_files, tree, n_crystals, chunk_size=2_000_000):
+    """
+    Singles counts per LUT crystal (nearest crystal to each single) over all
+    files, in one chunked pass. Returns (counts, time span in s).
+    """
+    counts = np.zeros(n_crystals)
+    t_min, t_max = np.inf, -np.inf
+    branches = ["GlobalTime", "PostPosition_X", "PostPosition_Y", "PostPosition_Z"]
+    for path in root_files:
+        with uproot.open(path) as f:
+            for chunk in f["Singles5"].iterate(branches, step_size=chunk_size, library="np"):
+                if len(chunk["GlobalTime"]) == 0:
+                    continue
+                pos = np.stack([chunk[b] for b in branches[1:]], axis=1)
+                _, idx = tree.query(pos)
+                counts += np.bincount(idx, minlength=n_crystals)
+                t_min = min(t_min, chunk["GlobalTime"].min())
+                t_max = max(t_max, chunk["GlobalTime"].max())
+    if not np.isfinite(t_min):
+        raise ValueError(f"No singles found in {root_files}")
+    return counts, (t_max - t_min) * 1e-9  # GlobalTime in ns
+
+
+def crystal_efficiency(counts, lut_xyz, module_period_deg=20.0):
+    """
+    Relative crystal efficiencies from the singles of a centered uniform
+    cylinder: the counts of each crystal divided by the mean of the crystals
+    with the same geometric illumination, i.e. the same axial position and
+    the same angular position within their module.
+    """
+    phi = np.mod(np.degrees(np.arctan2(lut_xyz[:, 1], lut_xyz[:, 0])), module_period_deg)
+    phi_key = np.mod(np.round(phi * 20.0), round(module_period_deg * 20.0)).astype(np.int64)
+    z_key = np.round(lut_xyz[:, 2] * 10.0).astype(np.int64)
+    _, group = np.unique(np.stack([phi_key, z_key], axis=1), axis=0, return_inverse=True)
+    group = group.ravel()
+    mean = np.bincount(group, weights=counts) / np.bincount(group)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        efficiency = np.where(mean[group] > 0, counts / mean[group], 0.0)
+    return efficiency
+
+
+def load_crystal_efficiency(config_lut, lut_xyz, tree, normalization_run, cache_dir):
+    """
+    Crystal efficiencies cached in cache_dir (the LUT folder may be read-only
+    package data), tagged with the LUT hash. Recomputed when a uniform-cylinder
+    run is given.
+    """
+    with open(config_lut, "rb") as f:
+        lut_hash = hashlib.sha1(f.read()).hexdigest()
+    cache = os.path.join(cache_dir, os.path.basename(config_lut).replace("_binary.lut", "_crystal_efficiency.npz"))
+
+    if normalization_run is None:
+        if not os.path.isfile(cache):
+            raise FileNotFoundError(f"No crystal efficiency table {cache}, give --normalization_run")
+        with np.load(cache) as table:
+            if str(table["lut_sha1"]) != lut_hash:
+                raise ValueError(f"{cache} was computed for another version of {config_lut}, "
+                                 f"recompute it with --normalization_run")
+            print(f"[NORM] Using cached crystal efficiencies: {cache}")
+            return table["efficiency"]
+
+    counts, _ = crystal_singles(normalization_run, tree, len(lut_xyz))
+    efficiency = crystal_efficiency(counts, lut_xyz)
+    os.makedirs(cache_dir, exist_ok=True)
+    np.savez(cache, efficiency=efficiency, counts=counts, lut_sha1=lut_hash,
+             runs=np.array([os.path.basename(p) for p in normalization_run]))
+    print(f"[NORM] {int(counts.sum()):,} singles, efficiency spread {efficiency[efficiency > 0].std():.3f} "
+          f"({np.count_nonzero(efficiency == 0)} dead crystals)")
+    print(f"[NORM] Saved crystal efficiencies to {cache}")
+    return efficiency
+
+
+# ==============================================
+# 4. Main function
 # ==============================================
 def main():
     args = parse_args()
@@ -139,6 +257,8 @@ def main():
     # Process the single coincidence file
     # ==============================================
     coinc_data = pd.read_csv(csv_path)
+    # time of the first single (ns); shards and thread files are not necessarily in time order
+    coinc_data = coinc_data.sort_values("time1", kind="stable", ignore_index=True)
     positions1 = coinc_data[["globalPosX1", "globalPosY1", "globalPosZ1"]].values
     positions2 = coinc_data[["globalPosX2", "globalPosY2", "globalPosZ2"]].values
 
@@ -149,18 +269,65 @@ def main():
     output_cdf = os.path.join(args.output_dir, f"{output_prefix}.cdf")
     output_cdh = os.path.join(args.output_dir, f"{output_prefix}.cdh")
 
-    # Write .cdf
-    with open(output_cdf, "wb") as f:
-        for i, (c1, c2) in enumerate(zip(idx1, idx2)):
-            data = struct.pack("<III", i, c1, c2)
-            f.write(data)
+    # ==============================================
+    # Correction factors
+    # ==============================================
+    time_ms = np.floor(coinc_data["time1"].values * 1e-6).astype(np.int64)
+    start_ms = int(round(args.start_time * 1000))
+    if len(time_ms) and time_ms[0] < start_ms:
+        raise ValueError(f"Coincidences at {time_ms[0] / 1000:g} s precede --start_time {args.start_time:g} s")
+    duration = args.duration
+    flags = {"Random correction flag": str(int(args.randoms)),
+             "Normalization correction flag": str(int(args.normalization))}
+    events = np.zeros(len(idx1), dtype=cdf_event_dtype(flags))
+    events["time"] = time_ms
+    events["crystal1"] = idx1
+    events["crystal2"] = idx2
+
+    if args.randoms:
+        # simulation outputs are named output_<phantom>_<material>_src<dist>cm_<N>.root
+        singles_pattern = args.singles or f"output_*_{material}_src{src_dist}cm_*.root"
+        singles_files = sorted(glob.glob(os.path.join(args.input_dir, singles_pattern)))
+        if not singles_files:
+            raise FileNotFoundError(f"No singles file matching '{singles_pattern}' in {args.input_dir}")
+        if args.singles is None and len(singles_files) > 1:
+            raise RuntimeError(f"Several acquisitions match '{singles_pattern}', give the singles of this one "
+                               f"with --singles:\n" + "\n".join(os.path.basename(p) for p in singles_files))
+        print(f"[RAND] Singles: {', '.join(os.path.basename(p) for p in singles_files)}")
+        counts, span = crystal_singles(singles_files, tree, len(lut_df))
+        # singles of the acquisition: their span is its duration
+        duration = duration or span
+        rates = counts / duration
+        # window of 2*tau, in s
+        events["random"] = 2 * args.time_window * 1e-9 * rates[idx1] * rates[idx2]
+        expected = events["random"].sum() * duration
+        print(f"[RAND] {int(counts.sum()):,} singles over {duration:.1f} s, "
+              f"expected randoms {expected:,.0f} ({expected / max(len(events), 1):.1%} of the prompts)")
+
+    if args.normalization:
+        efficiency = load_crystal_efficiency(config_lut, lut_df[["x", "y", "z"]].values, tree,
+                                             args.normalization_run, args.cache_dir)
+        eff_pair = efficiency[idx1] * efficiency[idx2]
+        # crystals without counts in the normalization run are left uncorrected
+        events["normalization"] = np.divide(1.0, eff_pair, out=np.ones(len(events)), where=eff_pair > 0)
+
+    if duration is None:
+        duration = (int(time_ms[-1]) + 1 - start_ms) / 1000.0 if len(time_ms) else 0.0
+        print(f"[WARN] No --duration: using {duration:g} s up to the last coincidence")
+
+    # Write .cdf and its time index
+    events.tofile(output_cdf)
+    index_path = write_time_index(output_cdf, time_ms, start_ms, max(1, int(round(args.index_bin * 1000))))
 
     num_events = len(idx1)
     print(f"[CDF] Wrote {num_events:,} events to {output_cdf}")
+    print(f"[CDF] Time index: {index_path}")
 
     # Write .cdh
     write_simple_text_cdh(output_cdh, data_file_name=output_cdf,
-                          num_events=num_events, config_name=config_name)
+                          num_events=num_events, config_name=config_name,
+                          duration=duration, randoms=args.randoms, normalization=args.normalization,
+                          start_time=args.start_time)
 
     print(f"[DONE] Generated:\n  {output_cdf}\n  {output_cdh}")
 
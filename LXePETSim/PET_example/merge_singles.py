@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Out-of-core time merge of singles coming from several threads or shards.
+Each input is cut into bounded chunks that are sorted and spilled to disk as
+sorted runs (inputs already time-ordered are used directly as runs), then the
+runs are merged block by block with a heap, giving one globally time-ordered
+stream of singles in constant memory.
+"""
+
+import os
+import heapq
+import tempfile
+import argparse
+import numpy as np
+import uproot
+
+if __package__:
+    from .pet_helpers import write_tree_chunk
+else:  # run as a script from this folder
+    from pet_helpers import write_tree_chunk
+
+
+SINGLES_BRANCHES = [
+    "GlobalTime",
+    "PostPosition_X",
+    "PostPosition_Y",
+    "PostPosition_Z",
+    "TotalEnergyDeposit",
+]
+OPTIONAL_BRANCHES = ["EventID", "RunID", "PreStepUniqueVolumeID",
+                     "EventPosition_X", "EventPosition_Y", "EventPosition_Z"]
+# string branches (PreStepUniqueVolumeID) are held as fixed-width bytes in the
+# sorted runs, which are plain record arrays
+STRING_WIDTH = 64
+
+
+# ==============================================
+# 1. Command-line argument parsing
+# ==============================================
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Merge singles from several ROOT files into one time-ordered tree."
+    )
+    parser.add_argument("--inputs", type=str, nargs="+", required=True,
+                        help="ROOT files holding the singles of one acquisition.")
+    parser.add_argument("--output", type=str, required=True,
+                        help="Output ROOT file.")
+    parser.add_argument("--tree", type=str, default="Singles5",
+                        help="Singles tree name.")
+    parser.add_argument("--chunk_size", type=int, default=2_000_000,
+                        help="Number of singles sorted in memory at once.")
+    parser.add_argument("--assume_sorted", action="store_true",
+                        help="Inputs are already time-ordered (one sorted run per file).")
+    parser.add_argument("--tmp_dir", type=str, default=None,
+                        help="Directory for the temporary sorted runs.")
+    return parser.parse_args()
+
+
+# ==============================================
+# 2. Sorted runs
+# ==============================================
+def singles_branches(files, tree_name):
+    """Branches read from every input: the singles branches, plus the truth branches all inputs have."""
+    branches = list(SINGLES_BRANCHES)
+    for b in OPTIONAL_BRANCHES:
+        if all(b in uproot.open(f)[tree_name].keys() for f in files):
+            branches.append(b)
+    return branches
+
+
+def to_records(chunk, branches):
+    dtype = [(b, f"S{STRING_WIDTH}" if chunk[b].dtype == object else chunk[b].dtype) for b in branches]
+    records = np.empty(len(chunk["GlobalTime"]), dtype=dtype)
+    for b in branches:
+        if chunk[b].dtype == object:
+            values = np.char.encode(chunk[b].astype(str))
+            if values.dtype.itemsize > STRING_WIDTH:
+                raise ValueError(f"{b} values longer than {STRING_WIDTH} characters")
+            records[b] = values
+        else:
+            records[b] = chunk[b]
+    return records
+
+
+def from_records(block):
+    """Dict of branches of a block of records, with the string branches decoded."""
+    return {name: np.char.decode(block[name]).astype(object) if block.dtype[name].kind == "S" else block[name]
+            for name in block.dtype.names}
+
+
+class RootRun:
+    """A time-ordered ROOT tree read lazily as a sorted run."""
+
+    def __init__(self, path, tree_name, branches):
+        self.tree = uproot.open(path)[tree_name]
+        self.branches = branches
+        self.size = self.tree.num_entries
+
+    def read(self, start, stop):
+        chunk = self.tree.arrays(self.branches, entry_start=start, entry_stop=stop, library="np")
+        return to_records(chunk, self.branches)
+
+
+class NpyRun:
+    """A sorted run spilled to disk, read through a memory map."""
+
+    def __init__(self, path):
+        self.data = np.load(path, mmap_mode="r")
+        self.size = len(self.data)
+
+    def read(self, start, stop):
+        return np.array(self.data[start:stop])
+
+
+def make_sorted_runs(files, tree_name, branches, chunk_size, tmp_dir):
+    """Sort every input in bounded chunks and spill each chunk to disk as a sorted run."""
+    runs = []
+    for path in files:
+        tree = uproot.open(path)[tree_name]
+        for chunk in tree.iterate(branches, step_size=chunk_size, library="np"):
+            records = to_records(chunk, branches)
+            records = records[np.argsort(records["GlobalTime"], kind="stable")]
+            run_path = os.path.join(tmp_dir, f"run{len(runs):05d}.npy")
+            np.save(run_path, records)
+            runs.append(NpyRun(run_path))
+        print(f"[SORT] {os.path.basename(path)}: {tree.num_entries:,} singles")
+    return runs
+
+
+# ==============================================
+# 3. Heap merge
+# ==============================================
+def merge_runs(runs, block_size):
+    """
+    Merge sorted runs into time-ordered blocks.
+
+    One block of each run is buffered. The heap is keyed on the last time of
+    each buffered block: everything up to the smallest of these times can be
+    emitted, since no run can still deliver an earlier single. The run that
+    owns the smallest key is then refilled.
+    """
+    position = [0] * len(runs)
+    buffers = [None] * len(runs)
+    heap = []
+
+    def refill(k):
+        start = position[k]
+        stop = min(start + block_size, runs[k].size)
+        position[k] = stop
+        block = runs[k].read(start, stop)
+        buffers[k] = block if buffers[k] is None else np.concatenate([buffers[k], block])
+        if stop < runs[k].size:
+            heapq.heappush(heap, (block["GlobalTime"][-1], k))
+
+    for k in range(len(runs)):
+        if runs[k].size:
+            refill(k)
+
+    while heap:
+        boundary, k = heapq.heappop(heap)
+        out = []
+        for i, buf in enumerate(buffers):
+            if buf is None or len(buf) == 0:
+                continue
+            n = np.searchsorted(buf["GlobalTime"], boundary, side="right")
+            out.append(buf[:n])
+            buffers[i] = buf[n:]
+        block = np.concatenate(out)
+        if len(block):
+            yield block[np.argsort(block["GlobalTime"], kind="stable")]
+        refill(k)
+
+    # all runs exhausted: flush what is left
+    rest = [b for b in buffers if b is not None and len(b)]
+    if rest:
+        block = np.concatenate(rest)
+        yield block[np.argsort(block["GlobalTime"], kind="stable")]
+
+
+def iterate_time_ordered(files, tree_name="Singles5", chunk_size=2_000_000,
+                         assume_sorted=False, tmp_dir=None):
+    """
+    Yield the singles of all input files as globally time-ordered blocks
+    (numpy record arrays, string branches as bytes: see from_records), using
+    bounded memory.
+    """
+    branches = singles_branches(files, tree_name)
+    if assume_sorted:
+        yield from merge_runs([RootRun(f, tree_name, branches) for f in files], chunk_size)
+        return
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as run_dir:
+        runs = make_sorted_runs(files, tree_name, branches, chunk_size, run_dir)
+        block_size = max(1, chunk_size // max(1, len(runs)))
+        yield from merge_runs(runs, block_size)
+
+
+def main():
+    args = parse_args()
+    n = 0
+    last_time = -np.inf
+    with uproot.recreate(args.output) as out:
+        for block in iterate_time_ordered(args.inputs, args.tree, args.chunk_size,
+                                          args.assume_sorted, args.tmp_dir):
+            if block["GlobalTime"][0] < last_time:
+                raise RuntimeError("Merged stream is not time-ordered; are the inputs really sorted?")
+            last_time = block["GlobalTime"][-1]
+            write_tree_chunk(out, args.tree, from_records(block))
+            n += len(block)
+    print(f"💾 Saved {n:,} time-ordered singles to {args.output}")
+
+
+# ==============================================
+# Entry point
+# ==============================================
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+Count-rate (NECR) curve from one or a few low-activity simulations.
+
+The singles of the input runs are re-timed offline to emulate higher
+activities: the decay time of each event (its first single) is remapped and
+its singles keep their offsets to it, so the event truth (EventID) and the
+ns time structure inside an event are preserved.
+  compress : decay times squeezed into 1/factor of the acquisition (any
+             factor >= 1), following the decay of the source over the
+             shorter interval (half-life unchanged)
+  overlay  : the acquisition is cut into 'factor' segments that are laid
+             on top of each other (integer factors), each segment being an
+             independent decay stream
+Several input runs (e.g. different seeds of the same setup) are overlaid as
+independent streams as well, so n runs give n times the activity at factor 1.
+
+At each level, singles of different events in the same readout volume
+(PreStepUniqueVolumeID cut at --pileup_level) within the pile-up window are discarded, coincidences are re-sorted and classified
+with the event truth: randoms (different events), scatters (same event, LOR
+farther than --scatter_distance from the source) and trues. The NECR is
+T^2 / (T + S + R).
+"""
+
+import argparse
+import numpy as np
+import pandas as pd
+import uproot
+
+
+BRANCHES = ["EventID", "GlobalTime", "PostPosition_X", "PostPosition_Y",
+            "PostPosition_Z", "TotalEnergyDeposit"]
+F18_HALF_LIFE = 6586.26  # s
+# PreStepUniqueVolumeID levels below each pile-up volume (module > stack > die > crystal)
+PILEUP_LEVELS = {"crystal": 0, "die": 1, "stack": 2, "module": 3}
+
+
+# ==============================================
+# 1. Command-line argument parsing
+# ==============================================
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Emulate higher activities from low-activity singles and compute the NECR curve."
+    )
+    parser.add_argument("--inputs", type=str, nargs="+", required=True,
+                        help="ROOT files with a Singles5 tree including EventID (same setup, independent runs).")
+    parser.add_argument("--factors", type=float, nargs="+", default=[1, 2, 5, 10, 20, 50, 100],
+                        help="Activity factors relative to the input runs.")
+    parser.add_argument("--method", type=str, default="compress", choices=["compress", "overlay"],
+                        help="Time remapping used to raise the activity.")
+    parser.add_argument("--time_range", type=float, nargs=2, default=None,
+                        help="Simulated acquisition interval of each run in s (default: span of the singles).")
+    parser.add_argument("--activity", type=float, default=None,
+                        help="Source activity of each run at t = 0 in Bq. The levels are then given in Bq "
+                             "(activity_Bq: mean activity over the emulated acquisition, all runs together).")
+    parser.add_argument("--half_life", type=float, default=F18_HALF_LIFE,
+                        help="Half-life of the source in s.")
+    parser.add_argument("--time_window", type=float, default=4.5,
+                        help="Coincidence window in ns (as sim_to_coincidence.py).")
+    parser.add_argument("--min_distance", type=float, default=20.0,
+                        help="Minimum distance between the two singles in mm (as sim_to_coincidence.py).")
+    parser.add_argument("--pileup_window", type=float, default=0.0,
+                        help="Singles of different events in the same readout cell closer than this (ns) "
+                             "are lost; 0 disables pile-up.")
+    parser.add_argument("--pileup_level", type=str, default="die", choices=list(PILEUP_LEVELS),
+                        help="Volume whose singles pile up (from PreStepUniqueVolumeID; die: 2x2 crystals).")
+    parser.add_argument("--source_position", type=float, nargs=3, default=[0.0, 0.0, 0.0],
+                        help="Source position in mm, for the scatter classification.")
+    parser.add_argument("--line_source", action="store_true",
+                        help="The source is a line along z through --source_position (NEMA NECR phantom).")
+    parser.add_argument("--scatter_distance", type=float, default=20.0,
+                        help="Same-event coincidences whose LOR passes farther than this from the source "
+                             "(mm) are counted as scatters.")
+    parser.add_argument("--output", type=str, default="necr_curve.csv",
+                        help="Output table (CSV).")
+    parser.add_argument("--plot", type=str, default=None,
+                        help="Save the count-rate curves to this file.")
+    args = parser.parse_args()
+    if min(args.factors) < 1:
+        parser.error("--factors must be >= 1")
+    if args.method == "overlay" and any(f != int(f) for f in args.factors):
+        parser.error("--method overlay requires integer --factors")
+    return args
+
+
+# ==============================================
+# 2. Input and time remapping
+# ==============================================
+def load_runs(paths, volume_id=False):
+    """
+    Concatenate the singles of all runs; each event gets a key unique across
+    runs. volume_id also reads PreStepUniqueVolumeID (pile-up).
+    """
+    branches = BRANCHES + (["PreStepUniqueVolumeID"] if volume_id else [])
+    runs = []
+    for k, path in enumerate(paths):
+        with uproot.open(path) as f:
+            tree = f["Singles5"]
+            missing = [b for b in branches if b not in tree.keys()]
+            if missing:
+                raise KeyError(f"{path}: Singles5 has no {missing} (EventID and PreStepUniqueVolumeID are "
+                               f"written by the lean, hits and debug output profiles)")
+            data = tree.arrays(branches, library="np")
+        data["run"] = np.full(len(data["GlobalTime"]), k, dtype=np.int64)
+        runs.append(data)
+        print(f"[INFO] {path}: {len(data['GlobalTime']):,} singles")
+    singles = {b: np.concatenate([r[b] for r in runs]) for b in runs[0]}
+    singles["event"] = singles["run"] * (int(singles["EventID"].max()) + 1) + singles["EventID"].astype(np.int64)
+    return singles
+
+
+def event_times(event, t):
+    """Time of the first single of each event, broadcast to all its singles."""
+    order = np.lexsort((t, event))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = event[order][1:] != event[order][:-1]
+    group = np.cumsum(first) - 1
+    t0 = np.empty(len(t))
+    t0[order] = t[order][first][group]
+    return t0
+
+
+def compress_decays(decay, factor, span, tau):
+    """
+    Map decay times over [0, span) to [0, span / factor), keeping the source
+    decay: the fraction of the run's decays before each time is mapped to the
+    time with the same fraction of the decays of the shorter interval.
+    Dividing by the factor would instead shorten the half-life by the factor.
+    """
+    fraction = np.expm1(-decay / tau) / np.expm1(-span / tau)
+    return -tau * np.log1p(fraction * np.expm1(-span / factor / tau))
+
+
+def remap_times(t, t_event, factor, t_start, span, method, tau):
+    """
+    New times of the singles at 'factor' times the (mean) activity, over
+    [0, span / factor). tau: mean life of the source, in ns as the times.
+    """
+    decay = t_event - t_start
+    if method == "compress":
+        new_decay = compress_decays(decay, factor, span, tau)
+    else:
+        # the overlaid segments decay with the source: their sum keeps its half-life
+        new_decay = np.mod(decay, span / factor)
+    return new_decay + (t - t_event)
+
+
+# ==============================================
+# 3. Pile-up and coincidence sorting (vectorized)
+# ==============================================
+def readout_cells(volume_ids, level):
+    """Index of the pile-up volume of each single: its crystal PreStepUniqueVolumeID cut at 'level'."""
+    names = pd.Series(volume_ids)
+    if PILEUP_LEVELS[level]:
+        names = names.str.rsplit("_", n=PILEUP_LEVELS[level]).str[0]
+    return pd.factorize(names)[0]
+
+
+def pileup_mask(t, cell, event, window):
+    """False for the singles sharing their cell with a single of another event within the window."""
+    order = np.lexsort((t, cell))
+    tc, cc, ec = t[order], cell[order], event[order]
+    close = (np.diff(tc) <= window) & (cc[1:] == cc[:-1]) & (ec[1:] != ec[:-1])
+    lost = np.zeros(len(t), dtype=bool)
+    lost[1:] |= close
+    lost[:-1] |= close
+    keep = np.ones(len(t), dtype=bool)
+    keep[order[lost]] = False
+    return keep
+
+
+def sort_coincidences(t, window):
+    """
+    Group time-ordered singles whose successive gaps are within the window.
+    Groups of exactly two singles are coincidences; larger groups (multiples)
+    are discarded. Returns the index pairs (i, j) and the number of multiples.
+    """
+    new_group = np.ones(len(t), dtype=bool)
+    new_group[1:] = np.diff(t) > window
+    starts = np.flatnonzero(new_group)
+    sizes = np.diff(np.append(starts, len(t)))
+    pairs = starts[sizes == 2]
+    return pairs, pairs + 1, int(np.count_nonzero(sizes > 2))
+
+
+def lor_distance(p1, p2, source, line_source):
+    """Distance (mm) from the source point, or from the z-line through it, to each LOR."""
+    if line_source:
+        p1, p2, source = p1[:, :2], p2[:, :2], source[:2]
+        d = p2 - p1
+        cross = d[:, 0] * (source[1] - p1[:, 1]) - d[:, 1] * (source[0] - p1[:, 0])
+        return np.abs(cross) / np.linalg.norm(d, axis=1)
+    d = p2 - p1
+    return np.linalg.norm(np.cross(d, source - p1), axis=1) / np.linalg.norm(d, axis=1)
+
+
+# ==============================================
+# 4. Count rates at each activity level
+# ==============================================
+def count_rates(singles, t, args, duration):
+    pos = np.stack([singles["PostPosition_X"], singles["PostPosition_Y"], singles["PostPosition_Z"]], axis=1)
+    event = singles["event"]
+    n_singles = len(t)
+
+    keep = np.ones(n_singles, dtype=bool)
+    if args.pileup_window > 0:
+        cells = readout_cells(singles["PreStepUniqueVolumeID"], args.pileup_level)
+        keep = pileup_mask(t, cells, event, args.pileup_window)
+    idx = np.flatnonzero(keep)
+    idx = idx[np.argsort(t[idx], kind="stable")]
+
+    i, j, n_multiples = sort_coincidences(t[idx], args.time_window)
+    i, j = idx[i], idx[j]
+    far = np.linalg.norm(pos[i] - pos[j], axis=1) > args.min_distance
+    i, j = i[far], j[far]
+
+    randoms = event[i] != event[j]
+    dist = lor_distance(pos[i], pos[j], np.asarray(args.source_position), args.line_source)
+    scatters = ~randoms & (dist > args.scatter_distance)
+    trues = ~randoms & ~scatters
+
+    T, S, R = (np.count_nonzero(m) / duration for m in (trues, scatters, randoms))
+    prompts = T + S + R
+    return {
+        "singles_rate": n_singles / duration,
+        "pileup_loss": 1.0 - keep.mean() if n_singles else 0.0,
+        "multiples_rate": n_multiples / duration,
+        "prompts_rate": prompts,
+        "trues_rate": T,
+        "scatters_rate": S,
+        "randoms_rate": R,
+        "scatter_fraction": S / (T + S) if T + S > 0 else np.nan,
+        "necr": T ** 2 / prompts if prompts > 0 else 0.0,
+    }
+
+
+def plot_curves(table, x, path):
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(7, 4.5))
+    for col, label in (("trues_rate", "Trues"), ("scatters_rate", "Scatters"),
+                       ("randoms_rate", "Randoms"), ("necr", "NECR")):
+        ax.plot(table[x], table[col] / 1000.0, "o-", label=label)
+    ax.set_xlabel("Activity [Bq]" if x == "activity_Bq" else "Relative activity")
+    ax.set_ylabel("Rate [kcps]")
+    ax.legend()
+    ax.grid(alpha=0.3)
+    fig.tight_layout()
+    fig.savefig(path, dpi=150)
+    print(f"📊 Saved count-rate curves to {path}")
+
+
+def main():
+    args = parse_args()
+    singles = load_runs(args.inputs, volume_id=args.pileup_window > 0)
+    t = singles["GlobalTime"]  # ns
+    if args.time_range is not None:
+        t_start, t_end = args.time_range[0] * 1e9, args.time_range[1] * 1e9
+    else:
+        t_start, t_end = float(t.min()), float(t.max())
+    span = t_end - t_start
+    n_runs = len(args.inputs)
+    t_event = event_times(singles["event"], t)
+
+    tau = args.half_life / np.log(2)
+    decays = None
+    if args.activity is not None:
+        decays = args.activity * tau * (np.exp(-t_start * 1e-9 / tau) - np.exp(-t_end * 1e-9 / tau))
+
+    rows = []
+    for factor in args.factors:
+        new_t = remap_times(t, t_event, factor, t_start, span, args.method, tau * 1e9)
+        duration = span / factor * 1e-9  # s
+        row = {"relative_activity": factor * n_runs}
+        if decays is not None:
+            # mean activity over the emulated acquisition (not the activity at t = 0)
+            row["activity_Bq"] = n_runs * decays / (span * 1e-9) * factor
+        row.update(count_rates(singles, new_t, args, duration))
+        rows.append(row)
+        print(f"[LEVEL] x{row['relative_activity']:g}: prompts {row['prompts_rate']:,.0f} cps, "
+              f"NECR {row['necr']:,.0f} cps, SF {row['scatter_fraction']:.3f}")
+
+    table = pd.DataFrame(rows)
+    table.to_csv(args.output, index=False, float_format="%.6g")
+    peak = table.loc[table["necr"].idxmax()]
+    x = "activity_Bq" if "activity_Bq" in table else "relative_activity"
+    print(f"Peak NECR {peak['necr']:,.0f} cps at {x} = {peak[x]:,.4g}")
+    print(f"💾 Saved count-rate table to {args.output}")
+    if args.plot:
+        plot_curves(table, x, args.plot)
+
+
+# ==============================================
+# Entry point
+# ==============================================
+if __name__ == "__main__":
+    main()
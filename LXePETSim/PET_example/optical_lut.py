@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Fast optical-response model for liquid-xenon detectors.
+
+A full-optics calibration run (scintillation photons tracked, see
+resource/XenonOpticalPhysics.cc) is used once to tabulate, as a function of
+the interaction position, the number of detected photons per MeV and the
+delay of the first detected photon. Production runs then skip optical
+transport (gamma-only speed) and redigitize_hits.py applies this table to
+every energy deposit (hit) before the readout, with the 'optical_lut'
+configuration key. Since the table is applied per deposit, it is built from
+the single-site calibration events only (all deposits in one table bin), for
+which the light and first-photon delay of the event are those of a deposit.
+
+The table is binned in cylindrical coordinates (r, phi, z) of the scanner,
+with phi folded over the module period so that all modules share it.
+
+  build : tabulate the response from a calibration run
+  show  : print a summary of a table
+"""
+
+import argparse
+import numpy as np
+import uproot
+from scipy.ndimage import distance_transform_edt
+
+
+CALIB_BRANCHES = ["EventID", "PostPosition_X", "PostPosition_Y", "PostPosition_Z",
+                  "TotalEnergyDeposit", "GlobalTime"]
+LUT_FIELDS = ["light_yield", "yield_spread", "delay_mean", "delay_sigma"]
+
+
+# ==============================================
+# 1. Command-line argument parsing
+# ==============================================
+def parse_args():
+    parser = argparse.ArgumentParser(description="LXe optical-response lookup table.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    b = sub.add_parser("build", help="Tabulate the optical response from a full-optics calibration run.")
+    b.add_argument("--input", type=str, required=True,
+                   help="Calibration ROOT file with a 'Hits' tree (energy deposits) and an "
+                        "'OpticalPhotons' tree (add_optical_calibration_recorder).")
+    b.add_argument("--output", type=str, default="lxe_optical_lut.npz",
+                   help="Output table (.npz).")
+    b.add_argument("--r_range", type=float, nargs=2, required=True,
+                   help="Inner and outer radius of the LXe volume in mm.")
+    b.add_argument("--z_range", type=float, nargs=2, required=True,
+                   help="Axial extent of the LXe volume in mm.")
+    b.add_argument("--phi_period", type=float, default=20.0,
+                   help="Angular period of the detector modules in degrees (360 for no folding).")
+    b.add_argument("--bins", type=int, nargs=3, default=[10, 10, 20],
+                   help="Number of (r, phi, z) bins.")
+    b.add_argument("--min_events", type=int, default=20,
+                   help="Bins with fewer calibration events are filled from their nearest neighbour.")
+
+    s = sub.add_parser("show", help="Print a summary of a table.")
+    s.add_argument("lut", type=str)
+    return parser.parse_args()
+
+
+# ==============================================
+# 2. Table lookup (used by redigitize_hits.py)
+# ==============================================
+def load_optical_lut(path):
+    with np.load(path) as f:
+        return {k: f[k] for k in f.files}
+
+
+def lut_bins(lut, x, y, z):
+    """Flat (r, phi, z) bin index of each position, clipped to the table."""
+    r = np.hypot(x, y)
+    phi = np.mod(np.degrees(np.arctan2(y, x)), float(lut["phi_period"]))
+    idx = []
+    for values, edges in ((r, lut["r_edges"]), (phi, lut["phi_edges"]), (z, lut["z_edges"])):
+        idx.append(np.clip(np.searchsorted(edges, values, side="right") - 1, 0, len(edges) - 2))
+    shape = tuple(len(lut[k]) - 1 for k in ("r_edges", "phi_edges", "z_edges"))
+    return np.ravel_multi_index(idx, shape)
+
+
+def hit_light(hits, lut, rng):
+    """
+    Optical response of each energy deposit, from the table at the hit
+    position: expected number of detected photons, relative gain spread and
+    first-photon time (hit time + tabulated delay). redigitize_hits.readout
+    sums the light and keeps the earliest photon of each single.
+    """
+    b = lut_bins(lut, hits["PostPosition_X"], hits["PostPosition_Y"], hits["PostPosition_Z"])
+    light = np.clip(hits["TotalEnergyDeposit"], 0.0, None) * lut["light_yield"].ravel()[b]
+    delay = lut["delay_mean"].ravel()[b] + lut["delay_sigma"].ravel()[b] * rng.standard_normal(len(b))
+    return light, lut["yield_spread"].ravel()[b], hits["GlobalTime"] + delay
+
+
+def optical_response(singles, lut, rng):
+    """
+    Replace the deposited energy of each single by the energy reconstructed
+    from its detected photons.
+
+    n ~ Poisson(Light * gain), Light being the expected photons summed over
+    the hits of the single and the gain spread (beyond photon statistics)
+    Gaussian with the light-weighted tabulated width; the energy is
+    n / light_yield at the single position, i.e. assuming a position-dependent
+    gain calibration with the readout position.
+    """
+    singles = dict(singles)
+    light = singles.pop("Light")
+    spread = singles.pop("LightSpread")
+    b = lut_bins(lut, singles["PostPosition_X"], singles["PostPosition_Y"], singles["PostPosition_Z"])
+    gain = np.clip(1.0 + spread * rng.standard_normal(len(light)), 0.0, None)
+    n = rng.poisson(light * gain)
+    singles["TotalEnergyDeposit"] = n / lut["light_yield"].ravel()[b]
+    return singles
+
+
+# ==============================================
+# 3. Build from a calibration run
+# ==============================================
+def calibration_events(path, lut):
+    """
+    One row per single-site calibration event (all deposits in the same bin
+    of the table): energy-weighted deposit position, total energy, first
+    deposit time, number of detected photons and first photon time.
+    Returns (events, number of multi-site events dropped).
+    """
+    with uproot.open(path) as f:
+        hits = f["Hits"].arrays(CALIB_BRANCHES, library="pd")
+        photons = f["OpticalPhotons"].arrays(["EventID", "GlobalTime"], library="pd")
+
+    hits = hits[hits["TotalEnergyDeposit"] > 0].copy()
+    hits["bin"] = lut_bins(lut, hits["PostPosition_X"].to_numpy(), hits["PostPosition_Y"].to_numpy(),
+                           hits["PostPosition_Z"].to_numpy())
+    for axis in "XYZ":
+        hits[f"w{axis}"] = hits[f"PostPosition_{axis}"] * hits["TotalEnergyDeposit"]
+    events = hits.groupby("EventID").agg(
+        energy=("TotalEnergyDeposit", "sum"),
+        wX=("wX", "sum"), wY=("wY", "sum"), wZ=("wZ", "sum"),
+        t0=("GlobalTime", "min"),
+        n_sites=("bin", "nunique"),
+    )
+    n_multi = int((events["n_sites"] > 1).sum())
+    events = events[events["n_sites"] == 1]
+    for axis in "XYZ":
+        events[axis.lower()] = events[f"w{axis}"] / events["energy"]
+
+    detected = photons.groupby("EventID")["GlobalTime"].agg(["size", "min"])
+    events["n_photons"] = detected["size"].reindex(events.index).fillna(0).to_numpy()
+    events["t1"] = detected["min"].reindex(events.index).to_numpy()
+    return events[["x", "y", "z", "energy", "t0", "n_photons", "t1"]].reset_index(), n_multi
+
+
+def fill_empty(values, empty):
+    """Copy into the empty bins the value of the nearest filled bin."""
+    if empty.all():
+        raise ValueError("No calibration bin has enough events")
+    nearest = distance_transform_edt(empty, return_distances=False, return_indices=True)
+    return values[tuple(nearest)]
+
+
+def build(args):
+    lut = {
+        "r_edges": np.linspace(*args.r_range, args.bins[0] + 1),
+        "phi_edges": np.linspace(0.0, args.phi_period, args.bins[1] + 1),
+        "z_edges": np.linspace(*args.z_range, args.bins[2] + 1),
+        "phi_period": np.float64(args.phi_period),
+    }
+    events, n_multi = calibration_events(args.input, lut)
+    print(f"[INFO] {len(events):,} single-site calibration events ({n_multi:,} multi-site dropped), "
+          f"{events['n_photons'].sum():,.0f} detected photons")
+    shape = tuple(args.bins)
+    b = lut_bins(lut, events["x"].to_numpy(), events["y"].to_numpy(), events["z"].to_numpy())
+    n_bins = int(np.prod(shape))
+
+    def per_bin(values, mask=None):
+        w = np.ones(len(values)) if mask is None else mask.astype(float)
+        v = np.where(w > 0, values, 0.0)
+        count = np.bincount(b, weights=w, minlength=n_bins)
+        mean = np.bincount(b, weights=v, minlength=n_bins) / np.maximum(count, 1)
+        var = np.bincount(b, weights=v ** 2, minlength=n_bins) / np.maximum(count, 1) - mean ** 2
+        return count, mean, np.sqrt(np.clip(var, 0.0, None))
+
+    energy = events["energy"].to_numpy()
+    n_photons = events["n_photons"].to_numpy()
+    count, light_yield, _ = per_bin(n_photons / energy)
+
+    # relative spread of the light yield beyond Poisson statistics
+    expected = energy * light_yield[b]
+    ok = expected > 0
+    rel = np.where(ok, n_photons / np.where(ok, expected, 1.0), 0.0)
+    _, _, rel_std = per_bin(rel, ok)
+    _, poisson_rel, _ = per_bin(np.where(ok, 1.0 / np.where(ok, expected, 1.0), 0.0), ok)
+    yield_spread = np.sqrt(np.clip(rel_std ** 2 - poisson_rel, 0.0, None))
+
+    seen = np.isfinite(events["t1"].to_numpy())
+    delay = np.where(seen, events["t1"].to_numpy() - events["t0"].to_numpy(), 0.0)
+    n_timed, delay_mean, delay_sigma = per_bin(delay, seen)
+
+    empty = ((count < args.min_events) | (n_timed < args.min_events) | (light_yield <= 0)).reshape(shape)
+    print(f"[INFO] {empty.sum()} / {n_bins} bins filled from their neighbours")
+    for name, values in zip(LUT_FIELDS, (light_yield, yield_spread, delay_mean, delay_sigma)):
+        lut[name] = fill_empty(values.reshape(shape), empty)
+    lut["n_events"] = count.reshape(shape)
+
+    np.savez(args.output, **lut)
+    print(f"💾 Saved optical response table to {args.output}")
+    show_lut(lut)
+
+
+def show_lut(lut):
+    print(f"Bins (r, phi, z): {lut['light_yield'].shape}, phi period {float(lut['phi_period'])} deg")
+    for name in LUT_FIELDS:
+        v = lut[name]
+        print(f"  {name:13s}: mean {v.mean():10.4g}  min {v.min():10.4g}  max {v.max():10.4g}")
+
+
+def main():
+    args = parse_args()
+    if args.command == "build":
+        build(args)
+    elif args.command == "show":
+        show_lut(load_optical_lut(args.lut))
+
+
+# ==============================================
+# Entry point
+# ==============================================
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,36 @@
-import opengate as gate
-import scipy
 import numpy as np
 import re
 
-from pathlib import Path
-import opengate.contrib.pet.philipsvereos as pet_vereos
-import opengate.contrib.phantoms.necr as phantom_necr
-
-
-def add_vereos_digitizer_v1(sim, pet, output):
+# opengate and scipy are imported by the functions that need them, so that
+# post-processing (e.g. the plotting helpers) does not initialize Geant4
+
+
+# Digitizer output profiles: which tiers are written to disk, and which
+# attributes are dropped from the final tier (all other tiers stay in memory only)
+#   lean  : only Singles5, with the branches read by sim_to_coincidence.py (+ EventID truth
+#           and the crystal PreStepUniqueVolumeID)
+#   hits  : lean + the Hits tree, needed by redigitize_hits.py
+#   debug : every tier with every attribute
+DIGITIZER_OUTPUT_PROFILES = {
+    "lean": {
+        "written": ["Singles5"],
+        "skip_attributes": ["LocalTime"],
+    },
+    "hits": {
+        "written": ["Hits", "Singles5"],
+        "skip_attributes": ["LocalTime"],
+    },
+    "debug": {
+        "written": ["Hits", "Singles1", "Singles2", "Singles3", "Singles4", "Singles5"],
+        "skip_attributes": [],
+    },
+}
+
+# Bytes per entry of the attributes a profile can drop (LocalTime: double)
+SKIPPABLE_ATTRIBUTE_BYTES = {"LocalTime": 8}
+
+
+def add_vereos_digitizer_v1(sim, pet, output, output_profile="lean", event_position=False, run_id=False):
     """
     add a  PET digitizer.
 
@@ -21,7 +43,20 @@ def add_vereos_digitizer_v1(sim, pet, output):
     - Module6: energy selection
 
     This is a simplified digitizer : no noise, no piles-up, no dead-time
+
+    output_profile selects the tiers written to disk (see DIGITIZER_OUTPUT_PROFILES).
+    event_position adds the primary vertex of the event (EventPosition) to every
+    tier, the source truth of multi-source runs (sim_to_coincidence.py --sources).
+    run_id adds the RunID to every tier, to split a multi-run simulation per
+    run interval (sim_worker.py).
     """
+    if output_profile not in DIGITIZER_OUTPUT_PROFILES:
+        raise ValueError(
+            f"Unknown output profile '{output_profile}', "
+            f"must be one of {list(DIGITIZER_OUTPUT_PROFILES)}"
+        )
+    profile = DIGITIZER_OUTPUT_PROFILES[output_profile]
+    import opengate as gate
 
     # units
     keV = gate.g4_units.keV
@@ -40,7 +75,13 @@ def add_vereos_digitizer_v1(sim, pet, output):
         "PreStepUniqueVolumeID",
         "GlobalTime",
         "LocalTime",
+        "EventID",  # needed to re-digitize the hits offline (redigitize_hits.py)
     ]
+    if event_position:
+        # the readout keeps the value of the last hit: all hits of a single share it
+        hc.attributes.append("EventPosition")
+    if run_id:
+        hc.attributes.append("RunID")
 
     # Readout
     module = sim.volume_manager.get_volume(f"{pet.name}_module")
@@ -81,6 +122,200 @@ def add_vereos_digitizer_v1(sim, pet, output):
     ew.output_filename = output
     ew.input_digi_collection = tb.name
     ew.channels = [{"name": ew.name, "min": 449.68 * keV, "max": 613.20 * keV}]
+    ew.skip_attributes = profile["skip_attributes"]
+
+    # intermediate tiers are still computed, but only kept in memory
+    for actor in [hc, sc, ea, eb, tb, ew]:
+        actor.root_output.write_to_disk = actor.name in profile["written"]
+
+
+def report_output_size(output_path, output_profile="lean"):
+    """
+    Print the size of each tree of a digitizer output file, and the data the
+    output profile did not write.
+
+    The unwritten tiers are not counted by Gate, but each one has at least as
+    many entries as Singles5 (every tier is a subset of the previous one), so
+    the saving is a lower bound: Singles5 entries x uncompressed bytes per
+    single for each tier kept in memory, plus the attributes skipped in Singles5.
+    """
+    import os
+    import uproot
+
+    profile = DIGITIZER_OUTPUT_PROFILES[output_profile]
+    with uproot.open(output_path) as f:
+        sizes = {
+            k.split(";")[0]: (f[k].num_entries, f[k].compressed_bytes, f[k].uncompressed_bytes)
+            for k in f.keys(cycle=False)
+            if f.classname_of(k) == "TTree"
+        }
+
+    size = os.path.getsize(output_path)
+    print(f"[OUTPUT] {output_path}: {size / 1e6:.2f} MB on disk")
+    for name, (n, b, _) in sizes.items():
+        print(f"  {name}: {n:,} entries, {b / 1e6:.2f} MB")
+
+    if "Singles5" not in sizes or sizes["Singles5"][0] == 0:
+        return None
+    n_singles, _, singles_bytes = sizes["Singles5"]
+    skipped = sum(SKIPPABLE_ATTRIBUTE_BYTES[a] for a in profile["skip_attributes"])
+    in_memory = [t for t in DIGITIZER_OUTPUT_PROFILES["debug"]["written"] if t not in profile["written"]]
+    saved = n_singles * skipped + len(in_memory) * (singles_bytes + n_singles * skipped)
+    print(f"[OUTPUT] Not written (profile '{output_profile}'): at least {saved / 1e6:.2f} MB uncompressed "
+          f"({', '.join(in_memory) or 'no tier'} kept in memory, {skipped} B per single of skipped attributes)")
+    return saved
+
+
+def write_tree_chunk(out, tree_name, chunk):
+    """
+    Append a dict of numpy arrays to a TTree of an uproot output file, creating
+    the tree on the first call. String branches (object arrays, e.g.
+    PreStepUniqueVolumeID) are written as ROOT strings.
+    """
+    import awkward as ak
+
+    if tree_name not in out:
+        out.mktree(tree_name, {k: "string" if v.dtype == object else v.dtype for k, v in chunk.items()})
+    if len(next(iter(chunk.values()))):
+        out[tree_name].extend({k: ak.Array(v.tolist()) if v.dtype == object else v for k, v in chunk.items()})
+
+
+# Physics presets (lengths in mm, energies in keV); validate_physics_preset.py
+# compares the singles of a "fast" run against a "detailed" one
+#   detailed : reference settings of pet_sim_philips.py
+#   fast     : standard EM option 0 (simpler multiple scattering), coarser cut
+#              in the phantom, electrons killed in the PET structure outside the
+#              crystals and particles entering the lead end shields killed
+PHYSICS_PRESETS = {
+    "detailed": {
+        "physics_list": "G4EmStandardPhysics_option3",
+        "world_cut": 1000.0,
+        "phantom_cut": 1.0,
+        "electron_kill_energy": None,
+        "kill_volumes": [],
+    },
+    "fast": {
+        "physics_list": "G4EmStandardPhysics",
+        "world_cut": 1000.0,
+        "phantom_cut": 5.0,
+        "electron_kill_energy": 1000.0,
+        "kill_volumes": ["endshielding1", "endshielding2"],
+    },
+}
+
+
+def set_physics_preset(sim, preset="detailed", pet=None, phantom=None):
+    """
+    Configure physics list, production cuts, user limits and kill volumes
+    from one of the PHYSICS_PRESETS. pet and phantom may be None (phase-space
+    record/replay runs).
+    """
+    if preset not in PHYSICS_PRESETS:
+        raise ValueError(f"Unknown physics preset '{preset}', must be one of {list(PHYSICS_PRESETS)}")
+    config = PHYSICS_PRESETS[preset]
+    import opengate as gate
+
+    mm = gate.g4_units.mm
+    keV = gate.g4_units.keV
+
+    pm = sim.physics_manager
+    pm.physics_list_name = config["physics_list"]
+    pm.enable_decay = True
+    pm.set_production_cut("world", "all", config["world_cut"] * mm)
+    if phantom is not None:
+        pm.set_production_cut(phantom.name, "all", config["phantom_cut"] * mm)
+
+    if pet is not None and config["electron_kill_energy"] is not None:
+        # user limits on electrons only (positrons must annihilate), in the PET
+        # region; the crystals get their own region, without limits
+        pm.user_limits_particles["all_charged"] = False
+        pm.set_user_limits_particles(["electron"])
+        pm.set_min_ekine(pet.name, config["electron_kill_energy"] * keV)
+        pm.set_production_cut(f"{pet.name}_crystal", "all", config["world_cut"] * mm)
+
+    if pet is not None:
+        for volume in config["kill_volumes"]:
+            kill = sim.add_actor("KillActor", f"kill_{volume}")
+            kill.attached_to = f"{pet.name}_{volume}"
+
+
+def add_phantom_phsp_recorder(sim, phantom, output):
+    """
+    Record the gammas leaving the phantom into a phase-space ROOT file.
+
+    The phase space is stored at the exiting step of the phantom container
+    (world coordinates) with the EventID and GlobalTime of each photon, so that
+    the replay can restore which photons come from the same decay and when.
+    """
+    phsp = sim.add_actor("PhaseSpaceActor", "PhantomPhaseSpace")
+    phsp.attached_to = phantom.name
+    phsp.output_filename = output
+    phsp.steps_to_store = "exiting"
+    phsp.attributes = [
+        "EventID",
+        "GlobalTime",
+        "KineticEnergy",
+        "PostPosition",
+        "PostDirection",
+        "PDGCode",
+        "Weight",
+    ]
+    f = sim.add_filter("ParticleFilter", "phsp_gamma_filter")
+    f.particle = "gamma"
+    phsp.filters.append(f)
+    return phsp
+
+
+def add_phsp_replay_source(sim, name, phsp_file):
+    """
+    Replay a phase-space chunk written by phase_space.py as the source of a
+    detector-only simulation.
+
+    Each entry is generated exactly once, in file order, as its own event
+    (the opengate phase-space source has no time information), so the replay
+    EventID is the entry index and phase_space.py restore_time can put back the
+    decay time of every single.
+    """
+    import uproot
+
+    with uproot.open(phsp_file) as f:
+        n_entries = f["PhaseSpace"].num_entries
+
+    source = sim.add_source("PhaseSpaceSource", name)
+    source.phsp_file = phsp_file
+    source.global_flag = True
+    source.position_key = "PostPosition"
+    source.direction_key = "PostDirection"
+    source.energy_key = "KineticEnergy"
+    source.weight_key = "Weight"
+    source.PDGCode_key = "PDGCode"
+    source.particle = ""
+    source.entry_start = 0
+    source.n = n_entries
+    return source
+
+
+def add_optical_calibration_recorder(sim, sensor, output):
+    """
+    Record the optical photons reaching the photosensors of a full-optics
+    LXe calibration run (G4OpticalPhysics enabled).
+
+    Together with the Hits tree of the detector digitizer, this is the input of
+    optical_lut.py build: one entry per detected photon with its EventID and
+    arrival time.
+    """
+    phsp = sim.add_actor("PhaseSpaceActor", "OpticalPhotons")
+    phsp.attached_to = sensor.name
+    phsp.output_filename = output
+    phsp.steps_to_store = "entering"
+    phsp.attributes = [
+        "EventID",
+        "GlobalTime",
+    ]
+    f = sim.add_filter("ParticleFilter", "optical_photon_filter")
+    f.particle = "opticalphoton"
+    phsp.filters.append(f)
+    return phsp
 
 
 def hello():
@@ -106,36 +341,108 @@ def tget(t, array_name):
     return t.arrays([array_name])[array_name]
 
 
-def plot_transaxial_position(ax, coinc, slice_time):
-    times = tget(coinc, "time1")
-    runID = tget(coinc, "runID")
-    gpx1 = tget(coinc, "globalPosX1")
-    gpx2 = tget(coinc, "globalPosX2")
-    gpy1 = tget(coinc, "globalPosY1")
-    gpy2 = tget(coinc, "globalPosY2")
-    # only consider coincidences  with time lower than time_slice
+# ----------------------------------------------------------------------
+# Density plotting backend: events are binned chunk by chunk into images,
+# so that plots of a full run stay fast and use bounded memory
+# ----------------------------------------------------------------------
+SCANNER_EXTENT = (-450.0, 450.0, -450.0, 450.0)  # mm, xmin xmax ymin ymax
+
+
+def iterate_arrays(t, names, step_size=1_000_000):
+    """
+    Chunks of the given branches as numpy arrays, from an uproot tree
+    or from a dict of arrays.
+    """
+    if hasattr(t, "iterate"):
+        yield from t.iterate(names, step_size=step_size, library="np")
+        return
+    n = len(t[names[0]])
+    for start in range(0, n, step_size):
+        yield {k: np.asarray(t[k][start : start + step_size]) for k in names}
+
+
+def bin_2d(image, x, y, extent, weights=None):
+    """Add points (x, y) into image[ix, iy] covering extent; points outside are dropped."""
+    nx, ny = image.shape
+    ix = np.floor((x - extent[0]) / (extent[1] - extent[0]) * nx).astype(np.int64)
+    iy = np.floor((y - extent[2]) / (extent[3] - extent[2]) * ny).astype(np.int64)
+    ok = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+    w = None if weights is None else weights[ok]
+    image += np.bincount(ix[ok] * ny + iy[ok], weights=w, minlength=nx * ny).reshape(nx, ny)
+
+
+def density_2d(t, pairs, bins=512, extent=SCANNER_EXTENT, selection=None, extra_branches=()):
+    """
+    2D histogram of the positions given by the (x branch, y branch) pairs,
+    accumulated over the whole tree chunk by chunk. 'selection' is an optional
+    function chunk -> boolean mask.
+    """
+    names = sorted({b for pair in pairs for b in pair} | set(extra_branches))
+    image = np.zeros((bins, bins))
+    for chunk in iterate_arrays(t, names):
+        mask = slice(None) if selection is None else selection(chunk)
+        for x_name, y_name in pairs:
+            bin_2d(image, chunk[x_name][mask], chunk[y_name][mask], extent)
+    return image
+
+
+def lor_sinogram(sinogram, x1, y1, x2, y2, s_max):
+    """
+    Accumulate transaxial LORs into a (phi, s) sinogram: phi in [0, pi) is the
+    line direction, s in [-s_max, s_max] its signed distance to the centre.
+    """
+    n_phi, n_s = sinogram.shape
+    phi = np.mod(np.arctan2(y2 - y1, x2 - x1), np.pi)
+    s = -x1 * np.sin(phi) + y1 * np.cos(phi)
+    ip = np.minimum((phi / np.pi * n_phi).astype(np.int64), n_phi - 1)
+    js = np.floor((s + s_max) / (2.0 * s_max) * n_s).astype(np.int64)
+    ok = (js >= 0) & (js < n_s)
+    sinogram += np.bincount(ip[ok] * n_s + js[ok], minlength=n_phi * n_s).reshape(n_phi, n_s)
+    return sinogram
+
+
+def backproject_sinogram(sinogram, s_max, bins=512, extent=SCANNER_EXTENT, radius=None):
+    """
+    Draw every sinogram line into an image (unfiltered backprojection): the
+    value of a pixel is proportional to the number of LORs crossing it.
+    Pixels farther than 'radius' from the centre (outside the detector ring,
+    where the LORs end) are left empty.
+    """
+    n_phi, n_s = sinogram.shape
+    x = extent[0] + (np.arange(bins) + 0.5) * (extent[1] - extent[0]) / bins
+    y = extent[2] + (np.arange(bins) + 0.5) * (extent[3] - extent[2]) / bins
+    X, Y = np.meshgrid(x, y, indexing="ij")
+    s_centers = -s_max + (np.arange(n_s) + 0.5) * 2.0 * s_max / n_s
+    image = np.zeros((bins, bins))
+    for i, phi in enumerate((np.arange(n_phi) + 0.5) * np.pi / n_phi):
+        if sinogram[i].any():
+            s = -X * np.sin(phi) + Y * np.cos(phi)
+            image += np.interp(s, s_centers, sinogram[i], left=0.0, right=0.0)
+    image[np.hypot(X, Y) > (s_max if radius is None else radius)] = 0.0
+    return image
+
+
+def show_density(ax, image, extent=SCANNER_EXTENT, cmap="viridis", log=True, alpha=1.0):
+    """Display an image from density_2d / backproject_sinogram, empty bins transparent."""
+    masked = np.ma.masked_less_equal(image.T, 0)
+    return ax.imshow(masked, origin="lower", extent=extent, cmap=cmap, alpha=alpha,
+                     norm="log" if log else None, interpolation="nearest")
+
+
+def plot_transaxial_position(ax, coinc, slice_time, bins=512, extent=SCANNER_EXTENT):
+    # density of all detection positions, before and after slice_time
     # (assuming 2 time slices only)
-    mask = times < slice_time
-    n = 1000  # restrict to the n first values
-    r0_gpx1 = gpx1[mask][:n]
-    r0_gpx2 = gpx2[mask][:n]
-    r0_gpy1 = gpy1[mask][:n]
-    r0_gpy2 = gpy2[mask][:n]
-    r0x = np.concatenate((r0_gpx1, r0_gpx2, r0_gpx1))
-    r0y = np.concatenate((r0_gpy1, r0_gpy2, r0_gpy1))
-    ax.scatter(r0x, r0y, s=1)
-    mask = times > slice_time
-    r1_gpx1 = gpx1[mask][:n]
-    r1_gpx2 = gpx2[mask][:n]
-    r1_gpy1 = gpy1[mask][:n]
-    r1_gpy2 = gpy2[mask][:n]
-    r1x = np.concatenate((r1_gpx1, r1_gpx2, r1_gpx1))
-    r1y = np.concatenate((r1_gpy1, r1_gpy2, r1_gpy1))
-    ax.scatter(r1x, r1y, s=1)
+    pairs = [("globalPosX1", "globalPosY1"), ("globalPosX2", "globalPosY2")]
+    before = density_2d(coinc, pairs, bins, extent, selection=lambda c: c["time1"] < slice_time,
+                        extra_branches=["time1"])
+    after = density_2d(coinc, pairs, bins, extent, selection=lambda c: c["time1"] > slice_time,
+                       extra_branches=["time1"])
+    show_density(ax, before, extent, cmap="Blues")
+    show_density(ax, after, extent, cmap="Oranges", alpha=0.7)
     ax.set_aspect("equal", adjustable="box")
     ax.set_xlabel("mm")
     ax.set_ylabel("mm")
-    ax.set_title("Transaxial detection position ({} first events only)".format(n))
+    ax.set_title("Transaxial detection position ({:,.0f} coincidences)".format((before.sum() + after.sum()) / 2))
 
 
 def plot_axial_detection(ax, coinc):
@@ -207,6 +514,8 @@ def get_decays(coinc):
 
 
 def plot_rad_decay(ax, end_time, decayO15, decayF18):
+    from scipy.optimize import curve_fit
+
     # histogram of decayO15
     bin_heights, bin_borders = np.histogram(
         np.array(decayO15), bins="auto", density=True
@@ -220,7 +529,7 @@ def plot_rad_decay(ax, end_time, decayO15, decayF18):
     def exponenial_func(x, a, b):
         return a * np.exp(-b * x)
 
-    popt, pcov = scipy.optimize.curve_fit(exponenial_func, bin_centers, bin_heights)
+    popt, pcov = curve_fit(exponenial_func, bin_centers, bin_heights)
     xx = np.linspace(0, int(end_time), int(end_time))
     yy = exponenial_func(xx, *popt)
     hl = np.log(2) / popt[1]
@@ -269,17 +578,27 @@ def plot_randoms_delays(ax, randoms, delays):
     ax.set_title("Randoms")
 
 
-def plot_LOR(ax, coinc, nb):
-    x1 = coinc.arrays()["globalPosX1"]
-    y1 = coinc.arrays()["globalPosY1"]
-    x2 = coinc.arrays()["globalPosX2"]
-    y2 = coinc.arrays()["globalPosY2"]
-    x1 = x1[0:nb]
-    y1 = y1[0:nb]
-    x2 = x2[0:nb]
-    y2 = y2[0:nb]
-    ax.plot([x1, x2], [y1, y2])
-    ax.autoscale()
+def plot_LOR(ax, coinc, nb=None, bins=512, extent=SCANNER_EXTENT):
+    # LOR density: the lines are binned into a fine sinogram chunk by chunk,
+    # then every sinogram line is drawn into the image (nb: optional limit on the number of LORs)
+    s_max = max(abs(v) for v in extent)
+    sinogram = np.zeros((2 * bins, bins))
+    n = 0
+    radius = 0.0
+    for chunk in iterate_arrays(coinc, ["globalPosX1", "globalPosY1", "globalPosX2", "globalPosY2"]):
+        if nb is not None:
+            chunk = {k: v[: nb - n] for k, v in chunk.items()}
+        x1, y1 = chunk["globalPosX1"], chunk["globalPosY1"]
+        x2, y2 = chunk["globalPosX2"], chunk["globalPosY2"]
+        lor_sinogram(sinogram, x1, y1, x2, y2, s_max)
+        if len(x1):
+            radius = max(radius, np.hypot(x1, y1).max(), np.hypot(x2, y2).max())
+        n += len(x1)
+        if nb is not None and n >= nb:
+            break
+    image = backproject_sinogram(sinogram, s_max, bins, extent, radius)
+    show_density(ax, image, extent, cmap="viridis")
+    ax.set_aspect("equal", adjustable="box")
     ax.set_xlabel("Position in mm")
     ax.set_ylabel("Poisition in mm")
-    ax.set_title("Lines of response (LOR)")
+    ax.set_title("Lines of response (LOR), {:,} lines".format(n))
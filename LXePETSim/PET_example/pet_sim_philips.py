@@ -2,18 +2,65 @@
 # -*- coding: utf-8 -*-
 
 import os
+import json
 import opengate as gate
 from pathlib import Path
 import opengate.contrib.pet.philipsvereos as pet_vereos
-from pet_helpers import add_vereos_digitizer_v1
 from opengate.geometry.utility import get_circular_repetition
 from opengate.sources.base import get_rad_yield
 import argparse
-from phantoms import (
-    add_multiple_hot_spheres_phantom,
-    add_simple_hot_point_phantom,
-    add_micro_derenzo_phantom,
-)
+
+if __package__:
+    from .pet_helpers import (
+        add_vereos_digitizer_v1,
+        report_output_size,
+        add_phantom_phsp_recorder,
+        add_phsp_replay_source,
+        set_physics_preset,
+    )
+    from .phantoms import (
+        add_multiple_hot_spheres_phantom,
+        add_simple_hot_point_phantom,
+        add_micro_derenzo_phantom,
+        add_uniform_cylinder_phantom,
+        add_radius_sweep_phantom,
+        radius_sweep_sources,
+        SOURCE_MODES,
+        VEREOS_ACCEPTANCE,
+    )
+else:  # run as a script from this folder
+    from pet_helpers import (
+        add_vereos_digitizer_v1,
+        report_output_size,
+        add_phantom_phsp_recorder,
+        add_phsp_replay_source,
+        set_physics_preset,
+    )
+    from phantoms import (
+        add_multiple_hot_spheres_phantom,
+        add_simple_hot_point_phantom,
+        add_micro_derenzo_phantom,
+        add_uniform_cylinder_phantom,
+        add_radius_sweep_phantom,
+        radius_sweep_sources,
+        SOURCE_MODES,
+        VEREOS_ACCEPTANCE,
+    )
+
+# Crystal material of the Vereos for each detector material name (--material),
+# the name used in the output files
+DETECTOR_MATERIALS = {"LYSO": "LYSO", "LXe": "G4_lXe"}
+
+# Phantoms of --phantom (the phantom name is also used in the output file names).
+# Only simple_hot_point uses --source_dist; uniform_cylinder is the
+# normalization run of coincidence_to_castor_data.py --normalization.
+PHANTOMS = {
+    "simple_hot_point": add_simple_hot_point_phantom,
+    "multiple_hot_spheres": add_multiple_hot_spheres_phantom,
+    "micro_derenzo": add_micro_derenzo_phantom,
+    "uniform_cylinder": add_uniform_cylinder_phantom,
+}
+
 
 # ----------------------------------------------------------------------
 # Utility function to create unique filenames with numbered suffix
@@ -31,18 +78,113 @@ def get_unique_filename(base_name, ext, outdir="."):
             return fpath, fname
         i += 1
 
-parser = argparse.ArgumentParser(description="Simulation parameter.")
-parser.add_argument(
-    "--source_dist",
-    type=float,
-    default=0.0,
-    help="Source distance to detector center in cm (e.g., 0.0, 25.0, 50.0)."
-)
-args = parser.parse_args()
 
-if __name__ == "__main__":
+def parse_args():
+    parser = argparse.ArgumentParser(description="Simulation parameter.")
+    parser.add_argument(
+        "--source_dist",
+        type=float,
+        default=0.0,
+        help="Source distance to detector center in cm (e.g., 0.0, 25.0, 50.0)."
+    )
+    parser.add_argument(
+        "--source_dists",
+        type=float,
+        nargs="+",
+        default=None,
+        help="Radius sweep: one tagged source per distance (cm) in a single run, instead of "
+             "--source_dist (see add_radius_sweep_phantom and split_sources.py)."
+    )
+    parser.add_argument(
+        "--phantom",
+        type=str,
+        default="simple_hot_point",
+        choices=list(PHANTOMS),
+        help="Phantom of the run (see phantoms.py); 'uniform_cylinder' is the normalization run."
+    )
+    parser.add_argument(
+        "--material",
+        type=str,
+        default="LYSO",
+        choices=list(DETECTOR_MATERIALS),
+        help="Crystal material of the detector, also used in the output file names."
+    )
+    parser.add_argument(
+        "--output_profile",
+        type=str,
+        default="lean",
+        choices=["lean", "hits", "debug"],
+        help="Digitizer tiers written to disk: 'lean' (Singles5 only), "
+             "'hits' (Hits + Singles5, for redigitize_hits.py) or 'debug' (all tiers)."
+    )
+    parser.add_argument(
+        "--physics_preset",
+        type=str,
+        default="detailed",
+        choices=["detailed", "fast"],
+        help="Physics settings (see PHYSICS_PRESETS in pet_helpers.py and validate_physics_preset.py)."
+    )
+    parser.add_argument(
+        "--time_start",
+        type=float,
+        default=0.0,
+        help="Start of the simulated acquisition interval in s (see sliced_acquisition.py)."
+    )
+    parser.add_argument(
+        "--time_end",
+        type=float,
+        default=1000.0,
+        help="End of the simulated acquisition interval in s."
+    )
+    parser.add_argument(
+        "--source_mode",
+        type=str,
+        default="positron",
+        choices=SOURCE_MODES,
+        help="'positron': F18 e+ transported by Geant4; 'back_to_back': 511 keV gamma pairs "
+             "emitted within the scanner acceptance (see add_f18_source in phantoms.py)."
+    )
+    parser.add_argument(
+        "--positron_range",
+        action="store_true",
+        help="Back-to-back mode: blur the emission points with the F18 positron range in water."
+    )
+    parser.add_argument(
+        "--full_solid_angle",
+        action="store_true",
+        help="Back-to-back mode: emit the pairs isotropically (no acceptance restriction)."
+    )
+    parser.add_argument(
+        "--phsp_mode",
+        type=str,
+        default="none",
+        choices=["none", "record", "replay"],
+        help="'record': simulate the phantom only and store the gammas leaving it; "
+             "'replay': detector-only simulation using a phase-space chunk as source."
+    )
+    parser.add_argument(
+        "--phsp_file",
+        type=str,
+        default=None,
+        help="Phase-space chunk to replay (see phase_space.py split)."
+    )
+    args = parser.parse_args()
+    if args.phsp_mode == "replay" and args.phsp_file is None:
+        parser.error("--phsp_mode replay requires --phsp_file")
+    if args.positron_range and args.source_mode != "back_to_back":
+        parser.error("--positron_range requires --source_mode back_to_back")
+    if args.source_dists is not None and args.phsp_mode != "none":
+        parser.error("--source_dists cannot be combined with --phsp_mode")
+    if args.source_dists is not None and args.phantom != "simple_hot_point":
+        parser.error("--source_dists replaces the phantom by the radius sweep; do not set --phantom")
+    return args
+
+
+def main():
+    args = parse_args()
     sim = gate.Simulation()
     source_dist = args.source_dist
+    phsp_mode = args.phsp_mode
 
     # ------------------------------------------------------------------
     # General options
@@ -73,12 +215,15 @@ if __name__ == "__main__":
     world.material = "G4_AIR"
 
     # ------------------------------------------------------------------
-    # Add the Philips Vereos PET
+    # Add the Philips Vereos PET (not needed to record the phantom phase space)
     # ------------------------------------------------------------------
-    pet = pet_vereos.add_pet(sim, "pet")
+    pet = None
+    if phsp_mode != "record":
+        pet = pet_vereos.add_pet(sim, "pet")
+        sim.volume_manager.get_volume("pet_crystal").material = DETECTOR_MATERIALS[args.material]
 
     # Simplified PET if visualization is enabled
-    if sim.visu:
+    if sim.visu and pet is not None:
         module = sim.volume_manager.get_volume("pet_module")
         translations_ring, rotations_ring = get_circular_repetition(
             2, [391.5 * mm, 0, 0], start_angle_deg=190, axis=[0, 0, 1]
@@ -89,17 +234,30 @@ if __name__ == "__main__":
     # ------------------------------------------------------------------
     # Phantom selection
     # ------------------------------------------------------------------
-    # Option 1: Multiple hot spheres
-    #phantom, sources = add_multiple_hot_spheres_phantom(sim, "multi_sphere")
-    #phantom_name = "multiple_hot_spheres"
-
-    # Option 2: Simple single hot sphere
-    phantom, sources = add_simple_hot_point_phantom(sim, "simple")
-    phantom_name = "simple_hot_point"
+    if phsp_mode == "replay":
+        # the phantom transport is already in the phase space:
+        # no phantom, the recorded gammas are the source
+        phantom = None
+        sources = [add_phsp_replay_source(sim, "phsp_replay", args.phsp_file)]
+        phantom_name = f"replay_{Path(args.phsp_file).stem}"
+    else:
+        source_options = {
+            "source_mode": args.source_mode,
+            "positron_range": args.positron_range,
+            "acceptance": None if args.full_solid_angle else VEREOS_ACCEPTANCE,
+        }
 
-    # Option 3: Micro-Derenzo phantom
-    # phantom, sources = add_micro_derenzo_phantom(sim, "micro_derenzo")
-    # phantom_name = "micro_derenzo"  # safer for filenames
+        if args.source_dists is not None:
+            # Radius sweep: all distances in one run, one tagged source each (--source_dists)
+            phantom, sources = add_radius_sweep_phantom(sim, "radius_sweep", args.source_dists, **source_options)
+            phantom_name = "radius_sweep"
+        elif args.phantom == "simple_hot_point":
+            phantom, sources = add_simple_hot_point_phantom(sim, "simple", source_dist=source_dist,
+                                                            **source_options)
+            phantom_name = args.phantom
+        else:
+            phantom, sources = PHANTOMS[args.phantom](sim, args.phantom, **source_options)
+            phantom_name = args.phantom
 
     print(f"\nUsing phantom: {phantom_name}")
     print(f"Total sources created: {len(sources)}")
@@ -113,7 +271,7 @@ if __name__ == "__main__":
     # ------------------------------------------------------------------
     # Reduce activity in visualization mode
     # ------------------------------------------------------------------
-    if sim.visu:
+    if sim.visu and phsp_mode != "replay":
         print("Visualization mode: reducing all activities by factor 100")
         for source in sources:
             source.activity = source.activity / 100
@@ -121,24 +279,37 @@ if __name__ == "__main__":
     # ------------------------------------------------------------------
     # Physics
     # ------------------------------------------------------------------
-    sim.physics_manager.physics_list_name = "G4EmStandardPhysics_option3"
-    sim.physics_manager.enable_decay = True
-    sim.physics_manager.set_production_cut("world", "all", 1 * m)
-    sim.physics_manager.set_production_cut(phantom.name, "all", 1 * mm)
+    set_physics_preset(sim, args.physics_preset, pet=pet, phantom=phantom)
 
     # ------------------------------------------------------------------
     # Output filenames (with automatic numbering)
     # ------------------------------------------------------------------
-    base_name = f"output_{phantom_name}_LYSO_src{source_dist}cm"
+    if phsp_mode == "record":
+        base_name = f"phsp_{phantom_name}_src{source_dist}cm"
+    elif args.source_dists is not None:
+        base_name = f"output_{phantom_name}_{args.material}"
+    else:
+        base_name = f"output_{phantom_name}_{args.material}_src{source_dist}cm"
     output_path, output_filename = get_unique_filename(base_name, ".root", sim.output_dir)
 
     stats_base = f"stats_{phantom_name}"
     stats_path, stats_filename = get_unique_filename(stats_base, ".txt", sim.output_dir)
 
     # ------------------------------------------------------------------
-    # Add PET digitizer
+    # Add PET digitizer (or the phantom phase-space recorder)
     # ------------------------------------------------------------------
-    add_vereos_digitizer_v1(sim, pet, output_filename)
+    if phsp_mode == "record":
+        add_phantom_phsp_recorder(sim, phantom, output_filename)
+    else:
+        add_vereos_digitizer_v1(sim, pet, output_filename, output_profile=args.output_profile,
+                                event_position=args.source_dists is not None)
+
+    # sourceID table of the radius sweep, read by sim_to_coincidence.py --sources
+    if args.source_dists is not None:
+        sources_path = output_path[:-len(".root")] + "_sources.json"
+        with open(sources_path, "w") as f:
+            json.dump(radius_sweep_sources(args.source_dists), f, indent=2)
+        print(f"Source table: {sources_path}")
 
     # Add simulation statistics actor
     stats = sim.add_actor("SimulationStatisticsActor", "Stats")
@@ -148,15 +319,23 @@ if __name__ == "__main__":
     # ------------------------------------------------------------------
     # Timing
     # ------------------------------------------------------------------
-    sim.run_timing_intervals = [[0, 1000.0 * sec]]
+    sim.run_timing_intervals = [[args.time_start * sec, args.time_end * sec]]
 
     # ------------------------------------------------------------------
     # Print simulation summary
     # ------------------------------------------------------------------
     print("\n=== Simulation Summary ===")
     print(f"Phantom: {phantom_name}")
+    if phsp_mode != "record":
+        print(f"Detector material: {args.material}")
+    print(f"Phase-space mode: {phsp_mode}")
+    print(f"Output profile: {args.output_profile}")
+    print(f"Physics preset: {args.physics_preset}")
+    print(f"Source mode: {args.source_mode}"
+          + (" + positron range" if args.positron_range else "")
+          + (" (full solid angle)" if args.full_solid_angle and args.source_mode == "back_to_back" else ""))
     print(f"Number of sources: {len(sources)}")
-    print(f"Simulation time: {sim.run_timing_intervals[0][1]/sec} seconds")
+    print(f"Simulation time: {sim.run_timing_intervals[0][0]/sec} - {sim.run_timing_intervals[0][1]/sec} seconds")
     print(f"Output file: {output_filename}")
     print(f"Stats file: {stats_filename}")
     print("=" * 30)
@@ -173,3 +352,9 @@ if __name__ == "__main__":
     print(f"Check outputs in: {sim.output_dir}")
     print(f"Stats: {stats_filename}")
     print(f"Data: {output_filename}")
+    if phsp_mode != "record":
+        report_output_size(output_path, args.output_profile)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,190 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import opengate as gate
-from opengate.sources.base import get_rad_yield
 import numpy as np
+from pathlib import Path
 
-def add_multiple_hot_spheres_phantom(sim, name="multi_sphere_phantom"):
+# opengate is imported by the phantom builders, so that the source constants
+# and acceptance_fraction can be used without it (e.g. by sim_worker.py --submit)
+
+
+# Source modes of the phantom builders
+#   positron     : e+ with the F18 beta spectrum, transported by Geant4 (reference)
+#   back_to_back : 511 keV gamma pairs emitted directly at the decay position,
+#                  optionally blurred by a positron-range kernel, and restricted
+#                  to the scanner acceptance (see add_f18_source)
+SOURCE_MODES = ["positron", "back_to_back"]
+
+# Detector acceptance used to restrict the back-to-back emission (mm):
+# inner face of the Vereos modules and half of their axial length
+VEREOS_ACCEPTANCE = {"radius": 382.0, "half_length": 82.0}
+
+# F18 positron range in water: the 3D annihilation density is
+#   sum_i w_i k_i^2 exp(-k_i r) / (4 pi r)
+# whose 1D projection is the bi-exponential sum_i w_i k_i / 2 exp(-k_i |x|).
+# Fitted to FWHM 0.102 mm, FWTM 1.03 mm and mean range 0.6 mm (Levin & Hoffman 1999).
+F18_WATER_POSITRON_RANGE = {"weights": [0.0824, 0.9176], "k": [35.86, 3.082]}  # k in 1/mm
+
+# Source distances (cm) of the radius study (auto_run_radius_sim.sh). In the
+# one-run sweep (add_radius_sweep_phantom) source k sits at the azimuth
+# k * 20 deg, a multiple of the Vereos module period: every source sees the
+# same detector geometry as a source on the x axis, and the sources are not
+# lined up behind each other.
+RADIUS_SWEEP_CM = [float(d) for d in range(16)]
+SWEEP_AZIMUTH_STEP_DEG = 20.0
+
+
+def acceptance_fraction(center, extent, acceptance):
+    """
+    Polar-angle range of the gamma pairs that can reach the scanner with both
+    photons, for a source of given center (mm) and extent (mm, largest distance
+    to its center). Returns (theta_min, theta_max) in rad and the accepted
+    fraction of the isotropic emission.
+
+    Both photons cross the inner radius at least (radius - rho) away from the
+    source, so pairs with |cot(theta)| > (half_length - |z|) / (radius - rho)
+    miss the crystals (unless scattered) and are not emitted.
+    """
+    rho = np.hypot(center[0], center[1]) + extent
+    z = max(abs(center[2]) - extent, 0.0)
+    if rho >= acceptance["radius"] or z >= acceptance["half_length"]:
+        raise ValueError(f"Source at {center} mm is outside the acceptance {acceptance}")
+    cot_max = (acceptance["half_length"] - z) / (acceptance["radius"] - rho)
+    # uniform in cos(theta): the accepted fraction is cos(theta_min)
+    fraction = cot_max / np.sqrt(1.0 + cot_max ** 2)
+    theta_min = np.arccos(fraction)
+    return theta_min, np.pi - theta_min, fraction
+
+
+def positron_range_image(shape, image_dir, voxel_size=0.1, n_samples=4_000_000,
+                         kernel=F18_WATER_POSITRON_RANGE, seed=0):
+    """
+    Annihilation-position image of a uniform source ('point', 'sphere' with
+    radius or 'cylinder' with radius and dz, along z; mm) blurred by the
+    positron-range kernel, sampled by Monte Carlo. The image (centered on the
+    source) is written once per shape and reused. Returns its path.
+    """
+    import itk
+
+    key = "_".join(f"{k}{v:g}" if not isinstance(v, str) else v for k, v in sorted(shape.items()))
+    path = Path(image_dir) / f"positron_range_{key}_vox{voxel_size:g}mm.mhd"
+    if path.exists():
+        return str(path)
+
+    rng = np.random.default_rng(seed)
+    # decay positions
+    if shape["type"] == "point":
+        xyz = np.zeros((n_samples, 3))
+        half = np.zeros(3)
+    elif shape["type"] == "sphere":
+        u = rng.normal(size=(n_samples, 3))
+        u /= np.linalg.norm(u, axis=1)[:, None]
+        xyz = u * shape["radius"] * np.cbrt(rng.random(n_samples))[:, None]
+        half = np.full(3, shape["radius"])
+    elif shape["type"] == "cylinder":
+        r = shape["radius"] * np.sqrt(rng.random(n_samples))
+        phi = rng.uniform(0, 2 * np.pi, n_samples)
+        xyz = np.stack([r * np.cos(phi), r * np.sin(phi), rng.uniform(-shape["dz"], shape["dz"], n_samples)], axis=1)
+        half = np.array([shape["radius"], shape["radius"], shape["dz"]])
+    else:
+        raise ValueError(f"Unknown source shape '{shape['type']}'")
+
+    # the radial pdf of each kernel component, r exp(-k r), is a Gamma(2, 1/k)
+    component = rng.choice(len(kernel["k"]), size=n_samples, p=kernel["weights"])
+    r = rng.gamma(2.0, 1.0 / np.asarray(kernel["k"])[component])
+    u = rng.normal(size=(n_samples, 3))
+    xyz += u / np.linalg.norm(u, axis=1)[:, None] * r[:, None]
+
+    # 3 mm margin: beyond it lies ~0.1 % of the F18 annihilations in water
+    n = 2 * np.ceil((half + 3.0) / voxel_size).astype(int) + 1
+    edges = [(np.arange(m + 1) - m / 2.0) * voxel_size for m in n]
+    counts, _ = np.histogramdd(xyz, bins=edges)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # itk arrays are indexed [z, y, x]
+    image = itk.image_from_array(np.ascontiguousarray(counts.transpose(2, 1, 0), dtype=np.float32))
+    image.SetSpacing([voxel_size] * 3)
+    itk.imwrite(image, str(path))
+    return str(path)
+
+
+def add_f18_source(sim, name, shape, translation, center, activity, attached_to=None,
+                   source_mode="positron", positron_range=False, acceptance=VEREOS_ACCEPTANCE):
+    """
+    Add the F18 source of one phantom element.
+
+    shape: {'type': 'point' | 'sphere' | 'cylinder', 'radius', 'dz'} (lengths in G4 units),
+    translation: position in the mother volume ('attached_to' or the world),
+    center: position in world coordinates, used for the acceptance,
+    activity: decay activity (the positron yield is applied here).
+
+    In 'back_to_back' mode with an acceptance, only the pairs emitted within
+    the polar-angle range that can reach the detector are generated, at the
+    accepted fraction of the pair rate: the number and time structure of the
+    detected coincidences are those of the full isotropic source (except for
+    pairs scattering into the detector from outside the range).
+    """
+    import opengate as gate
+    from opengate.sources.base import get_rad_yield
+
+    mm = gate.g4_units.mm
+    rad = gate.g4_units.rad
+    sec = gate.g4_units.s
+    if source_mode not in SOURCE_MODES:
+        raise ValueError(f"Unknown source mode '{source_mode}', must be one of {SOURCE_MODES}")
+    if positron_range and source_mode != "back_to_back":
+        raise ValueError("The positron-range blur only applies to the 'back_to_back' source mode")
+    total_yield = get_rad_yield("F18")
+
+    if source_mode == "positron":
+        source = sim.add_source("GenericSource", name)
+        source.particle = "e+"
+        source.energy.type = "F18"
+        fraction = 1.0
+    else:
+        shape_mm = {k: v / mm if k != "type" else v for k, v in shape.items()}
+        if positron_range:
+            source = sim.add_source("VoxelSource", name)
+            source.image = positron_range_image(shape_mm, Path(sim.output_dir) / "source_images")
+        else:
+            source = sim.add_source("GenericSource", name)
+        source.particle = "back_to_back"  # energy forced to 511 keV
+
+        fraction = 1.0
+        if acceptance is not None:
+            extent = max(shape_mm.get("radius", 0.0), shape_mm.get("dz", 0.0))
+            if positron_range:
+                extent += 3.0
+            theta_min, theta_max, fraction = acceptance_fraction(np.asarray(center) / mm, extent, acceptance)
+            source.direction.type = "iso"
+            source.direction.theta = [theta_min * rad, theta_max * rad]
+
+    if attached_to is not None:
+        source.attached_to = attached_to
+    source.position.translation = translation
+    if source_mode == "positron" or not positron_range:
+        source.position.type = shape["type"]
+        if shape["type"] != "point":
+            source.position.radius = shape["radius"]
+        if shape["type"] == "cylinder":
+            source.position.dz = shape["dz"]
+    source.activity = activity * total_yield * fraction
+    source.half_life = 6586.26 * sec  # F18 half-life
+    if fraction < 1.0:
+        print(f"  {name}: emission restricted to theta in [{np.degrees(theta_min):.1f}, "
+              f"{np.degrees(theta_max):.1f}] deg, accepted fraction {fraction:.4f}")
+    return source
+
+
+def add_multiple_hot_spheres_phantom(sim, name="multi_sphere_phantom", source_mode="positron",
+                                     positron_range=False, acceptance=VEREOS_ACCEPTANCE):
     """
     Add a phantom with multiple hot spheres at different positions and sizes
     for comprehensive PET system evaluation
+    (source_mode, positron_range, acceptance: see add_f18_source)
     """
+    import opengate as gate
+
     # units
     mm = gate.g4_units.mm
     cm = gate.g4_units.cm
@@ -79,7 +254,6 @@ def add_multiple_hot_spheres_phantom(sim, name="multi_sphere_phantom"):
 
     # Create spheres and sources
     sources = []
-    total_yield = get_rad_yield("F18")
     
     print(f"Creating {len(sphere_configs)} hot spheres:")
     
@@ -93,15 +267,12 @@ def add_multiple_hot_spheres_phantom(sim, name="multi_sphere_phantom"):
         sphere.color = config["color"]
         
         # Create corresponding source
-        source = sim.add_source("GenericSource", f"{config['name']}_source")
-        source.particle = "e+"
-        source.energy.type = "F18"
-        source.position.type = "sphere"
-        source.position.translation = config["position"]
         # must set radius for the source, otherwise it defaults to 0 and acts like a point source
-        source.position.radius = sphere.rmax
-        source.activity = config["activity"] * total_yield
-        source.half_life = 6586.26 * sec  # F18 half-life
+        source = add_f18_source(
+            sim, f"{config['name']}_source", {"type": "sphere", "radius": sphere.rmax},
+            translation=config["position"], center=config["position"], activity=config["activity"],
+            source_mode=source_mode, positron_range=positron_range, acceptance=acceptance,
+        )
         
         sources.append(source)
         
@@ -114,10 +285,14 @@ def add_multiple_hot_spheres_phantom(sim, name="multi_sphere_phantom"):
     return waterbox, sources
 
 
-def add_simple_hot_point_phantom(sim, name="simple_point", source_dist=0.0):
+def add_simple_hot_point_phantom(sim, name="simple_point", source_dist=0.0, source_mode="positron",
+                                 positron_range=False, acceptance=VEREOS_ACCEPTANCE):
     """
     Simple single hot sphere phantom (your original design)
+    (source_mode, positron_range, acceptance: see add_f18_source)
     """
+    import opengate as gate
+
     # units
     mm = gate.g4_units.mm
     cm = gate.g4_units.cm
@@ -141,26 +316,128 @@ def add_simple_hot_point_phantom(sim, name="simple_point", source_dist=0.0):
     hot_sphere.color = [1, 0, 0, 0.6]  # red semi-transparent
 
     # ---- positron source ----
-    source = sim.add_source("GenericSource", f"{name}_source")
-    total_yield = get_rad_yield("F18")
-    source.attached_to = hot_sphere.name  # attach to the small water sphere
-    source.particle = "e+"
-    source.energy.type = "F18"
-    source.position.type = "point"
-    source.position.translation = [0, 0, 0]  # centered inside the sphere
-    source.activity = 1e4 * Bq * total_yield
-    source.half_life = 6586.26 * sec
+    # attached to the small water sphere, centered inside it
+    source = add_f18_source(
+        sim, f"{name}_source", {"type": "point"}, translation=[0, 0, 0],
+        center=hot_sphere.translation, activity=1e4 * Bq, attached_to=hot_sphere.name,
+        source_mode=source_mode, positron_range=positron_range, acceptance=acceptance,
+    )
 
     return waterbox, [source]
 
+def radius_sweep_sources(source_dists=RADIUS_SWEEP_CM, sphere_radius_mm=3.0):
+    """
+    sourceID table of the radius sweep: one entry per distance with its
+    azimuth and world position (mm), as written next to the simulation output
+    for sim_to_coincidence.py --sources and split_sources.py.
+    """
+    table = []
+    for k, dist in enumerate(source_dists):
+        azimuth = (k * SWEEP_AZIMUTH_STEP_DEG) % 360.0
+        position = [float(10.0 * dist * np.cos(np.radians(azimuth))),
+                    float(10.0 * dist * np.sin(np.radians(azimuth))), 0.0]
+        table.append({"sourceID": k, "source_dist_cm": float(dist), "azimuth_deg": azimuth,
+                      "position_mm": position})
+    positions = np.array([t["position_mm"] for t in table])
+    gaps = np.linalg.norm(positions[:, None] - positions[None], axis=-1)[np.triu_indices(len(table), 1)]
+    if len(gaps) and gaps.min() <= 2 * sphere_radius_mm:
+        raise ValueError(f"Radius-sweep spheres overlap (closest sources {gaps.min():.1f} mm apart)")
+    return table
+
+
+def add_radius_sweep_phantom(sim, name="radius_sweep", source_dists=RADIUS_SWEEP_CM, activity_bq=1e4,
+                             source_mode="positron", positron_range=False, acceptance=VEREOS_ACCEPTANCE):
+    """
+    All the source distances of the radius study in one run: one hot sphere
+    and point source per distance, as in add_simple_hot_point_phantom, placed
+    as in radius_sweep_sources(). Source k is '<name>_source<k>'; the events
+    are tagged afterwards from their primary vertex (digitizer event_position,
+    sim_to_coincidence.py --sources).
+    activity_bq is the total activity, shared by the sources, so that the
+    scanner sees the singles rate (randoms, pile-up, dead time) of one
+    per-distance run. Each source then gets 1/len(source_dists) of the
+    counts of a per-distance run of the same duration.
+    (source_mode, positron_range, acceptance: see add_f18_source)
+    """
+    import opengate as gate
+
+    mm = gate.g4_units.mm
+    cm = gate.g4_units.cm
+    Bq = gate.g4_units.Bq
+
+    table = radius_sweep_sources(source_dists)
+    half_size = max(20.0, max(source_dists) + 1.0)
+    waterbox = sim.add_volume("Box", f"{name}_waterbox")
+    waterbox.size = [2 * half_size * cm] * 3
+    waterbox.translation = [0 * cm, 0 * cm, 0 * cm]
+    waterbox.material = "G4_AIR"
+    waterbox.color = [0, 0, 1, 0.5]
+
+    source_activity = activity_bq / len(table)
+    sources = []
+    print(f"Creating {len(table)} radius-sweep sources ({source_activity:g} Bq each):")
+    for entry in table:
+        k = entry["sourceID"]
+        hot_sphere = sim.add_volume("Sphere", f"{name}_hot_sphere{k}")
+        hot_sphere.rmin = 0 * mm
+        hot_sphere.rmax = 3 * mm
+        hot_sphere.translation = [v * mm for v in entry["position_mm"]]
+        hot_sphere.material = "G4_WATER"
+        hot_sphere.mother = waterbox.name
+        hot_sphere.color = [1, 0, 0, 0.6]
+
+        sources.append(add_f18_source(
+            sim, f"{name}_source{k}", {"type": "point"}, translation=[0, 0, 0],
+            center=hot_sphere.translation, activity=source_activity * Bq, attached_to=hot_sphere.name,
+            source_mode=source_mode, positron_range=positron_range, acceptance=acceptance,
+        ))
+        print(f"  sourceID {k}: {entry['source_dist_cm']:.1f} cm at {entry['azimuth_deg']:.0f} deg")
+
+    return waterbox, sources
+
+
+def add_uniform_cylinder_phantom(sim, name="uniform_cylinder", radius_mm=100.0, length_mm=200.0,
+                                 activity_bq=1e5, source_mode="positron", positron_range=False,
+                                 acceptance=VEREOS_ACCEPTANCE):
+    """
+    Centered water cylinder with uniform activity, e.g. for the crystal
+    efficiencies of the normalization (coincidence_to_castor_data.py --normalization_run).
+    It is longer than the axial FOV so that all crystal rings are illuminated.
+    (source_mode, positron_range, acceptance: see add_f18_source)
+    """
+    import opengate as gate
+
+    mm = gate.g4_units.mm
+    Bq = gate.g4_units.Bq
+
+    cylinder = sim.add_volume("Tubs", f"{name}_cylinder")
+    cylinder.rmin = 0
+    cylinder.rmax = radius_mm * mm
+    cylinder.dz = length_mm * mm / 2.0
+    cylinder.material = "G4_WATER"
+    cylinder.color = [0, 0, 1, 0.3]
+
+    source = add_f18_source(
+        sim, f"{name}_source", {"type": "cylinder", "radius": cylinder.rmax, "dz": cylinder.dz},
+        translation=[0, 0, 0], center=[0, 0, 0], activity=activity_bq * Bq, attached_to=cylinder.name,
+        source_mode=source_mode, positron_range=positron_range, acceptance=acceptance,
+    )
+    return cylinder, [source]
+
+
 def add_micro_derenzo_phantom(
     sim,
     name="micro_derenzo",
     rmin_mm=10.0,              # outward offset in mm
     absolute_rmin=True,        # True: place first rod exactly at rmin; False: shift whole sector outward
     activity_ref_bq=2e1,       # reference activity for rods with diameter = 1.0 mm
-    rod_length_mm=1.0          # rod length in mm (fixed as requested)
+    rod_length_mm=1.0,         # rod length in mm (fixed as requested)
+    source_mode="positron",    # see add_f18_source
+    positron_range=False,
+    acceptance=VEREOS_ACCEPTANCE,
 ):
+    import opengate as gate
+
     mm = gate.g4_units.mm
     cm = gate.g4_units.cm
     sec = gate.g4_units.s
@@ -185,7 +462,6 @@ def add_micro_derenzo_phantom(
     #rod_layers = [2,3,4]
     rod_len = rod_length_mm * mm
 
-    total_yield = get_rad_yield("F18")
     sources = []
 
     # Convert rmin to length unit
@@ -245,16 +521,12 @@ def add_micro_derenzo_phantom(
                 activity_bq = activity_ref_bq * (d_mm / 1.0)**2
 
                 # Attach F18 source
-                src = sim.add_source("GenericSource", f"{rod_name}_src")
-                src.attached_to = rod.name
-                src.particle = "e+"
-                src.energy.type = "F18"
-                src.position.type = "cylinder"
-                src.position.radius = rod.rmax
-                src.position.dz = rod.dz
-                src.direction.type = "iso"
-                src.activity = activity_bq * Bq * total_yield
-                src.half_life = 6586.26 * sec
+                src = add_f18_source(
+                    sim, f"{rod_name}_src", {"type": "cylinder", "radius": rod.rmax, "dz": rod.dz},
+                    translation=[0, 0, 0], center=rod.translation, activity=activity_bq * Bq,
+                    attached_to=rod.name, source_mode=source_mode, positron_range=positron_range,
+                    acceptance=acceptance,
+                )
 
                 sources.append(src)
 
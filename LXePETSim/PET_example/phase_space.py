@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Phase-space tools for the record/replay workflow of pet_sim_philips.py.
+
+  split        : compact the phase space recorded at the phantom boundary
+                 (pet_sim_philips.py --phsp_mode record) into chunk files that
+                 can be replayed by independent parallel runs.
+  restore_time : after a replay (pet_sim_philips.py --phsp_mode replay), put
+                 back the decay time and decay EventID of every single, so the
+                 output can be sorted into coincidences as a full simulation.
+"""
+
+import os
+import argparse
+import numpy as np
+import uproot
+
+if __package__:
+    from .pet_helpers import write_tree_chunk
+else:  # run as a script from this folder
+    from pet_helpers import write_tree_chunk
+
+
+RECORD_TREE = "PhantomPhaseSpace"
+CHUNK_TREE = "PhaseSpace"
+
+# compact storage: GlobalTime stays in double precision (ns over ~1000 s)
+CHUNK_DTYPES = {
+    "EventID": np.int32,
+    "GlobalTime": np.float64,
+    "KineticEnergy": np.float32,
+    "PostPosition_X": np.float32,
+    "PostPosition_Y": np.float32,
+    "PostPosition_Z": np.float32,
+    "PostDirection_X": np.float32,
+    "PostDirection_Y": np.float32,
+    "PostDirection_Z": np.float32,
+    "PDGCode": np.int32,
+    "Weight": np.float32,
+}
+
+
+# ==============================================
+# 1. Command-line argument parsing
+# ==============================================
+def parse_args():
+    parser = argparse.ArgumentParser(description="Phase-space record/replay tools.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sp = sub.add_parser("split", help="Compact a recorded phase space into chunk files.")
+    sp.add_argument("--input", type=str, required=True,
+                    help="ROOT file written in record mode.")
+    sp.add_argument("--output_dir", type=str, default=None,
+                    help="Output directory (default: next to the input file).")
+    sp.add_argument("--entries_per_chunk", type=int, default=5_000_000,
+                    help="Approximate number of photons per chunk (decays are never split).")
+    sp.add_argument("--min_energy", type=float, default=0.0,
+                    help="Drop photons below this kinetic energy in MeV "
+                         "(e.g. the lower bound of the energy window).")
+
+    rt = sub.add_parser("restore_time", help="Restore decay times in replayed singles.")
+    rt.add_argument("--singles", type=str, required=True,
+                    help="ROOT file written in replay mode.")
+    rt.add_argument("--phsp", type=str, required=True,
+                    help="Phase-space chunk used as the replay source.")
+    rt.add_argument("--tree", type=str, default="Singles5",
+                    help="Singles tree to process.")
+    rt.add_argument("--output", type=str, default=None,
+                    help="Output ROOT file (default: <singles>_timed.root).")
+    return parser.parse_args()
+
+
+# ==============================================
+# 2. Split
+# ==============================================
+def iterate_whole_decays(tree, step_size):
+    """Iterate over a phase-space tree, never splitting the photons of one decay."""
+    carry = None
+    for chunk in tree.iterate(list(CHUNK_DTYPES), step_size=step_size, library="np"):
+        if carry is not None:
+            chunk = {k: np.concatenate([carry[k], chunk[k]]) for k in chunk}
+        tail = chunk["EventID"] == chunk["EventID"][-1]
+        carry = {k: v[tail] for k, v in chunk.items()}
+        chunk = {k: v[~tail] for k, v in chunk.items()}
+        if len(chunk["EventID"]):
+            yield chunk
+    if carry is not None and len(carry["EventID"]):
+        yield carry
+
+
+def split(args):
+    output_dir = args.output_dir or os.path.dirname(os.path.abspath(args.input))
+    os.makedirs(output_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(args.input))[0]
+
+    with uproot.open(args.input) as f:
+        tree = f[RECORD_TREE]
+        print(f"[INFO] {tree.num_entries:,} photons recorded in {args.input}")
+        n_in, n_out = 0, 0
+        for i, chunk in enumerate(iterate_whole_decays(tree, args.entries_per_chunk)):
+            n_in += len(chunk["EventID"])
+            keep = chunk["KineticEnergy"] >= args.min_energy
+            chunk = {k: chunk[k][keep].astype(dtype) for k, dtype in CHUNK_DTYPES.items()}
+            path = os.path.join(output_dir, f"{stem}_chunk{i:03d}.root")
+            with uproot.recreate(path) as out:
+                out[CHUNK_TREE] = chunk
+            n_out += len(chunk["EventID"])
+            print(f"💾 Chunk {i}: {len(chunk['EventID']):,} photons -> {path}")
+    print(f"[DONE] Kept {n_out:,} / {n_in:,} photons")
+
+
+# ==============================================
+# 3. Restore decay time
+# ==============================================
+def restore_time(args):
+    """
+    The replay EventID is the phase-space entry index. Add the recorded
+    GlobalTime of that entry (decay time + flight to the phantom boundary)
+    to the single time, and use the decay EventID as the single EventID.
+    """
+    with uproot.open(args.phsp) as f:
+        phsp = f[CHUNK_TREE].arrays(["EventID", "GlobalTime"], library="np")
+
+    output = args.output or args.singles.replace(".root", "_timed.root")
+    n = 0
+    with uproot.open(args.singles) as f, uproot.recreate(output) as out:
+        for chunk in f[args.tree].iterate(library="np"):
+            entry = chunk["EventID"].astype(np.int64)
+            chunk["ReplayEventID"] = chunk["EventID"]
+            chunk["EventID"] = phsp["EventID"][entry]
+            chunk["GlobalTime"] = chunk["GlobalTime"] + phsp["GlobalTime"][entry]
+            write_tree_chunk(out, args.tree, chunk)
+            n += len(entry)
+    print(f"💾 Saved {n:,} singles with decay times to {output}")
+
+
+def main():
+    args = parse_args()
+    if args.command == "split":
+        split(args)
+    elif args.command == "restore_time":
+        restore_time(args)
+
+
+# ==============================================
+# Entry point
+# ==============================================
+if __name__ == "__main__":
+    main()
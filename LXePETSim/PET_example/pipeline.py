@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Incremental pipeline driver with a content-hash catalog.
+
+Each stage (simulate -> sort -> convert -> recon) is run through the existing
+scripts, and every artifact it produces is recorded in an SQLite catalog with
+its parameters, the content hashes of its inputs (including the script that
+produced it) and the producing stage. A stage is only re-run when one of its
+inputs or parameters changed, and artifacts can be queried by material,
+source distance, phantom or config instead of globbing the output folder.
+
+Examples:
+  python pipeline.py simulate --source_dist 5.0
+  python pipeline.py sort --material LYSO --source_dist 5.0
+  python pipeline.py convert --material LYSO --source_dist 5.0 --config_option fine
+  python pipeline.py recon --material LYSO --source_dist 5.0 --config_option original
+  python pipeline.py query --stage convert --material LYSO
+"""
+
+import os
+import sys
+import json
+import glob
+import sqlite3
+import hashlib
+import argparse
+import subprocess
+from datetime import datetime
+
+if __package__:
+    from .castor_io import CONFIG_DIR
+else:  # run as a script from this folder
+    from castor_io import CONFIG_DIR
+
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+OPTION_NAME_MAP = {
+    "original": "philips_vereos_virtual_crystals",
+    "fine": "philips_vereos_virtual_crystals_fine",
+    "super_fine": "philips_vereos_virtual_crystals_super_fine",
+}
+
+CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime REAL,
+    sha1 TEXT
+);
+CREATE TABLE IF NOT EXISTS artifacts (
+    path TEXT PRIMARY KEY,
+    stage TEXT,
+    stage_key TEXT,
+    sha1 TEXT,
+    material TEXT,
+    source_dist REAL,
+    phantom TEXT,
+    config TEXT,
+    params TEXT,
+    inputs TEXT,
+    created TEXT
+);
+CREATE INDEX IF NOT EXISTS artifacts_stage_key ON artifacts (stage_key);
+"""
+
+
+# ==============================================
+# 1. Catalog
+# ==============================================
+class Catalog:
+    """SQLite catalog of files (content hashes) and artifacts (provenance)."""
+
+    def __init__(self, db_path):
+        self.db = sqlite3.connect(db_path)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(CATALOG_SCHEMA)
+
+    def file_hash(self, path):
+        """SHA1 of a file; cached per (size, mtime) so large files are hashed once."""
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        row = self.db.execute("SELECT size, mtime, sha1 FROM files WHERE path = ?", (path,)).fetchone()
+        if row is not None and row["size"] == st.st_size and row["mtime"] == st.st_mtime:
+            return row["sha1"]
+        h = hashlib.sha1()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 24), b""):
+                h.update(block)
+        sha1 = h.hexdigest()
+        self.db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                        (path, st.st_size, st.st_mtime, sha1))
+        self.db.commit()
+        return sha1
+
+    def stage_key(self, stage, params, inputs):
+        """Hash identifying one execution of a stage: its parameters and input contents."""
+        h = hashlib.sha1()
+        h.update(stage.encode())
+        h.update(json.dumps(params, sort_keys=True).encode())
+        for path in sorted(inputs):
+            h.update(self.file_hash(path).encode())
+        return h.hexdigest()
+
+    def fresh_outputs(self, stage_key):
+        """Outputs of a previous execution with the same key, if all still exist unchanged."""
+        rows = self.db.execute("SELECT path, sha1 FROM artifacts WHERE stage_key = ?", (stage_key,)).fetchall()
+        if not rows:
+            return None
+        for row in rows:
+            if not os.path.isfile(row["path"]) or self.file_hash(row["path"]) != row["sha1"]:
+                return None
+        return [row["path"] for row in rows]
+
+    def record(self, path, stage, stage_key, params, inputs, tags):
+        path = os.path.abspath(path)
+        self.db.execute(
+            "INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (path, stage, stage_key, self.file_hash(path),
+             tags.get("material"), tags.get("source_dist"), tags.get("phantom"), tags.get("config"),
+             json.dumps(params, sort_keys=True),
+             json.dumps({os.path.abspath(p): self.file_hash(p) for p in inputs}, sort_keys=True),
+             datetime.now().isoformat(timespec="seconds")),
+        )
+        self.db.commit()
+
+    def query(self, stage=None, material=None, source_dist=None, phantom=None, config=None):
+        """Artifacts matching all the given tags, newest first."""
+        clauses, values = [], []
+        for column, value in (("stage", stage), ("material", material), ("source_dist", source_dist),
+                              ("phantom", phantom), ("config", config)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                values.append(value)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return self.db.execute(f"SELECT * FROM artifacts {where} ORDER BY created DESC, path DESC",
+                               values).fetchall()
+
+    def latest(self, **tags):
+        rows = self.query(**tags)
+        if not rows:
+            raise FileNotFoundError(f"No artifact in the catalog for {tags}")
+        return rows[0]["path"]
+
+
+# ==============================================
+# 2. Stage execution
+# ==============================================
+def run_stage(catalog, stage, params, inputs, command, outputs, tags, cwd):
+    """
+    Run 'command' unless the catalog already holds the outputs of the same
+    stage with the same parameters and input contents. 'outputs' is either a
+    list of paths or a callable returning them after the command has run.
+    """
+    key = catalog.stage_key(stage, params, inputs)
+    cached = catalog.fresh_outputs(key)
+    if cached is not None:
+        print(f"[SKIP] {stage}: up to date ({', '.join(os.path.basename(p) for p in cached)})")
+        return cached
+
+    print(f"[RUN] {stage}: {' '.join(command)}")
+    subprocess.run(command, check=True, cwd=cwd)
+    paths = outputs() if callable(outputs) else outputs
+    for path in paths:
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"Stage '{stage}' did not produce {path}")
+        catalog.record(path, stage, key, params, inputs, tags)
+        print(f"[CATALOG] {stage}: {os.path.abspath(path)}")
+    return paths
+
+
+def script(name):
+    return os.path.join(SCRIPT_DIR, name)
+
+
+def stage_simulate(catalog, args):
+    output_dir = os.path.join(args.workdir, "output_radius_plot")
+    pattern = os.path.join(output_dir, f"output_{args.phantom}_{args.material}_*.root")
+    before = set(glob.glob(pattern))
+    params = {"source_dist": args.source_dist, "material": args.material, "phantom": args.phantom,
+              "script": os.path.basename(args.script)}
+    inputs = [args.script, script("pet_helpers.py"), script("phantoms.py")]
+    command = [sys.executable, args.script, "--source_dist", str(args.source_dist),
+               "--material", args.material, "--phantom", args.phantom]
+    tags = {"material": args.material, "source_dist": args.source_dist, "phantom": args.phantom}
+
+    def new_outputs():
+        return sorted(set(glob.glob(pattern)) - before)
+
+    return run_stage(catalog, "simulate", params, inputs, command, new_outputs, tags, args.workdir)
+
+
+def stage_sort(catalog, args):
+    root_file = catalog.latest(stage="simulate", material=args.material,
+                               source_dist=args.source_dist, phantom=args.phantom)
+    csv_path = os.path.join(args.workdir, "output_radius_plot",
+                            f"coincidence_{args.material}_src{args.source_dist:.1f}cm.csv")
+    params = {"material": args.material, "source_dist": args.source_dist}
+    inputs = [root_file, script("sim_to_coincidence.py")]
+    command = [sys.executable, script("sim_to_coincidence.py"), "--pattern", os.path.basename(root_file),
+               "--material", args.material, "--source_dist", str(args.source_dist)]
+    tags = {"material": args.material, "source_dist": args.source_dist, "phantom": args.phantom}
+    return run_stage(catalog, "sort", params, inputs, command, [csv_path], tags, args.workdir)
+
+
+def stage_convert(catalog, args):
+    csv_path = catalog.latest(stage="sort", material=args.material,
+                              source_dist=args.source_dist, phantom=args.phantom)
+    lut = os.path.join(args.config_path, f"{OPTION_NAME_MAP[args.config_option]}_binary.lut")
+    prefix = f"coincidence_{args.material}_src{args.source_dist:.1f}cm_{args.config_option}"
+    outputs = [os.path.join(args.castor_dir, f"{prefix}.cdf"), os.path.join(args.castor_dir, f"{prefix}.cdh")]
+    params = {"material": args.material, "source_dist": args.source_dist, "config": args.config_option}
+    inputs = [csv_path, lut, script("coincidence_to_castor_data.py")]
+    command = [sys.executable, script("coincidence_to_castor_data.py"),
+               "--config_option", args.config_option, "--material", args.material,
+               "--source_dist", str(args.source_dist), "--input_dir", os.path.dirname(csv_path),
+               "--output_dir", args.castor_dir, "--config_path", args.config_path]
+    tags = {"material": args.material, "source_dist": args.source_dist, "phantom": args.phantom,
+            "config": args.config_option}
+    return run_stage(catalog, "convert", params, inputs, command, outputs, tags, args.workdir)
+
+
+def stage_recon(catalog, args):
+    rows = [r for r in catalog.query(stage="convert", material=args.material, source_dist=args.source_dist,
+                                     phantom=args.phantom, config=args.config_option)
+            if r["path"].endswith(".cdh")]
+    if not rows:
+        raise FileNotFoundError("No converted dataset in the catalog, run the 'convert' stage first")
+    cdh = rows[0]["path"]
+    cdf = cdh[:-len(".cdh")] + ".cdf"
+    lut = os.path.join(args.config_path, f"{OPTION_NAME_MAP[args.config_option]}_binary.lut")
+    fout = os.path.join(args.castor_dir, os.path.basename(cdh)[:-len(".cdh")] + "_osem")
+    n_it = sum(int(step.split(":")[0]) for step in args.it.split(","))
+    outputs = [f"{fout}_it{n_it}.hdr", f"{fout}_it{n_it}.img"]
+    params = {"it": args.it, "dim": args.dim, "fov": args.fov}
+    inputs = [cdh, cdf, lut, script("quick_osem_recon.py")]
+    command = [sys.executable, script("quick_osem_recon.py"), "--datafile", cdh, "--lut", lut,
+               "--fout", fout, "--it", args.it, "--dim", args.dim, "--fov", args.fov, "--flip_y"]
+    tags = {"material": args.material, "source_dist": args.source_dist, "phantom": args.phantom,
+            "config": args.config_option}
+    return run_stage(catalog, "recon", params, inputs, command, outputs, tags, args.workdir)
+
+
+def print_query(catalog, args):
+    rows = catalog.query(stage=args.stage, material=args.material, source_dist=args.source_dist,
+                         phantom=args.phantom, config=args.config_option)
+    for r in rows:
+        print(f"{r['stage']:9s} {r['material'] or '-':5s} {r['source_dist'] if r['source_dist'] is not None else '-':>5} "
+              f"{r['config'] or '-':10s} {r['created']}  {r['path']}")
+    print(f"[INFO] {len(rows)} artifacts")
+
+
+def register(catalog, args):
+    """Add existing files (e.g. older simulation outputs) to the catalog."""
+    params = {"source_dist": args.source_dist}
+    tags = {"material": args.material, "source_dist": args.source_dist, "phantom": args.phantom,
+            "config": args.config_option if args.stage in ("convert", "recon") else None}
+    for path in args.paths:
+        key = catalog.stage_key(args.stage, dict(params, registered=os.path.abspath(path)), [path])
+        catalog.record(path, args.stage, key, params, [], tags)
+        print(f"[CATALOG] {args.stage}: {os.path.abspath(path)}")
+
+
+# ==============================================
+# 3. Command-line interface
+# ==============================================
+def parse_args():
+    parser = argparse.ArgumentParser(description="Incremental PET simulation/reconstruction pipeline.")
+    parser.add_argument("--catalog", type=str, default="pipeline_catalog.sqlite",
+                        help="SQLite catalog file.")
+    parser.add_argument("--workdir", type=str, default=".",
+                        help="Folder containing output_radius_plot/.")
+    parser.add_argument("--castor_dir", type=str, default="./castor_data",
+                        help="Folder for the CASToR list-mode data and images.")
+    parser.add_argument("--config_path", type=str, default=CONFIG_DIR,
+                        help="Path to the LUT configuration files.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def add_tags(p, stage_choice=False):
+        p.add_argument("--material", type=str, default=None if stage_choice else "LYSO")
+        p.add_argument("--source_dist", type=float, default=None if stage_choice else 0.0)
+        p.add_argument("--phantom", type=str, default=None if stage_choice else "simple_hot_point")
+        p.add_argument("--config_option", type=str, default=None if stage_choice else "original",
+                       choices=list(OPTION_NAME_MAP))
+        return p
+
+    p = add_tags(sub.add_parser("simulate", help="Run the OpenGATE simulation."))
+    p.add_argument("--script", type=str, default=script("pet_sim_philips.py"))
+    add_tags(sub.add_parser("sort", help="ROOT singles -> coincidence CSV."))
+    add_tags(sub.add_parser("convert", help="Coincidence CSV -> CASToR list-mode."))
+    p = add_tags(sub.add_parser("recon", help="Quick-look NumPy OSEM reconstruction."))
+    p.add_argument("--it", type=str, default="2:28")
+    p.add_argument("--dim", type=str, default="300,150,1")
+    p.add_argument("--fov", type=str, default="300.,150.,2.")
+    p = add_tags(sub.add_parser("query", help="List catalog artifacts."), stage_choice=True)
+    p.add_argument("--stage", type=str, default=None)
+    p = add_tags(sub.add_parser("register", help="Add existing files to the catalog."))
+    p.add_argument("--stage", type=str, required=True)
+    p.add_argument("paths", nargs="+")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    os.makedirs(args.castor_dir, exist_ok=True)
+    catalog = Catalog(args.catalog)
+    stages = {
+        "simulate": stage_simulate,
+        "sort": stage_sort,
+        "convert": stage_convert,
+        "recon": stage_recon,
+        "query": print_query,
+        "register": register,
+    }
+    stages[args.command](catalog, args)
+
+
+# ==============================================
+# Entry point
+# ==============================================
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Quick-look list-mode OSEM reconstruction in NumPy.
+Reads a CASToR list-mode dataset (.cdh/.cdf) and the binary LUT, and
+reconstructs it with a vectorized Joseph ray-driven projector, without
+going through a CASToR installation. Meant for sanity checks during a
+sweep, not as a replacement for castor-recon.
+"""
+
+import os
+import hashlib
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+if __package__:
+    from .castor_io import CONFIG_DIR, CACHE_DIR, read_cdf, load_binary_lut, read_interfile_image, write_interfile_image
+else:  # run as a script from this folder
+    from castor_io import CONFIG_DIR, CACHE_DIR, read_cdf, load_binary_lut, read_interfile_image, write_interfile_image
+
+
+# ==============================================
+# 1. Command-line argument parsing
+# ==============================================
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Reconstruct a CASToR list-mode dataset with a NumPy OSEM."
+    )
+    parser.add_argument("--datafile", type=str, required=True,
+                        help="CASToR list-mode header (.cdh).")
+    parser.add_argument("--lut", type=str,
+                        default=os.path.join(CONFIG_DIR, "philips_vereos_virtual_crystals_binary.lut"),
+                        help="Binary LUT of the scanner used by the dataset.")
+    parser.add_argument("--fout", type=str, default="quick_osem",
+                        help="Output base name of the reconstructed images.")
+    parser.add_argument("--it", type=str, default="2:28",
+                        help="Iterations:subsets, e.g. '2:28' (same syntax as castor-recon).")
+    parser.add_argument("--dim", type=str, default="300,150,1",
+                        help="Number of voxels (X,Y,Z).")
+    parser.add_argument("--fov", type=str, default="300.,150.,2.",
+                        help="Field-of-view size in mm (X,Y,Z).")
+    parser.add_argument("--off", type=str, default="0.,0.,0.",
+                        help="Field-of-view offset in mm (X,Y,Z).")
+    parser.add_argument("--sens", type=str, default=None,
+                        help="Optional sensitivity image (.hdr) computed by CASToR with the same geometry.")
+    parser.add_argument("--sens_cache_dir", type=str, default=CACHE_DIR,
+                        help="Directory where the Monte Carlo sensitivity images are cached (empty to disable).")
+    parser.add_argument("--sens_lors", type=int, default=20_000_000,
+                        help="Number of random crystal pairs used to estimate the sensitivity image.")
+    parser.add_argument("--batch", type=int, default=4096,
+                        help="Number of LORs projected at once.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Number of worker processes.")
+    parser.add_argument("--flip_y", action="store_true",
+                        help="Flip the saved image along Y (as castor-recon '-flip-out Y').")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Random seed of the sensitivity estimation.")
+    args = parser.parse_args()
+    try:
+        steps = parse_iterations(args.it)
+    except ValueError:
+        parser.error(f"--it must be iterations:subsets pairs, e.g. '2:28,1:14', got '{args.it}'")
+    if sum(n_it for n_it, _ in steps) < 1 or any(n_it < 0 or n_sub < 1 for n_it, n_sub in steps):
+        parser.error(f"--it must give at least one iteration and at least one subset per step, got '{args.it}'")
+    return args
+
+
+# ==============================================
+# 2. Image geometry and Joseph projector
+# ==============================================
+def make_geometry(dim, fov, off):
+    """Image geometry: number of voxels, voxel size and lower FOV corner, all in (x, y, z) order."""
+    dim = np.asarray(dim, dtype=np.int64)
+    fov = np.asarray(fov, dtype=np.float64)
+    off = np.asarray(off, dtype=np.float64)
+    return {"dim": dim, "vox": fov / dim, "corner": off - fov / 2.0}
+
+
+def joseph_system_rows(p1, p2, geom):
+    """
+    Sparse system-matrix rows of a batch of LORs with the Joseph projector.
+    The ray is sampled at each voxel plane along its dominant transaxial axis
+    and bilinearly interpolated in the two other axes.
+    Returns (lor index, flat voxel index, weight) arrays.
+    """
+    dim, vox, corner = geom["dim"], geom["vox"], geom["corner"]
+    d = p2 - p1
+    x_major = np.abs(d[:, 0]) >= np.abs(d[:, 1])
+    # purely axial LORs (both crystals in the same transaxial position) do not cross the slice plane
+    transaxial = (d[:, 0] != 0) | (d[:, 1] != 0)
+
+    lors, voxels, weights = [], [], []
+    for major, mask in ((0, x_major & transaxial), (1, ~x_major & transaxial)):
+        lor = np.nonzero(mask)[0]
+        if len(lor) == 0:
+            continue
+        minor = 1 - major
+        a1, da = p1[lor, major], d[lor, major]
+        centers = corner[major] + (np.arange(dim[major]) + 0.5) * vox[major]
+        t = (centers[None, :] - a1[:, None]) / da[:, None]
+
+        # continuous voxel coordinates in the interpolated axes
+        u = (p1[lor, minor, None] + t * d[lor, minor, None] - corner[minor]) / vox[minor] - 0.5
+        w = (p1[lor, 2, None] + t * d[lor, 2, None] - corner[2]) / vox[2] - 0.5
+        inside = (u > -1) & (u < dim[minor]) & (w > -1) & (w < dim[2])
+        i_lor, i_major = np.nonzero(inside)
+        u, w = u[inside], w[inside]
+
+        step = vox[major] * np.sqrt(1.0 + (d[lor, minor] / da) ** 2 + (d[lor, 2] / da) ** 2)
+        step = step[i_lor]
+
+        u0, w0 = np.floor(u).astype(np.int64), np.floor(w).astype(np.int64)
+        fu, fw = u - u0, w - w0
+        for du, dw, wt in ((0, 0, (1 - fu) * (1 - fw)), (1, 0, fu * (1 - fw)),
+                           (0, 1, (1 - fu) * fw), (1, 1, fu * fw)):
+            iu, iw = u0 + du, w0 + dw
+            ok = (iu >= 0) & (iu < dim[minor]) & (iw >= 0) & (iw < dim[2]) & (wt > 0)
+            ix = i_major[ok] if major == 0 else iu[ok]
+            iy = iu[ok] if major == 0 else i_major[ok]
+            voxels.append((iw[ok] * dim[1] + iy) * dim[0] + ix)
+            lors.append(lor[i_lor[ok]])
+            weights.append(wt[ok] * step[ok])
+
+    if not lors:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0)
+    return np.concatenate(lors), np.concatenate(voxels), np.concatenate(weights)
+
+
+def backproject_ratio(p1, p2, image, geom, batch):
+    """Backproject 1 / (forward projection) of the given LORs. Returns a flat image."""
+    n_vox = int(np.prod(geom["dim"]))
+    flat = image.ravel()
+    out = np.zeros(n_vox)
+    for start in range(0, len(p1), batch):
+        stop = min(start + batch, len(p1))
+        lor, vx, wt = joseph_system_rows(p1[start:stop], p2[start:stop], geom)
+        fwd = np.bincount(lor, weights=wt * flat[vx], minlength=stop - start)
+        # float output: bincount returns integers when the batch has no voxel crossing
+        ratio = np.divide(1.0, fwd, out=np.zeros(stop - start), where=fwd > 0)
+        out += np.bincount(vx, weights=wt * ratio[lor], minlength=n_vox)
+    return out
+
+
+def backproject_ones(p1, p2, geom, batch):
+    """Backproject a unit value along each LOR. Returns a flat image."""
+    n_vox = int(np.prod(geom["dim"]))
+    out = np.zeros(n_vox)
+    for start in range(0, len(p1), batch):
+        stop = min(start + batch, len(p1))
+        _, vx, wt = joseph_system_rows(p1[start:stop], p2[start:stop], geom)
+        out += np.bincount(vx, weights=wt, minlength=n_vox)
+    return out
+
+
+# ==============================================
+# 3. Process pool workers
+# ==============================================
+_WORKER = {}
+
+
+def _init_worker(p1, p2, geom, batch):
+    _WORKER.update(p1=p1, p2=p2, geom=geom, batch=batch)
+
+
+def _worker_backproject_ratio(idx, image):
+    w = _WORKER
+    return backproject_ratio(w["p1"][idx], w["p2"][idx], image, w["geom"], w["batch"])
+
+
+def _worker_sensitivity(lut_xyz, n_lors, seed, geom, batch):
+    rng = np.random.default_rng(seed)
+    c1 = rng.integers(0, len(lut_xyz), n_lors)
+    c2 = rng.integers(0, len(lut_xyz), n_lors)
+    keep = c1 != c2
+    return backproject_ones(lut_xyz[c1[keep]], lut_xyz[c2[keep]], geom, batch)
+
+
+# ==============================================
+# 4. Sensitivity image
+# ==============================================
+def sensitivity_cache_key(lut_path, geom, n_lors, seed):
+    """Hash of everything the Monte Carlo sensitivity image depends on."""
+    h = hashlib.sha1()
+    with open(lut_path, "rb") as f:
+        h.update(f.read())
+    for arr in (geom["dim"], geom["vox"], geom["corner"]):
+        h.update(np.asarray(arr, dtype=np.float64).tobytes())
+    h.update(f"{n_lors}:{seed}".encode())
+    return h.hexdigest()[:16]
+
+
+def compute_sensitivity(lut_xyz, geom, n_lors, seed, batch, pool, n_workers):
+    """
+    Estimate the list-mode sensitivity image by backprojecting uniformly sampled
+    crystal pairs, scaled to the total number of crystal pairs.
+    """
+    per_worker = int(np.ceil(n_lors / n_workers))
+    seeds = np.random.SeedSequence(seed).spawn(n_workers)
+    futures = [pool.submit(_worker_sensitivity, lut_xyz, per_worker, s, geom, batch) for s in seeds]
+    sens = sum(f.result() for f in futures)
+    n_pairs = len(lut_xyz) * (len(lut_xyz) - 1) / 2.0
+    return sens * n_pairs / (per_worker * n_workers)
+
+
+def get_sensitivity(args, lut_xyz, geom, pool, n_workers):
+    if args.sens:
+        sens, _ = read_interfile_image(args.sens)
+        if args.flip_y:
+            sens = sens[:, ::-1, :]
+        print(f"[SENS] Loaded sensitivity image: {args.sens}")
+        return np.asarray(sens, dtype=np.float64).ravel()
+
+    cache_path = None
+    if args.sens_cache_dir:
+        key = sensitivity_cache_key(args.lut, geom, args.sens_lors, args.seed)
+        cache_path = os.path.join(args.sens_cache_dir, f"sens_{key}.npy")
+        if os.path.isfile(cache_path):
+            print(f"[SENS] Using cached sensitivity image: {cache_path}")
+            return np.load(cache_path)
+
+    print(f"[SENS] Estimating sensitivity image from {args.sens_lors:,} random LORs...")
+    sens = compute_sensitivity(lut_xyz, geom, args.sens_lors, args.seed, args.batch, pool, n_workers)
+    if cache_path:
+        os.makedirs(args.sens_cache_dir, exist_ok=True)
+        np.save(cache_path, sens)
+        print(f"[SENS] Cached sensitivity image: {cache_path}")
+    return sens
+
+
+# ==============================================
+# 5. OSEM
+# ==============================================
+def parse_iterations(text):
+    """Parse the castor-recon '-it' syntax, e.g. '2:28,1:14', into (iterations, subsets) pairs."""
+    steps = []
+    for item in text.split(","):
+        n_it, n_sub = item.split(":")
+        steps.append((int(n_it), int(n_sub)))
+    return steps
+
+
+def osem(p1, p2, sens, geom, steps, pool, n_workers):
+    """List-mode OSEM; yields (iteration number, image) after each iteration."""
+    n_vox = int(np.prod(geom["dim"]))
+    image = np.where(sens > 0, 1.0, 0.0)
+    it = 0
+    for n_it, n_sub in steps:
+        subset_sens = sens / n_sub
+        for _ in range(n_it):
+            for s in range(n_sub):
+                idx = np.arange(s, len(p1), n_sub)
+                chunks = np.array_split(idx, n_workers)
+                futures = [pool.submit(_worker_backproject_ratio, c, image) for c in chunks if len(c)]
+                bp = np.zeros(n_vox)
+                for f in futures:
+                    bp += f.result()
+                image = np.divide(image * bp, subset_sens, out=np.zeros(n_vox), where=subset_sens > 0)
+            it += 1
+            yield it, image
+
+
+def main():
+    args = parse_args()
+
+    geom = make_geometry(
+        [int(v) for v in args.dim.split(",")],
+        [float(v) for v in args.fov.split(",")],
+        [float(v) for v in args.off.split(",")],
+    )
+    steps = parse_iterations(args.it)
+
+    header, events = read_cdf(args.datafile)
+    lut = load_binary_lut(args.lut)
+    lut_xyz = lut[:, :3].astype(np.float64)
+    print(f"[INFO] Scanner: {header.get('Scanner name', '?')}, {len(lut):,} crystals")
+    print(f"[INFO] Events: {len(events):,}")
+    print(f"[INFO] Image: dim={geom['dim'].tolist()}, voxel={geom['vox'].tolist()} mm")
+
+    c1 = np.asarray(events["crystal1"], dtype=np.int64)
+    c2 = np.asarray(events["crystal2"], dtype=np.int64)
+    p1, p2 = lut_xyz[c1], lut_xyz[c2]
+
+    n_workers = max(1, args.workers)
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                             initargs=(p1, p2, geom, args.batch)) as pool:
+        sens = get_sensitivity(args, lut_xyz, geom, pool, n_workers)
+        n_total = sum(n for n, _ in steps)
+        for it, image in osem(p1, p2, sens, geom, steps, pool, n_workers):
+            print(f"[OSEM] Iteration {it}/{n_total} done")
+
+    image = image.reshape(geom["dim"][::-1])
+    if args.flip_y:
+        image = image[:, ::-1, :]
+    write_interfile_image(f"{args.fout}_it{it}.hdr", image, geom["vox"].tolist())
+    print(f"[DONE] Generated: {args.fout}_it{it}.hdr")
+
+
+# ==============================================
+# Entry point
+# ==============================================
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+Offline re-digitization of a stored Hits tree.
+Replays the readout / efficiency / energy blurring / time blurring / energy
+window chain of add_vereos_digitizer_v1 in NumPy, so that one simulation can
+be re-used for many digitizer configurations without re-running Geant4.
+The output ROOT file contains a 'Singles5' tree and can be fed directly to
+sim_to_coincidence.py.
+"""
+
+import os
+import json
+import argparse
+import numpy as np
+import pandas as pd
+import uproot
+
+if __package__:
+    from .optical_lut import load_optical_lut, hit_light, optical_response
+    from .pet_helpers import write_tree_chunk
+else:  # run as a script from this folder
+    from optical_lut import load_optical_lut, hit_light, optical_response
+    from pet_helpers import write_tree_chunk
+
+
+# Default configuration: same values as add_vereos_digitizer_v1 (ROOT units: MeV, ns, mm)
+VEREOS_DIGITIZER_V1 = {
+    "name": "vereos_v1",
+    "policy": "EnergyWeightedCentroidPosition",
+    "efficiency": 0.86481,
+    "energy_resolution": 0.112,
+    "energy_reference": 0.511,
+    "time_fwhm": 0.220,
+    "energy_min": 0.44968,
+    "energy_max": 0.61320,
+    # LXe fast optics: table from optical_lut.py, replaces the energy and time blurring
+    "optical_lut": None,
+    # time blurring FWHM (ns) added on top of the table delays (e.g. electronics)
+    "extra_time_fwhm": 0.0,
+}
+
+# PreStepUniqueVolumeID levels below the readout group volume (module > stack > die > crystal)
+VEREOS_LEVELS_BELOW_MODULE = 3
+
+HITS_BRANCHES = [
+    "EventID",
+    "PostPosition_X",
+    "PostPosition_Y",
+    "PostPosition_Z",
+    "TotalEnergyDeposit",
+    "PreStepUniqueVolumeID",
+    "GlobalTime",
+]
+# read when present: hits of different runs (e.g. sim_worker.py batches) share EventIDs
+OPTIONAL_HITS_BRANCHES = ["RunID"]
+
+
+# ==============================================
+# 1. Command-line argument parsing
+# ==============================================
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Re-digitize a stored Hits tree with one or several digitizer configurations."
+    )
+    parser.add_argument("--input", type=str, required=True,
+                        help="ROOT file containing a 'Hits' tree (simulated with --output_profile hits or debug).")
+    parser.add_argument("--output_dir", type=str, default=None,
+                        help="Output directory (default: next to the input file).")
+    parser.add_argument("--configs", type=str, default=None,
+                        help="JSON file with a list of digitizer configurations. "
+                             "Missing keys take the add_vereos_digitizer_v1 values.")
+    parser.add_argument("--policy", type=str, default=VEREOS_DIGITIZER_V1["policy"],
+                        choices=["EnergyWeightedCentroidPosition", "EnergyWinnerPosition"])
+    parser.add_argument("--efficiency", type=float, default=VEREOS_DIGITIZER_V1["efficiency"])
+    parser.add_argument("--energy_resolution", type=float, default=VEREOS_DIGITIZER_V1["energy_resolution"],
+                        help="FWHM energy resolution at the reference energy (InverseSquare law).")
+    parser.add_argument("--time_fwhm", type=float, default=VEREOS_DIGITIZER_V1["time_fwhm"],
+                        help="Time blurring FWHM in ns (without --optical_lut).")
+    parser.add_argument("--energy_min", type=float, default=VEREOS_DIGITIZER_V1["energy_min"],
+                        help="Lower energy window bound in MeV.")
+    parser.add_argument("--energy_max", type=float, default=VEREOS_DIGITIZER_V1["energy_max"],
+                        help="Upper energy window bound in MeV.")
+    parser.add_argument("--optical_lut", type=str, default=None,
+                        help="LXe optical-response table (optical_lut.py build); replaces the energy and "
+                             "time blurring.")
+    parser.add_argument("--extra_time_fwhm", type=float, default=VEREOS_DIGITIZER_V1["extra_time_fwhm"],
+                        help="With --optical_lut: time blurring FWHM in ns added to the tabulated delays.")
+    parser.add_argument("--levels_below_group", type=int, default=VEREOS_LEVELS_BELOW_MODULE,
+                        help="Number of volume levels between the readout group volume and the crystal.")
+    parser.add_argument("--chunk_size", type=int, default=1_000_000,
+                        help="Number of hits read at once.")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Random seed.")
+    return parser.parse_args()
+
+
+def load_configs(args):
+    """Return the list of digitizer configurations requested on the command line."""
+    if args.configs:
+        with open(args.configs, "r") as f:
+            user_configs = json.load(f)
+        configs = []
+        for i, c in enumerate(user_configs):
+            config = dict(VEREOS_DIGITIZER_V1, name=f"config{i}")
+            config.update(c)
+            configs.append(config)
+        return configs
+    return [dict(
+        VEREOS_DIGITIZER_V1,
+        name="custom",
+        policy=args.policy,
+        efficiency=args.efficiency,
+        energy_resolution=args.energy_resolution,
+        time_fwhm=args.time_fwhm,
+        energy_min=args.energy_min,
+        energy_max=args.energy_max,
+        optical_lut=args.optical_lut,
+        extra_time_fwhm=args.extra_time_fwhm,
+    )]
+
+
+# ==============================================
+# 2. Digitizer modules (vectorized)
+# ==============================================
+def readout(hits, policy, levels_below_group, light=None):
+    """
+    Group hits of the same event in the same group volume into one single.
+    The single keeps the volume ID (and RunID) of its highest-energy hit.
+    EnergyWinnerPosition keeps the position of the highest-energy hit;
+    EnergyWeightedCentroidPosition uses the energy-weighted position. As in
+    the Gate adder, the time is that of the earliest hit of the group.
+    With the per-hit optical response (optical_lut.hit_light), the single
+    gets the summed light and the time of its earliest photon instead.
+    """
+    volume_ids = pd.Series(hits["PreStepUniqueVolumeID"])
+    group_names = volume_ids.str.rsplit("_", n=levels_below_group).str[0]
+    group_code = pd.factorize(group_names)[0]
+    keys = [hits["EventID"].astype(np.int64), group_code]
+    if "RunID" in hits:
+        keys.insert(0, hits["RunID"].astype(np.int64))
+    keys = np.stack(keys)
+    _, first, group = np.unique(keys, axis=1, return_index=True, return_inverse=True)
+    group = group.ravel()
+    n_groups = len(first)
+
+    edep = hits["TotalEnergyDeposit"]
+    energy = np.bincount(group, weights=edep, minlength=n_groups)
+
+    # winner: highest energy hit of each group
+    order = np.lexsort((-edep, group))
+    winner = order[np.r_[0, np.flatnonzero(np.diff(group[order])) + 1]]
+
+    singles = {"EventID": hits["EventID"][winner], "TotalEnergyDeposit": energy,
+               "PreStepUniqueVolumeID": hits["PreStepUniqueVolumeID"][winner]}
+    if "RunID" in hits:
+        singles["RunID"] = hits["RunID"][winner]
+    if policy == "EnergyWinnerPosition":
+        for axis in "XYZ":
+            singles[f"PostPosition_{axis}"] = hits[f"PostPosition_{axis}"][winner]
+    else:
+        safe = np.where(energy > 0, energy, 1.0)
+        for axis in "XYZ":
+            pos = hits[f"PostPosition_{axis}"]
+            singles[f"PostPosition_{axis}"] = np.bincount(group, weights=edep * pos, minlength=n_groups) / safe
+    # hits are not stored in time order
+    first_time = np.full(n_groups, np.inf)
+    if light is None:
+        np.minimum.at(first_time, group, hits["GlobalTime"])
+    else:
+        hit_photons, hit_spread, photon_time = light
+        np.minimum.at(first_time, group, photon_time)
+        singles["Light"] = np.bincount(group, weights=hit_photons, minlength=n_groups)
+        safe = np.where(singles["Light"] > 0, singles["Light"], 1.0)
+        singles["LightSpread"] = np.bincount(group, weights=hit_photons * hit_spread, minlength=n_groups) / safe
+    singles["GlobalTime"] = first_time
+    return singles
+
+
+def select(singles, mask):
+    return {k: v[mask] for k, v in singles.items()}
+
+
+def efficiency(singles, eff, rng):
+    return select(singles, rng.random(len(singles["TotalEnergyDeposit"])) < eff)
+
+
+def energy_blurring(singles, resolution, reference, rng):
+    """InverseSquare law: FWHM resolution scales as 1/sqrt(E) from the reference energy."""
+    e = singles["TotalEnergyDeposit"]
+    res = resolution * np.sqrt(reference / np.where(e > 0, e, reference))
+    sigma = res * e / (2.0 * np.sqrt(2.0 * np.log(2.0)))
+    singles = dict(singles)
+    singles["TotalEnergyDeposit"] = e + sigma * rng.standard_normal(len(e))
+    return singles
+
+
+def time_blurring(singles, fwhm, rng):
+    sigma = fwhm / (2.0 * np.sqrt(2.0 * np.log(2.0)))
+    singles = dict(singles)
+    t = singles["GlobalTime"]
+    singles["GlobalTime"] = t + sigma * rng.standard_normal(len(t))
+    return singles
+
+
+def energy_window(singles, e_min, e_max):
+    e = singles["TotalEnergyDeposit"]
+    return select(singles, (e >= e_min) & (e <= e_max))
+
+
+def digitize(hits, config, rng, levels_below_group, optical_lut=None):
+    """
+    Apply the full chain of one configuration to a chunk of hits grouped by whole events.
+    With an optical-response table, the table is applied to every hit before
+    the readout, and the photon statistics and first-photon delays replace the
+    parametric energy and time blurring (only extra_time_fwhm is added).
+    """
+    light = hit_light(hits, optical_lut, rng) if optical_lut is not None else None
+    singles = readout(hits, config["policy"], levels_below_group, light)
+    singles = efficiency(singles, config["efficiency"], rng)
+    if optical_lut is not None:
+        singles = optical_response(singles, optical_lut, rng)
+        time_fwhm = config["extra_time_fwhm"]
+    else:
+        singles = energy_blurring(singles, config["energy_resolution"], config["energy_reference"], rng)
+        time_fwhm = config["time_fwhm"]
+    if time_fwhm > 0:
+        singles = time_blurring(singles, time_fwhm, rng)
+    singles = energy_window(singles, config["energy_min"], config["energy_max"])
+    return singles
+
+
+# ==============================================
+# 3. Chunked reading
+# ==============================================
+def iterate_whole_events(hits_tree, chunk_size):
+    """
+    Iterate over the Hits tree in chunks, carrying the hits of the last event
+    of each chunk over to the next one so that no event is split.
+    """
+    branches = HITS_BRANCHES + [b for b in OPTIONAL_HITS_BRANCHES if b in hits_tree.keys()]
+    carry = None
+    for chunk in hits_tree.iterate(branches, step_size=chunk_size, library="np"):
+        if carry is not None:
+            chunk = {k: np.concatenate([carry[k], chunk[k]]) for k in chunk}
+        tail = chunk["EventID"] == chunk["EventID"][-1]
+        if "RunID" in chunk:
+            tail &= chunk["RunID"] == chunk["RunID"][-1]
+        carry = {k: v[tail] for k, v in chunk.items()}
+        chunk = {k: v[~tail] for k, v in chunk.items()}
+        if len(chunk["EventID"]):
+            yield chunk
+    if carry is not None and len(carry["EventID"]):
+        yield carry
+
+
+def main():
+    args = parse_args()
+    configs = load_configs(args)
+
+    f = uproot.open(args.input)
+    hits_tree = f["Hits"]
+    missing = set(HITS_BRANCHES) - set(hits_tree.keys())
+    if missing:
+        raise ValueError(f"Hits tree is missing branches {missing}; "
+                         f"re-run the simulation with the EventID attribute in the Hits actor.")
+
+    output_dir = args.output_dir or os.path.dirname(os.path.abspath(args.input))
+    os.makedirs(output_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(args.input))[0]
+
+    seeds = np.random.SeedSequence(args.seed).spawn(len(configs))
+    rngs = [np.random.default_rng(s) for s in seeds]
+    paths = [os.path.join(output_dir, f"{stem}_redigi_{c['name']}.root") for c in configs]
+    outputs = [uproot.recreate(path) for path in paths]
+    luts = [load_optical_lut(c["optical_lut"]) if c["optical_lut"] else None for c in configs]
+    for config in configs:
+        print(f"[CONFIG] {config['name']}: {config}")
+
+    n_hits = 0
+    n_singles = [0] * len(configs)
+    for chunk in iterate_whole_events(hits_tree, args.chunk_size):
+        n_hits += len(chunk["EventID"])
+        for i, (config, rng, out, lut) in enumerate(zip(configs, rngs, outputs, luts)):
+            singles = digitize(chunk, config, rng, args.levels_below_group, lut)
+            write_tree_chunk(out, "Singles5", singles)
+            n_singles[i] += len(singles["EventID"])
+        print(f"[INFO] Processed {n_hits:,} hits")
+
+    for config, out, path, n in zip(configs, outputs, paths, n_singles):
+        out.close()
+        print(f"💾 {config['name']}: {n:,} singles written to {path}")
+
+
+# ==============================================
+# Entry point
+# ==============================================
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Batch spatial-resolution analysis of reconstructed point-source images.
+For every image, radial, tangential and axial profiles are taken through the
+hottest voxel and their FWHM / FWTM are measured as in NEMA NU 2 (peak from a
+parabolic fit of the maximum and its two neighbours, widths by linear
+interpolation between samples). Images are processed in parallel and the
+results are written to one summary table, e.g. to plot resolution against
+source distance for LXe and LYSO.
+"""
+
+import os
+import re
+import glob
+import argparse
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from scipy.ndimage import map_coordinates
+
+if __package__:
+    from .castor_io import read_interfile_image
+else:  # run as a script from this folder
+    from castor_io import read_interfile_image
+
+
+IMAGE_NAME_PATTERN = re.compile(
+    r"coincidence_(?P<material>[A-Za-z0-9]+)_src(?P<source_dist>[0-9\.]+)cm_(?P<config>[a-z_]+?)"
+    r"(?:_osem)?_it(?P<iteration>[0-9]+)\.hdr$"
+)
+DIRECTIONS = ["radial", "tangential", "axial"]
+
+
+# ==============================================
+# 1. Command-line argument parsing
+# ==============================================
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Measure FWHM/FWTM of reconstructed point sources."
+    )
+    parser.add_argument("--images", type=str, nargs="+", required=True,
+                        help="Interfile headers (.hdr) or glob patterns, e.g. 'castor_data/*_it2.hdr'.")
+    parser.add_argument("--output", type=str, default="resolution_summary.csv",
+                        help="Summary table (CSV).")
+    parser.add_argument("--profile_length", type=float, default=40.0,
+                        help="Full length of each profile in mm.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Number of worker processes.")
+    return parser.parse_args()
+
+
+# ==============================================
+# 2. Profile widths (vectorized over profiles)
+# ==============================================
+def profile_widths(profiles, spacing, fraction):
+    """
+    Full width at 'fraction' of the maximum of each row of 'profiles' (n, m),
+    sampled every 'spacing' mm (array of n). Rows whose profile does not
+    drop below the level on both sides give NaN.
+    """
+    n, m = profiles.shape
+    rows = np.arange(n)
+    i = np.clip(np.argmax(profiles, axis=1), 1, m - 2)
+    y0, y1, y2 = profiles[rows, i - 1], profiles[rows, i], profiles[rows, i + 1]
+    curvature = y0 - 2.0 * y1 + y2
+    peak = np.where(curvature < 0, y1 - (y2 - y0) ** 2 / (8.0 * np.where(curvature < 0, curvature, -1.0)), y1)
+    level = fraction * peak
+
+    idx = np.arange(m)[None, :]
+    below = profiles < level[:, None]
+    left = below & (idx < i[:, None])
+    right = below & (idx > i[:, None])
+    # last sample below the level left of the peak, first one right of it
+    l = m - 1 - np.argmax(left[:, ::-1], axis=1)
+    r = np.argmax(right, axis=1)
+    valid = left.any(axis=1) & right.any(axis=1)
+    l = np.clip(l, 0, m - 2)
+    r = np.clip(r, 1, m - 1)
+
+    pl0, pl1 = profiles[rows, l], profiles[rows, l + 1]
+    pr0, pr1 = profiles[rows, r - 1], profiles[rows, r]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        xl = l + (level - pl0) / (pl1 - pl0)
+        xr = r - 1 + (pr0 - level) / (pr0 - pr1)
+    return np.where(valid, (xr - xl) * spacing, np.nan)
+
+
+def extract_profiles(image, voxel_size, length):
+    """
+    Radial, tangential and axial profiles through the hottest voxel.
+    The radial direction points from the FOV centre to the peak (x axis if
+    the peak is at the centre). Returns (profiles (3, m), spacing (3,), peak mm).
+    """
+    nz, ny, nx = image.shape
+    vx, vy, vz = voxel_size
+    pz, py, px = np.unravel_index(np.argmax(image), image.shape)
+    peak_mm = np.array([(px + 0.5 - nx / 2.0) * vx, (py + 0.5 - ny / 2.0) * vy, (pz + 0.5 - nz / 2.0) * vz])
+
+    radius = np.hypot(peak_mm[0], peak_mm[1])
+    u = peak_mm[:2] / radius if radius > 0.5 * min(vx, vy) else np.array([1.0, 0.0])
+    t = np.array([-u[1], u[0]])
+
+    step_xy, step_z = min(vx, vy), vz
+    m = int(round(length / min(step_xy, step_z))) | 1
+    k = np.arange(m) - m // 2
+
+    coords = np.empty((3, 3, m))  # (direction, zyx, sample)
+    for d, (ex, ey) in enumerate((u, t)):
+        coords[d] = [np.full(m, pz), py + k * step_xy * ey / vy, px + k * step_xy * ex / vx]
+    coords[2] = [pz + k, np.full(m, py), np.full(m, px)]
+
+    coords = coords.transpose(1, 0, 2).reshape(3, -1)
+    profiles = map_coordinates(image.astype(np.float64), coords, order=1, cval=0.0)
+    return profiles.reshape(3, m), np.array([step_xy, step_xy, step_z]), peak_mm
+
+
+# ==============================================
+# 3. Per-image analysis
+# ==============================================
+def analyse_image(hdr_path, length):
+    image, voxel_size = read_interfile_image(hdr_path)
+    profiles, spacing, peak_mm = extract_profiles(image, voxel_size, length)
+    fwhm = profile_widths(profiles, spacing, 0.5)
+    fwtm = profile_widths(profiles, spacing, 0.1)
+    if image.shape[0] == 1:
+        # single slice: no axial information
+        fwhm[2] = fwtm[2] = np.nan
+
+    row = {"file": os.path.basename(hdr_path)}
+    match = IMAGE_NAME_PATTERN.search(os.path.basename(hdr_path))
+    if match:
+        row.update(material=match["material"], source_dist=float(match["source_dist"]),
+                   config=match["config"], iteration=int(match["iteration"]))
+    row.update(peak_x=peak_mm[0], peak_y=peak_mm[1], peak_z=peak_mm[2],
+               peak_r=np.hypot(peak_mm[0], peak_mm[1]))
+    for d, name in enumerate(DIRECTIONS):
+        row[f"{name}_fwhm"] = fwhm[d]
+        row[f"{name}_fwtm"] = fwtm[d]
+    return row
+
+
+def main():
+    args = parse_args()
+    paths = sorted({p for pattern in args.images for p in (glob.glob(pattern) or [pattern])})
+    if not paths:
+        raise FileNotFoundError(f"No image found for {args.images}")
+    print(f"[INFO] Analysing {len(paths)} images with {args.workers} workers")
+
+    with ProcessPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        rows = list(pool.map(analyse_image, paths, [args.profile_length] * len(paths)))
+
+    summary = pd.DataFrame(rows)
+    sort_keys = [k for k in ("material", "config", "source_dist", "iteration") if k in summary]
+    if sort_keys:
+        summary = summary.sort_values(sort_keys, kind="stable")
+    summary.to_csv(args.output, index=False, float_format="%.3f")
+    print(summary.drop(columns="file").to_string(index=False, float_format="%.2f"))
+    print(f"💾 Saved resolution summary to {args.output}")
+
+
+# ==============================================
+# Entry point
+# ==============================================
+if __name__ == "__main__":
+    main()
@@ -1,110 +1,267 @@
-import pet_helpers as p
 import os
+import json
 from pathlib import Path
 import uproot
 import numpy as np
 import pandas as pd
 import argparse
 
+
 # ------------------------
 # Parse command-line arguments
 # ------------------------
-parser = argparse.ArgumentParser(description="Find coincidences in PET ROOT files.")
-parser.add_argument(
-    "--pattern",
-    type=str,
-    default="*derenzo*.root",
-    help="Glob pattern for ROOT files (e.g., '*hot_point*.root')."
-)
-parser.add_argument(
-    "--material",
-    type=str,
-    default="LXe",
-    help="Detector material name (e.g., LXe, LYSO, BGO)."
-)
-parser.add_argument(
-    "--source_dist",
-    type=float,
-    default=0.0,
-    help="Source distance to detector center in cm (e.g., 0.0, 25.0, 50.0)."
-)
-args = parser.parse_args()
+def parse_args():
+    parser = argparse.ArgumentParser(description="Find coincidences in PET ROOT files.")
+    parser.add_argument(
+        "--pattern",
+        type=str,
+        default="*derenzo*.root",
+        help="Glob pattern for ROOT files (e.g., '*hot_point*.root')."
+    )
+    parser.add_argument(
+        "--material",
+        type=str,
+        default="LXe",
+        help="Detector material name (e.g., LXe, LYSO, BGO)."
+    )
+    parser.add_argument(
+        "--source_dist",
+        type=float,
+        default=0.0,
+        help="Source distance to detector center in cm (e.g., 0.0, 25.0, 50.0)."
+    )
+    parser.add_argument(
+        "--merge",
+        action="store_true",
+        help="Treat all matching files as thread/time shards of one acquisition and "
+             "merge them out-of-core into a single time-ordered stream."
+    )
+    parser.add_argument(
+        "--chunk_size",
+        type=int,
+        default=2_000_000,
+        help="Number of singles held in memory at once in --merge mode."
+    )
+    parser.add_argument(
+        "--sources",
+        type=str,
+        default=None,
+        help="Source table of a multi-source run (output_*_sources.json of pet_sim_philips.py --source_dists): "
+             "tag every single with the sourceID of its primary vertex and write sourceID1/sourceID2."
+    )
+    parser.add_argument(
+        "--source_tolerance",
+        type=float,
+        default=5.0,
+        help="Maximum distance (mm) between the primary vertex and the source position for a sourceID; "
+             "farther singles get -1."
+    )
+    return parser.parse_args()
+
 
 # ------------------------
-# Setup
+# Coincidence search
 # ------------------------
-cwd = os.getcwd()
-folder = Path(cwd) / 'output_radius_plot'
-if not folder.is_dir():
-    raise RuntimeError(f'ERROR: {folder} is not a folder.')
-print(f"CWD: {cwd}")
-print(f"Output folder: {folder}")
-print(f"File pattern: {args.pattern}")
-print(f"Material: {args.material}")
-print(f"Source distance: {args.source_dist} mm")
+COINCIDENCE_KEYS = [
+    'globalPosX1', 'globalPosY1', 'globalPosZ1',
+    'globalPosX2', 'globalPosY2', 'globalPosZ2',
+    'time1', 'time2', 'energy1', 'energy2', 'distance'
+]
+SOURCE_KEYS = ['sourceID1', 'sourceID2']
+# a single opens the window [t, t + TIME_WINDOW]: two uncorrelated singles
+# pair when they are within TIME_WINDOW of each other (randoms rate 2*tau*S_i*S_j)
+TIME_WINDOW = 4.5  # ns
+MIN_DISTANCE = 20.0  # mm
+EVENT_POSITION = ['EventPosition_X', 'EventPosition_Y', 'EventPosition_Z']
+
 
 # ------------------------
-# Main loop
+# Source truth of multi-source runs
 # ------------------------
-for root_file in folder.glob(args.pattern):
-    print(f"\n📂 Processing file: {root_file.name}")
-
-    try:
-        f = uproot.open(root_file)
-        singles5 = f['Singles5']
-        data = singles5.arrays()
-    except Exception as e:
-        print(f"❌ Failed to open {root_file.name}: {e}")
-        continue
-
-    global_time = np.array(data["GlobalTime"])
-    x = np.array(data["PostPosition_X"])
-    y = np.array(data["PostPosition_Y"])
-    z = np.array(data["PostPosition_Z"])
-    energy = np.array(data["TotalEnergyDeposit"])
-    print(f"✅ Loaded {len(global_time):,} singles events")
-
-    time_order = np.argsort(global_time)
-    sorted_times = global_time[time_order]
-
-    time_window = 4.5  # ns
-    coincidences = {k: [] for k in [
-        'globalPosX1', 'globalPosY1', 'globalPosZ1',
-        'globalPosX2', 'globalPosY2', 'globalPosZ2',
-        'time1', 'time2', 'energy1', 'energy2', 'distance'
-    ]}
-    processed = set()
-    n_singles = len(sorted_times)
-    print(f"Searching {n_singles:,} singles for coincidences...")
-
-    for i in range(n_singles - 1):
-        if i in processed:
+def load_source_table(path):
+    """sourceID table written by pet_sim_philips.py --source_dists (see radius_sweep_sources)."""
+    with open(path, 'r') as f:
+        table = json.load(f)
+    return sorted(table, key=lambda entry: entry['sourceID'])
+
+
+def assign_source_ids(ex, ey, ez, table, tolerance):
+    """sourceID of the nearest source to each primary vertex (mm), -1 if none is within the tolerance."""
+    best = np.full(len(ex), np.inf)
+    source_id = np.full(len(ex), -1, dtype=np.int64)
+    for entry in table:
+        px, py, pz = entry['position_mm']
+        d = np.sqrt((ex - px)**2 + (ey - py)**2 + (ez - pz)**2)
+        closer = d < best
+        best[closer] = d[closer]
+        source_id[closer] = entry['sourceID']
+    source_id[best > tolerance] = -1
+    return source_id
+
+
+def tag_sources(columns, table, tolerance):
+    """Add a 'sourceID' column to a dict of singles branches, from the EventPosition branches."""
+    missing = [b for b in EVENT_POSITION if b not in columns]
+    if missing:
+        raise KeyError(f"No {missing} in the singles: run the simulation with --source_dists")
+    columns['sourceID'] = assign_source_ids(*(np.asarray(columns[b]) for b in EVENT_POSITION), table, tolerance)
+    return columns
+
+
+def search_coincidences(t, x, y, z, energy, processed, stop, time_window, min_distance, source_id=None):
+    """
+    Greedy search over time-ordered singles: each single i < stop that is not
+    already used is paired with the first later unused single within the time
+    window whose detection points are more than min_distance apart.
+    'processed' is updated in place. Returns the coincidences as a dict of lists
+    (with sourceID1/sourceID2 if the sourceID of the singles is given).
+    """
+    keys = COINCIDENCE_KEYS + (SOURCE_KEYS if source_id is not None else [])
+    coincidences = {k: [] for k in keys}
+    n_singles = len(t)
+    for i in range(min(stop, n_singles - 1)):
+        if processed[i]:
             continue
-        idx1 = time_order[i]
-        time1 = sorted_times[i]
+        time1 = t[i]
         j = i + 1
-        while j < n_singles and (sorted_times[j] - time1) <= time_window:
-            if j in processed:
+        while j < n_singles and (t[j] - time1) <= time_window:
+            if processed[j]:
                 j += 1
                 continue
-            idx2 = time_order[j]
-            dx, dy, dz = x[idx1] - x[idx2], y[idx1] - y[idx2], z[idx1] - z[idx2]
+            dx, dy, dz = x[i] - x[j], y[i] - y[j], z[i] - z[j]
             distance = np.sqrt(dx**2 + dy**2 + dz**2)
-            if distance > 20.0:
-                for k, v in zip(
-                    ['globalPosX1', 'globalPosY1', 'globalPosZ1', 'globalPosX2', 'globalPosY2', 'globalPosZ2',
-                     'time1', 'time2', 'energy1', 'energy2', 'distance'],
-                    [x[idx1], y[idx1], z[idx1], x[idx2], y[idx2], z[idx2],
-                     global_time[idx1], global_time[idx2], energy[idx1], energy[idx2], distance]):
+            if distance > min_distance:
+                values = [x[i], y[i], z[i], x[j], y[j], z[j], t[i], t[j], energy[i], energy[j], distance]
+                if source_id is not None:
+                    values += [source_id[i], source_id[j]]
+                for k, v in zip(keys, values):
                     coincidences[k].append(v)
-                processed.update({i, j})
+                processed[i] = processed[j] = True
                 break
             j += 1
+    return coincidences
+
+
+def stream_coincidences(blocks, time_window, min_distance, with_source_id=False):
+    """
+    Run the coincidence search on a stream of time-ordered singles blocks in
+    bounded memory. Singles closer than one time window to the end of the
+    buffer are carried over to the next block, so the result is the same as
+    searching the whole acquisition at once.
+    """
+    names = ['GlobalTime', 'PostPosition_X', 'PostPosition_Y', 'PostPosition_Z', 'TotalEnergyDeposit']
+    if with_source_id:
+        names.append('sourceID')
+    carry = {k: np.zeros(0, dtype=np.int64 if k == 'sourceID' else np.float64) for k in names}
+    carry_processed = np.zeros(0, dtype=bool)
+    for block in blocks:
+        buf = {k: np.concatenate([carry[k], block[k]]) for k in names}
+        processed = np.concatenate([carry_processed, np.zeros(len(block['GlobalTime']), dtype=bool)])
+        t = buf['GlobalTime']
+        stop = np.searchsorted(t, t[-1] - time_window, side='left')
+        yield search_coincidences(t, buf['PostPosition_X'], buf['PostPosition_Y'], buf['PostPosition_Z'],
+                                  buf['TotalEnergyDeposit'], processed, stop, time_window, min_distance,
+                                  buf.get('sourceID'))
+        carry = {k: v[stop:] for k, v in buf.items()}
+        carry_processed = processed[stop:]
+    if len(carry_processed):
+        yield search_coincidences(carry['GlobalTime'], carry['PostPosition_X'], carry['PostPosition_Y'],
+                                  carry['PostPosition_Z'], carry['TotalEnergyDeposit'], carry_processed,
+                                  len(carry_processed), time_window, min_distance, carry.get('sourceID'))
+
+
+def main():
+    args = parse_args()
 
-    coincidence_data = pd.DataFrame({k: np.array(v) for k, v in coincidences.items()})
+    # ------------------------
+    # Setup
+    # ------------------------
+    cwd = os.getcwd()
+    folder = Path(cwd) / 'output_radius_plot'
+    if not folder.is_dir():
+        raise RuntimeError(f'ERROR: {folder} is not a folder.')
+    print(f"CWD: {cwd}")
+    print(f"Output folder: {folder}")
+    print(f"File pattern: {args.pattern}")
+    print(f"Material: {args.material}")
+    print(f"Source distance: {args.source_dist} mm")
+
+    time_window = TIME_WINDOW
+    min_distance = MIN_DISTANCE
 
     # Smart output name including material and source distance
     csv_name = f"coincidence_{args.material}_src{args.source_dist:.1f}cm.csv"
+    source_table = None
+    if args.sources:
+        # multi-source run: one file for all sources, split by split_sources.py
+        source_table = load_source_table(args.sources)
+        csv_name = f"coincidence_{args.material}_sweep.csv"
+        print(f"Sources: {len(source_table)} from {args.sources}")
     csv_path = folder / csv_name
-    coincidence_data.to_csv(csv_path, index=False)
-    print(f"💾 Saved {len(coincidence_data)} coincidences to {csv_path}")
+
+    # ------------------------
+    # Merged mode: all matching files are shards of one acquisition
+    # ------------------------
+    if args.merge:
+        if __package__:
+            from .merge_singles import iterate_time_ordered
+        else:  # run as a script from this folder
+            from merge_singles import iterate_time_ordered
+
+        root_files = sorted(str(f) for f in folder.glob(args.pattern))
+        if not root_files:
+            raise RuntimeError(f'ERROR: no file matches {args.pattern} in {folder}')
+        print(f"\n📂 Merging {len(root_files)} files into one time-ordered stream")
+        blocks = iterate_time_ordered(root_files, 'Singles5', args.chunk_size)
+        if source_table is not None:
+            blocks = (tag_sources({k: b[k] for k in b.dtype.names}, source_table, args.source_tolerance)
+                      for b in blocks)
+        n_coinc = 0
+        for coincidences in stream_coincidences(blocks, time_window, min_distance, source_table is not None):
+            coincidence_data = pd.DataFrame({k: np.array(v) for k, v in coincidences.items()})
+            coincidence_data.to_csv(csv_path, index=False, mode='a' if n_coinc else 'w', header=not n_coinc)
+            n_coinc += len(coincidence_data)
+        print(f"💾 Saved {n_coinc} coincidences to {csv_path}")
+
+    # ------------------------
+    # Main loop
+    # ------------------------
+    for root_file in ([] if args.merge else folder.glob(args.pattern)):
+        print(f"\n📂 Processing file: {root_file.name}")
+
+        try:
+            f = uproot.open(root_file)
+            singles5 = f['Singles5']
+            data = singles5.arrays()
+        except Exception as e:
+            print(f"❌ Failed to open {root_file.name}: {e}")
+            continue
+
+        global_time = np.array(data["GlobalTime"])
+        x = np.array(data["PostPosition_X"])
+        y = np.array(data["PostPosition_Y"])
+        z = np.array(data["PostPosition_Z"])
+        energy = np.array(data["TotalEnergyDeposit"])
+        source_id = None
+        if source_table is not None:
+            columns = {b: np.array(data[b]) for b in EVENT_POSITION if b in data.fields}
+            source_id = tag_sources(columns, source_table, args.source_tolerance)['sourceID']
+            print(f"🏷️  {np.count_nonzero(source_id < 0):,} singles without source")
+        print(f"✅ Loaded {len(global_time):,} singles events")
+
+        time_order = np.argsort(global_time)
+        n_singles = len(time_order)
+        print(f"Searching {n_singles:,} singles for coincidences...")
+
+        coincidences = search_coincidences(
+            global_time[time_order], x[time_order], y[time_order], z[time_order], energy[time_order],
+            np.zeros(n_singles, dtype=bool), n_singles, time_window, min_distance,
+            None if source_id is None else source_id[time_order])
+
+        coincidence_data = pd.DataFrame({k: np.array(v) for k, v in coincidences.items()})
+        coincidence_data.to_csv(csv_path, index=False)
+        print(f"💾 Saved {len(coincidence_data)} coincidences to {csv_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+"""
+Long-lived simulation worker for many short point-source runs.
+
+Run requests (source position, activity, duration, seed, output path) are
+JSON files dropped in a queue folder. The worker claims the pending requests
+and simulates them as ONE OpenGATE simulation: the Vereos, the physics and
+the digitizer are built and initialized once, and every request is a run
+interval of its own. Between runs only the source changes: the hot sphere is
+moved with a dynamic parametrisation and each request has its own F18 source,
+active during its interval only. The singles carry their RunID and are split
+into one ROOT file per request afterwards, with the times shifted so that
+each output starts at 0 s, as a pet_sim_philips.py run would.
+
+Geant4 cannot be initialized twice in one process, so each batch runs in a
+subprocess (sim.run(start_new_process=True)) while this process keeps
+watching the queue: a batch of N requests pays the initialization once
+instead of N times. Once a request is pending, the worker waits up to
+--gather seconds for more before starting the batch.
+
+A batch has one random stream, so the output of a request depends on the
+other requests of its batch. A request with a 'seed' is reproducible: it
+is simulated alone, with that seed (and pays its own initialization).
+Requests without a seed are batched; the seed drawn for their batch is
+recorded.
+
+A request file:
+
+  {"output": "runs/src5cm.root", "duration_s": 10, "position_mm": [50, 0, 0],
+   "activity_bq": 1e4, "seed": 12}
+
+Queue states: <id>.json (pending) -> <id>.running -> <id>.done / <id>.failed
+(the last two hold the request and the run information).
+"""
+
+import os
+import json
+import time
+import argparse
+import contextlib
+import numpy as np
+
+if __package__:
+    from .phantoms import SOURCE_MODES, VEREOS_ACCEPTANCE, acceptance_fraction
+else:  # run as a script from this folder
+    from phantoms import SOURCE_MODES, VEREOS_ACCEPTANCE, acceptance_fraction
+
+
+REQUEST_DEFAULTS = {"position_mm": [0.0, 0.0, 0.0], "activity_bq": 1e4, "seed": None}
+SPHERE_RADIUS_MM = 3.0
+WORLD_HALF_SIZE_MM = 1000.0
+
+
+# ==============================================
+# 1. Command-line argument parsing
+# ==============================================
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Simulate a queue of point-source runs with one detector and physics initialization per batch."
+    )
+    parser.add_argument("--queue", type=str, required=True,
+                        help="Queue folder of the run requests (<id>.json).")
+    parser.add_argument("--submit", type=str, default=None,
+                        help="Add the requests of a JSON-lines file to the queue and exit (checked against "
+                             "the acceptance of --source_mode/--full_solid_angle, as the worker will run them).")
+    parser.add_argument("--work_dir", type=str, default="./output_worker",
+                        help="Folder of the batch simulations (ROOT file before the split, stats).")
+    parser.add_argument("--max_batch", type=int, default=50,
+                        help="Maximum number of requests simulated in one initialization.")
+    parser.add_argument("--poll", type=float, default=5.0,
+                        help="Seconds between two looks at the queue.")
+    parser.add_argument("--gather", type=float, default=30.0,
+                        help="Once a request is pending, seconds to wait for more requests before starting "
+                             "a batch (unless --max_batch are pending).")
+    parser.add_argument("--once", action="store_true",
+                        help="Exit when the queue is empty instead of waiting for new requests.")
+    parser.add_argument("--keep_batch", action="store_true",
+                        help="Keep the batch ROOT file once it is split per request.")
+    parser.add_argument("--chunk_size", type=int, default=1_000_000,
+                        help="Number of singles read at once when splitting a batch.")
+    parser.add_argument("--output_profile", type=str, default="lean", choices=["lean", "hits", "debug"],
+                        help="Digitizer tiers written (see pet_sim_philips.py); every tier is split per request.")
+    parser.add_argument("--physics_preset", type=str, default="detailed", choices=["detailed", "fast"],
+                        help="Physics settings (see PHYSICS_PRESETS in pet_helpers.py).")
+    parser.add_argument("--source_mode", type=str, default="positron", choices=SOURCE_MODES,
+                        help="Source mode of every request (see add_f18_source in phantoms.py).")
+    parser.add_argument("--positron_range", action="store_true",
+                        help="Back-to-back mode: blur the emission points with the F18 positron range in water.")
+    parser.add_argument("--full_solid_angle", action="store_true",
+                        help="Back-to-back mode: emit the pairs isotropically (no acceptance restriction).")
+    args = parser.parse_args()
+    if args.positron_range and args.source_mode != "back_to_back":
+        parser.error("--positron_range requires --source_mode back_to_back")
+    if args.max_batch < 1:
+        parser.error("--max_batch must be at least 1")
+    return args
+
+
+# ==============================================
+# 2. Request queue
+# ==============================================
+def source_acceptance(args):
+    """Acceptance the back-to-back emission is restricted to, and the source extent in mm (None: no restriction)."""
+    if args.source_mode != "back_to_back" or args.full_solid_angle:
+        return None, 0.0
+    # the positron-range image reaches 3 mm beyond the point (see add_f18_source)
+    return VEREOS_ACCEPTANCE, 3.0 if args.positron_range else 0.0
+
+
+def check_request(request, acceptance=None, extent=0.0):
+    """
+    Fill the defaults of a run request and check it. With an acceptance
+    (source_acceptance), the source must lie inside it. Returns the completed request.
+    """
+    request = {**REQUEST_DEFAULTS, **request}
+    for key in ("output", "duration_s"):
+        if key not in request:
+            raise ValueError(f"Run request without '{key}': {request}")
+    if not str(request["output"]).endswith(".root"):
+        raise ValueError(f"The output of a run request must be a .root file, got '{request['output']}'")
+    if float(request["duration_s"]) <= 0 or float(request["activity_bq"]) <= 0:
+        raise ValueError(f"Run request with a non-positive duration or activity: {request}")
+    x, y, z = (float(v) for v in request["position_mm"])
+    if np.hypot(x, y) + SPHERE_RADIUS_MM >= VEREOS_ACCEPTANCE["radius"] or \
+            abs(z) + SPHERE_RADIUS_MM >= WORLD_HALF_SIZE_MM:
+        raise ValueError(f"Source position {request['position_mm']} mm is outside the scanner bore")
+    if acceptance is not None:
+        acceptance_fraction([x, y, z], extent, acceptance)
+    request["position_mm"] = [x, y, z]
+    return request
+
+
+def submit(queue_dir, request, acceptance=None, extent=0.0):
+    """Add one run request to the queue. Returns the path of the request file."""
+    request = check_request(request, acceptance, extent)
+    os.makedirs(queue_dir, exist_ok=True)
+    path = os.path.join(queue_dir, f"{time.time_ns()}_{os.getpid()}.json")
+    # written under another name first, so a worker never reads a partial file
+    with open(path + ".tmp", "w") as f:
+        json.dump(request, f, indent=2)
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def finish(running_path, status, info):
+    """Move a claimed request to its final state (done/failed) with the run information."""
+    final_path = running_path[:-len(".running")] + f".{status}"
+    with open(final_path, "w") as f:
+        json.dump(info, f, indent=2)
+    os.remove(running_path)
+    return final_path
+
+
+def pending_requests(queue_dir):
+    return sorted(name for name in os.listdir(queue_dir) if name.endswith(".json"))
+
+
+def claim_batch(queue_dir, max_batch, acceptance=None, extent=0.0):
+    """
+    Claim up to max_batch pending requests, oldest first. A request is claimed
+    by renaming it to .running, so several workers can share one queue.
+    A request with a seed makes a batch of its own; a request failing
+    check_request (e.g. outside the acceptance) is marked failed on its own.
+    Returns [(running path, request)].
+    """
+    batch = []
+    for name in pending_requests(queue_dir):
+        if len(batch) == max_batch:
+            break
+        path = os.path.join(queue_dir, name)
+        try:
+            with open(path) as f:
+                request = json.load(f)
+        except FileNotFoundError:
+            continue  # claimed by another worker
+        except json.JSONDecodeError:
+            request = None
+        seeded = isinstance(request, dict) and request.get("seed") is not None
+        if seeded and batch:
+            continue  # simulated alone, in a later batch
+
+        running_path = path[:-len(".json")] + ".running"
+        try:
+            os.rename(path, running_path)
+        except FileNotFoundError:
+            continue
+        try:
+            if not isinstance(request, dict):
+                raise ValueError("not a JSON object")
+            request = check_request(request, acceptance, extent)
+        except (ValueError, TypeError) as e:
+            print(f"[WARN] Rejected {name}: {e}")
+            finish(running_path, "failed", {"error": str(e)})
+            continue
+        batch.append((running_path, request))
+        if seeded:
+            break
+    return batch
+
+
+def wait_for_requests(args):
+    """
+    Wait until a request is pending, then up to --gather s for the batch to
+    fill. Returns False if the queue is empty and the worker runs --once.
+    """
+    while not pending_requests(args.queue):
+        if args.once:
+            return False
+        time.sleep(args.poll)
+    if not args.once:
+        deadline = time.monotonic() + args.gather
+        while len(pending_requests(args.queue)) < args.max_batch and time.monotonic() < deadline:
+            time.sleep(max(0.0, min(args.poll, deadline - time.monotonic())))
+    return True
+
+
+# ==============================================
+# 3. Batch simulation
+# ==============================================
+def run_batch(args, requests, batch_dir):
+    """
+    Simulate the requests as consecutive run intervals of one simulation.
+    Returns (batch ROOT file, run intervals in s, seed). A seeded request is
+    always alone in its batch (claim_batch) and sets the seed.
+    """
+    import opengate as gate
+    import opengate.contrib.pet.philipsvereos as pet_vereos
+    if __package__:
+        from .pet_helpers import add_vereos_digitizer_v1, set_physics_preset
+        from .phantoms import add_f18_source
+    else:  # run as a script from this folder
+        from pet_helpers import add_vereos_digitizer_v1, set_physics_preset
+        from phantoms import add_f18_source
+
+    mm = gate.g4_units.mm
+    m = gate.g4_units.m
+    sec = gate.g4_units.s
+    Bq = gate.g4_units.Bq
+
+    sim = gate.Simulation()
+    sim.visu = False
+    sim.random_seed = requests[0]["seed"] if len(requests) == 1 and requests[0]["seed"] is not None else "auto"
+    sim.number_of_threads = 1
+    sim.progress_bar = False
+    sim.output_dir = batch_dir
+
+    world = sim.world
+    world.size = [2 * WORLD_HALF_SIZE_MM * mm] * 3
+    world.material = "G4_AIR"
+    pet = pet_vereos.add_pet(sim, "pet")
+
+    # consecutive run intervals, one per request
+    intervals = []
+    t = 0.0
+    for request in requests:
+        intervals.append([t, t + float(request["duration_s"])])
+        t += float(request["duration_s"])
+    sim.run_timing_intervals = [[t0 * sec, t1 * sec] for t0, t1 in intervals]
+
+    # one hot sphere (as in add_simple_hot_point_phantom), moved to the source position of each run
+    positions = [[v * mm for v in r["position_mm"]] for r in requests]
+    hot_sphere = sim.add_volume("Sphere", "worker_hot_sphere")
+    hot_sphere.rmin = 0 * mm
+    hot_sphere.rmax = SPHERE_RADIUS_MM * mm
+    hot_sphere.translation = positions[0]
+    hot_sphere.material = "G4_WATER"
+    hot_sphere.color = [1, 0, 0, 0.6]
+    if len(requests) > 1:
+        hot_sphere.add_dynamic_parametrisation(translation=positions)
+
+    acceptance, _ = source_acceptance(args)
+    for k, (request, (t0, t1)) in enumerate(zip(requests, intervals)):
+        source = add_f18_source(
+            sim, f"worker_source{k}", {"type": "point"}, translation=[0, 0, 0],
+            center=positions[k], activity=float(request["activity_bq"]) * Bq, attached_to=hot_sphere.name,
+            source_mode=args.source_mode, positron_range=args.positron_range, acceptance=acceptance,
+        )
+        source.start_time = t0 * sec
+        source.end_time = t1 * sec
+
+    set_physics_preset(sim, args.physics_preset, pet=pet, phantom=hot_sphere)
+    output_filename = "batch_singles.root"
+    add_vereos_digitizer_v1(sim, pet, output_filename, output_profile=args.output_profile, run_id=True)
+    stats = sim.add_actor("SimulationStatisticsActor", "Stats")
+    stats.track_types_flag = True
+    stats.output_filename = "stats_batch.txt"
+
+    print(f"[BATCH] {len(requests)} runs, {intervals[-1][1]:g} s simulated, seed {sim.random_seed}")
+    sim.run(start_new_process=True)
+    return os.path.join(batch_dir, output_filename), intervals, sim.current_random_seed
+
+
+def split_runs(batch_path, requests, intervals, chunk_size):
+    """
+    Write the entries of every tree of the batch file to the output of their
+    run (RunID), with GlobalTime counted from the start of the run.
+    Returns the number of entries of each tree per request.
+    """
+    import uproot
+    if __package__:
+        from .pet_helpers import write_tree_chunk
+    else:  # run as a script from this folder
+        from pet_helpers import write_tree_chunk
+
+    counts = [{} for _ in requests]
+    with contextlib.ExitStack() as stack:
+        batch = stack.enter_context(uproot.open(batch_path))
+        outputs = []
+        for request in requests:
+            os.makedirs(os.path.dirname(os.path.abspath(request["output"])), exist_ok=True)
+            outputs.append(stack.enter_context(uproot.recreate(request["output"])))
+
+        trees = sorted({key.split(";")[0] for key, cls in batch.classnames().items() if cls == "TTree"})
+        for name in trees:
+            tree = batch[name]
+            for chunk in tree.iterate(step_size=chunk_size, library="np"):
+                run_id = chunk["RunID"]
+                for k in np.unique(run_id):
+                    selected = run_id == k
+                    data = {b: v[selected] for b, v in chunk.items()}
+                    # GlobalTime is in ns
+                    data["GlobalTime"] = data["GlobalTime"] - intervals[k][0] * 1e9
+                    write_tree_chunk(outputs[k], name, data)
+                    counts[k][name] = counts[k].get(name, 0) + len(data["GlobalTime"])
+
+            # a run without any entry still gets its (empty) tree
+            empty = tree.arrays(entry_stop=0, library="np")
+            for k, output in enumerate(outputs):
+                if name not in counts[k]:
+                    write_tree_chunk(output, name, empty)
+                    counts[k][name] = 0
+    return counts
+
+
+# ==============================================
+# 4. Worker loop
+# ==============================================
+def process_batch(args, batch, batch_dir):
+    requests = [request for _, request in batch]
+    os.makedirs(batch_dir, exist_ok=True)
+    try:
+        batch_path, intervals, seed = run_batch(args, requests, batch_dir)
+        counts = split_runs(batch_path, requests, intervals, args.chunk_size)
+    except Exception as e:
+        print(f"❌ Batch {batch_dir} failed: {e}")
+        for running_path, request in batch:
+            finish(running_path, "failed", {"request": request, "batch": batch_dir, "error": str(e)})
+        return
+
+    for k, (running_path, request) in enumerate(batch):
+        finish(running_path, "done", {"request": request, "batch": batch_dir, "run_id": k,
+                                      "batch_size": len(batch), "batch_interval_s": intervals[k],
+                                      "batch_seed": seed, "entries": counts[k]})
+        print(f"💾 Run {k}: {counts[k]} -> {request['output']}")
+    if not args.keep_batch:
+        os.remove(batch_path)
+
+
+def main():
+    args = parse_args()
+    os.makedirs(args.queue, exist_ok=True)
+    if args.submit:
+        with open(args.submit) as f:
+            requests = [json.loads(line) for line in f if line.strip()]
+        # all requests are checked before any is queued
+        requests = [check_request(request, *source_acceptance(args)) for request in requests]
+        for request in requests:
+            print(f"[QUEUE] {submit(args.queue, request, *source_acceptance(args))}")
+        return
+
+    n_batches = 0
+    print(f"[WORKER] Watching {args.queue}")
+    while wait_for_requests(args):
+        batch = claim_batch(args.queue, args.max_batch, *source_acceptance(args))
+        if not batch:
+            continue
+        batch_dir = os.path.join(args.work_dir, f"batch_{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}_{n_batches}")
+        process_batch(args, batch, batch_dir)
+        n_batches += 1
+    print(f"[DONE] {n_batches} batches, queue empty")
+
+
+# ==============================================
+# Entry point
+# ==============================================
+if __name__ == "__main__":
+    main()
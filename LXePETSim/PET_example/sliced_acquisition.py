@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Time-sliced acquisition with overlapped post-processing.
+
+The acquisition is simulated as consecutive time slices, each one a separate
+pet_sim_philips.py run in its own folder (run_dir/sliceNNN). As soon as a
+slice is finished, its coincidence sorting and list-mode conversion are
+started in the background while the next slice is being simulated. A
+checkpoint file records the finished slices, so an interrupted acquisition
+restarts from the last finished slice. At the end, the list-mode data of all
+slices are concatenated into one dataset.
+
+Coincidences straddling a slice boundary (a few ns out of each slice) are lost.
+"""
+
+import os
+import sys
+import json
+import shlex
+import shutil
+import asyncio
+import argparse
+
+if __package__:
+    from .castor_io import CONFIG_DIR, read_cdf, write_cdh, write_time_index
+else:  # run as a script from this folder
+    from castor_io import CONFIG_DIR, read_cdf, write_cdh, write_time_index
+
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# ==============================================
+# 1. Command-line argument parsing
+# ==============================================
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Simulate an acquisition in time slices, post-processing each slice while the next one runs."
+    )
+    parser.add_argument("--run_dir", type=str, required=True,
+                        help="Folder holding the slices, the checkpoint and the merged list-mode data.")
+    parser.add_argument("--source_dist", type=float, default=0.0,
+                        help="Source distance to detector center in cm.")
+    parser.add_argument("--material", type=str, default="LYSO",
+                        help="Detector material of the simulation, also used in the output file names.")
+    parser.add_argument("--duration", type=float, default=1000.0,
+                        help="Total acquisition time in s.")
+    parser.add_argument("--n_slices", type=int, default=10,
+                        help="Number of time slices.")
+    parser.add_argument("--config_option", type=str, default="original",
+                        choices=["original", "fine", "super_fine"],
+                        help="LUT configuration of the list-mode conversion.")
+    parser.add_argument("--config_path", type=str, default=CONFIG_DIR,
+                        help="Path to the LUT configuration files.")
+    parser.add_argument("--post_workers", type=int, default=2,
+                        help="Maximum number of slices post-processed at the same time.")
+    parser.add_argument("--sim_args", type=str, default="",
+                        help="Extra arguments passed to pet_sim_philips.py, e.g. '--output_profile hits'.")
+    return parser.parse_args()
+
+
+# ==============================================
+# 2. Checkpoint
+# ==============================================
+def load_checkpoint(path, args):
+    settings = {"duration": args.duration, "n_slices": args.n_slices, "source_dist": args.source_dist,
+                "material": args.material, "config_option": args.config_option}
+    if not os.path.isfile(path):
+        return dict(settings, slices={})
+    with open(path, "r") as f:
+        checkpoint = json.load(f)
+    changed = {k: (checkpoint.get(k), v) for k, v in settings.items() if checkpoint.get(k) != v}
+    if changed:
+        raise ValueError(f"Checkpoint {path} was written with other settings (saved, requested): {changed}")
+    done = sum(s.get("converted", False) for s in checkpoint["slices"].values())
+    print(f"[RESUME] {done}/{args.n_slices} slices already finished")
+    return checkpoint
+
+
+def save_checkpoint(path, checkpoint):
+    # write-then-rename so that a crash never leaves a truncated checkpoint
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp, path)
+
+
+# ==============================================
+# 3. Slice simulation and post-processing
+# ==============================================
+async def run(command, cwd, log_path):
+    with open(log_path, "a") as log:
+        proc = await asyncio.create_subprocess_exec(*command, cwd=cwd, stdout=log, stderr=log)
+        code = await proc.wait()
+    if code != 0:
+        raise RuntimeError(f"'{os.path.basename(command[1])}' failed with code {code}, see {log_path}")
+
+
+async def simulate_slice(args, k, slice_dir):
+    if os.path.isdir(slice_dir):
+        # output of an interrupted run of this slice
+        print(f"[RESUME] Discarding unfinished slice {k}")
+        shutil.rmtree(slice_dir)
+    os.makedirs(os.path.join(slice_dir, "output_radius_plot"))
+
+    width = args.duration / args.n_slices
+    t0, t1 = k * width, (k + 1) * width
+    print(f"[SIM] Slice {k}: {t0:g} - {t1:g} s")
+    command = [sys.executable, os.path.join(SCRIPT_DIR, "pet_sim_philips.py"),
+               "--source_dist", str(args.source_dist), "--material", args.material,
+               "--time_start", str(t0), "--time_end", str(t1), *shlex.split(args.sim_args)]
+    await run(command, slice_dir, os.path.join(slice_dir, "simulation.log"))
+
+
+async def postprocess_slice(args, k, slice_dir, semaphore):
+    async with semaphore:
+        print(f"[POST] Slice {k}: sorting and conversion started")
+        width = args.duration / args.n_slices
+        log_path = os.path.join(slice_dir, "postprocess.log")
+        await run([sys.executable, os.path.join(SCRIPT_DIR, "sim_to_coincidence.py"),
+                   "--pattern", "output_*.root", "--material", args.material,
+                   "--source_dist", str(args.source_dist)], slice_dir, log_path)
+        await run([sys.executable, os.path.join(SCRIPT_DIR, "coincidence_to_castor_data.py"),
+                   "--config_option", args.config_option, "--material", args.material,
+                   "--source_dist", str(args.source_dist),
+                   "--input_dir", os.path.join(slice_dir, "output_radius_plot"),
+                   "--output_dir", os.path.join(slice_dir, "castor"),
+                   "--config_path", args.config_path,
+                   "--start_time", str(k * width), "--duration", str(width)], slice_dir, log_path)
+        print(f"[POST] Slice {k}: done")
+
+
+def slice_cdh(args, slice_dir):
+    return os.path.join(slice_dir, "castor",
+                        f"coincidence_{args.material}_src{args.source_dist:.1f}cm_{args.config_option}.cdh")
+
+
+async def acquire(args, checkpoint, checkpoint_path):
+    semaphore = asyncio.Semaphore(max(1, args.post_workers))
+
+    async def post(k, slice_dir):
+        await postprocess_slice(args, k, slice_dir, semaphore)
+        checkpoint["slices"][str(k)]["converted"] = True
+        save_checkpoint(checkpoint_path, checkpoint)
+
+    post_tasks = []
+    for k in range(args.n_slices):
+        slice_dir = os.path.join(args.run_dir, f"slice{k:03d}")
+        status = checkpoint["slices"].setdefault(str(k), {})
+        if status.get("converted"):
+            continue
+        if not status.get("simulated"):
+            try:
+                await simulate_slice(args, k, slice_dir)
+            except Exception:
+                # keep the slices already simulated: let their post-processing finish
+                await asyncio.gather(*post_tasks, return_exceptions=True)
+                raise
+            status["simulated"] = True
+            save_checkpoint(checkpoint_path, checkpoint)
+        # the next slice is simulated while this one is post-processed
+        post_tasks.append(asyncio.create_task(post(k, slice_dir)))
+    await asyncio.gather(*post_tasks)
+
+
+# ==============================================
+# 4. Merge the slices
+# ==============================================
+def merge_slices(args, chunk_size=10_000_000):
+    """
+    Concatenate the list-mode data of all slices (consecutive in time, so the
+    result stays time-ordered), keeping the header of the first one.
+    """
+    prefix = f"coincidence_{args.material}_src{args.source_dist:.1f}cm_{args.config_option}"
+    output_cdf = os.path.join(args.run_dir, f"{prefix}.cdf")
+    output_cdh = os.path.join(args.run_dir, f"{prefix}.cdh")
+
+    n_events = 0
+    header = None
+    with open(output_cdf, "wb") as out:
+        for k in range(args.n_slices):
+            slice_header, events = read_cdf(slice_cdh(args, os.path.join(args.run_dir, f"slice{k:03d}")))
+            header = header or slice_header
+            for start in range(0, len(events), chunk_size):
+                block = events[start:start + chunk_size]
+                block.tofile(out)
+                n_events += len(block)
+
+    header["Data filename"] = output_cdf
+    header["Number of events"] = str(n_events)
+    header["Start time (s)"] = "0"
+    header["Duration (s)"] = f"{args.duration:g}"
+    write_cdh(output_cdh, header)
+    _, events = read_cdf(output_cdh)
+    write_time_index(output_cdf, events["time"], 0)
+    print(f"💾 Merged {n_events:,} events from {args.n_slices} slices into {output_cdh}")
+
+
+def main():
+    args = parse_args()
+    os.makedirs(args.run_dir, exist_ok=True)
+    checkpoint_path = os.path.join(args.run_dir, "checkpoint.json")
+    checkpoint = load_checkpoint(checkpoint_path, args)
+    save_checkpoint(checkpoint_path, checkpoint)
+
+    asyncio.run(acquire(args, checkpoint, checkpoint_path))
+    merge_slices(args)
+
+
+# ==============================================
+# Entry point
+# ==============================================
+if __name__ == "__main__":
+    main()
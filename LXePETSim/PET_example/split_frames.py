@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Cut a list-mode dataset into time frames, one .cdf/.cdh pair per frame.
+
+The events of a frame [t0, t1) are located with the time index written by
+coincidence_to_castor_data.py (only the two boundary bins are read) and
+copied as a slice of the memory-mapped .cdf. Without a time index, the frame
+boundaries are found by bisection on the event times.
+"""
+
+import os
+import argparse
+
+if __package__:
+    from .castor_io import read_cdf, resolve_cdf_path, write_cdh, load_time_index, event_range
+else:  # run as a script from this folder
+    from castor_io import read_cdf, resolve_cdf_path, write_cdh, load_time_index, event_range
+
+
+# ==============================================
+# 1. Command-line argument parsing
+# ==============================================
+def parse_frame(text):
+    t0, t1 = (float(v) for v in text.split(":"))
+    if t1 <= t0:
+        raise argparse.ArgumentTypeError(f"Empty frame '{text}'")
+    return t0, t1
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Split a CASToR list-mode dataset into time frames.")
+    parser.add_argument("--datafile", type=str, required=True,
+                        help="CASToR list-mode header (.cdh).")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--frames", type=parse_frame, nargs="+",
+                       help="Frames 't0:t1' in s (same time origin as the header 'Start time'), e.g. 0:60 60:120.")
+    group.add_argument("--frame_duration", type=float,
+                       help="Consecutive frames of this duration (s) over the acquisition.")
+    parser.add_argument("--output_dir", type=str, default=None,
+                        help="Output folder (default: next to the dataset).")
+    parser.add_argument("--chunk_size", type=int, default=10_000_000,
+                        help="Number of events copied at once.")
+    return parser.parse_args()
+
+
+# ==============================================
+# 2. Frames
+# ==============================================
+def acquisition_interval(header):
+    start = float(header.get("Start time (s)", 0))
+    return start, start + float(header["Duration (s)"])
+
+
+def clip_frames(header, frames):
+    """
+    Clip the frames to the acquisition, so that the start time and duration
+    of each frame header are those of its data. A frame outside the
+    acquisition is an error.
+    """
+    start, end = acquisition_interval(header)
+    clipped = []
+    for t0, t1 in frames:
+        c0, c1 = max(t0, start), min(t1, end)
+        if c1 <= c0:
+            raise ValueError(f"Frame {t0:g}:{t1:g} s is outside the acquisition ({start:g} - {end:g} s)")
+        if (c0, c1) != (t0, t1):
+            print(f"[WARN] Frame {t0:g}:{t1:g} s clipped to the acquisition: {c0:g}:{c1:g} s")
+        clipped.append((c0, c1))
+    return clipped
+
+
+def frame_list(header, frame_duration):
+    start, end = acquisition_interval(header)
+    frames = []
+    t0 = start
+    while t0 < end - 1e-9:
+        frames.append((t0, min(t0 + frame_duration, end)))
+        t0 += frame_duration
+    return frames
+
+
+def write_frame(events, header, first, last, t0, t1, cdh_path, chunk_size):
+    """Write events[first:last] (a view of the memory map) as a dataset starting at t0 and lasting t1 - t0."""
+    cdf_path = cdh_path[:-len(".cdh")] + ".cdf"
+    with open(cdf_path, "wb") as out:
+        for start in range(first, last, chunk_size):
+            events[start:min(start + chunk_size, last)].tofile(out)
+
+    frame_header = dict(header)
+    frame_header["Data filename"] = cdf_path
+    frame_header["Number of events"] = str(last - first)
+    frame_header["Start time (s)"] = f"{t0:g}"
+    frame_header["Duration (s)"] = f"{t1 - t0:g}"
+    write_cdh(cdh_path, frame_header)
+
+
+def main():
+    args = parse_args()
+    header, events = read_cdf(args.datafile)
+    index = load_time_index(resolve_cdf_path(args.datafile, header))
+    if index is None:
+        print("[WARN] No time index, locating the frames by bisection")
+    frames = clip_frames(header, args.frames) if args.frames else frame_list(header, args.frame_duration)
+
+    output_dir = args.output_dir or os.path.dirname(os.path.abspath(args.datafile))
+    os.makedirs(output_dir, exist_ok=True)
+    base = os.path.basename(args.datafile)[:-len(".cdh")]
+    for k, (t0, t1) in enumerate(frames):
+        first, last = event_range(events, int(round(t0 * 1000)), int(round(t1 * 1000)), index)
+        cdh_path = os.path.join(output_dir, f"{base}_frame{k:03d}.cdh")
+        write_frame(events, header, first, last, t0, t1, cdh_path, args.chunk_size)
+        print(f"[FRAME] {k}: {t0:g} - {t1:g} s, {last - first:,} events -> {cdh_path}")
+
+
+# ==============================================
+# Entry point
+# ==============================================
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Split the coincidences of a multi-source run (pet_sim_philips.py --source_dists,
+sorted with sim_to_coincidence.py --sources) into one coincidence file per
+source distance.
+
+Only coincidences whose two singles come from the same source are kept
+(sourceID1 == sourceID2 >= 0); pairs mixing two sources and singles without
+a source (e.g. vertex outside the tolerance) are dropped. Source k of the
+sweep sits at azimuth k * 20 deg; its detection positions are rotated back by
+that angle, so each output is equivalent to a run with the source on the x
+axis (the Vereos geometry repeats every 20 deg). The sweep sources share the
+activity of one per-distance run (add_radius_sweep_phantom), so the count
+rates match, but each output has 1/n_sources of its counts; the spatial
+distribution of the singles (hence of pile-up and randoms over the crystals)
+is that of the whole sweep. The outputs are named as
+those of sim_to_coincidence.py, coincidence_<material>_src<dist>cm.csv, and
+feed coincidence_to_castor_data.py directly.
+"""
+
+import os
+import re
+import argparse
+import numpy as np
+import pandas as pd
+
+if __package__:
+    from .sim_to_coincidence import load_source_table
+else:  # run as a script from this folder
+    from sim_to_coincidence import load_source_table
+
+
+# ==============================================
+# 1. Command-line argument parsing
+# ==============================================
+def parse_args():
+    parser = argparse.ArgumentParser(description="Route the coincidences of a multi-source run to per-distance files.")
+    parser.add_argument("--input", type=str, required=True,
+                        help="Coincidence CSV with sourceID1/sourceID2 (coincidence_<material>_sweep.csv).")
+    parser.add_argument("--sources", type=str, required=True,
+                        help="Source table of the run (output_*_sources.json).")
+    parser.add_argument("--material", type=str, default=None,
+                        help="Material of the output names (default: from the input name).")
+    parser.add_argument("--output_dir", type=str, default=None,
+                        help="Output folder (default: the folder of the input).")
+    parser.add_argument("--no_rotate", action="store_true",
+                        help="Keep the detection positions as simulated (sources at their own azimuth).")
+    parser.add_argument("--chunk_size", type=int, default=1_000_000,
+                        help="Number of coincidences read at once.")
+    return parser.parse_args()
+
+
+# ==============================================
+# 2. Routing
+# ==============================================
+def rotate_back(chunk, azimuth_deg):
+    """Rotate the detection positions by -azimuth around the scanner axis."""
+    c, s = np.cos(np.radians(azimuth_deg)), np.sin(np.radians(azimuth_deg))
+    for n in ("1", "2"):
+        x, y = chunk[f"globalPosX{n}"].values, chunk[f"globalPosY{n}"].values
+        chunk[f"globalPosX{n}"] = c * x + s * y
+        chunk[f"globalPosY{n}"] = -s * x + c * y
+    return chunk
+
+
+def main():
+    args = parse_args()
+    table = load_source_table(args.sources)
+    material = args.material
+    if material is None:
+        match = re.match(r"coincidence_([A-Za-z0-9]+)_", os.path.basename(args.input))
+        if not match:
+            raise ValueError(f"Cannot parse the material from {args.input}, give --material")
+        material = match.group(1)
+    output_dir = args.output_dir or os.path.dirname(os.path.abspath(args.input))
+    os.makedirs(output_dir, exist_ok=True)
+
+    outputs = {e["sourceID"]: os.path.join(output_dir, f"coincidence_{material}_src{e['source_dist_cm']:.1f}cm.csv")
+               for e in table}
+    azimuths = {e["sourceID"]: e["azimuth_deg"] for e in table}
+    counts = dict.fromkeys(outputs, 0)
+    n_total = n_mixed = n_untagged = 0
+    for chunk in pd.read_csv(args.input, chunksize=args.chunk_size):
+        if "sourceID1" not in chunk:
+            raise KeyError(f"{args.input} has no sourceID columns: sort it with sim_to_coincidence.py --sources")
+        n_total += len(chunk)
+        s1, s2 = chunk["sourceID1"].values, chunk["sourceID2"].values
+        n_untagged += np.count_nonzero((s1 < 0) | (s2 < 0))
+        n_mixed += np.count_nonzero((s1 != s2) & (s1 >= 0) & (s2 >= 0))
+        for k, group in chunk[(s1 == s2) & (s1 >= 0)].groupby("sourceID1"):
+            if k not in outputs:
+                raise ValueError(f"sourceID {k} is not in {args.sources}")
+            if not args.no_rotate:
+                group = rotate_back(group.copy(), azimuths[k])
+            group.to_csv(outputs[k], index=False, mode="a" if counts[k] else "w", header=not counts[k])
+            counts[k] += len(group)
+
+    for k, path in outputs.items():
+        if counts[k] == 0:
+            # keep one (empty) file per distance
+            pd.DataFrame(columns=pd.read_csv(args.input, nrows=0).columns).to_csv(path, index=False)
+        print(f"💾 sourceID {k}: {counts[k]:,} coincidences -> {path}")
+    print(f"[INFO] {n_total:,} coincidences: {sum(counts.values()):,} kept, {n_mixed:,} mixing two sources, "
+          f"{n_untagged:,} with an untagged single")
+
+
+# ==============================================
+# Entry point
+# ==============================================
+if __name__ == "__main__":
+    main()
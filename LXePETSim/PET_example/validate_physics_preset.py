@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Validate a physics preset against the detailed one.
+
+Two runs of pet_sim_philips.py with the same source and acquisition time, one
+with '--physics_preset detailed' (reference) and one with the preset to test,
+are compared on their Singles5 tree: number of singles (with its Poisson
+error), energy spectrum (chi2 test and Kolmogorov-Smirnov distance), mean
+energy and crystal-position spread. If the statistics files of both runs are
+given, the speed-up is reported from their primaries per second. The last
+line is the row of the measured-cost table of the README.
+"""
+
+import json
+import argparse
+import numpy as np
+import uproot
+from scipy import stats
+
+
+# ==============================================
+# 1. Command-line argument parsing
+# ==============================================
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Compare the singles of a physics preset against the detailed preset."
+    )
+    parser.add_argument("--reference", type=str, required=True,
+                        help="ROOT file of the run with '--physics_preset detailed'.")
+    parser.add_argument("--test", type=str, required=True,
+                        help="ROOT file of the run with the preset to validate.")
+    parser.add_argument("--reference_stats", type=str, default=None,
+                        help="Statistics file (stats_*.txt) of the reference run.")
+    parser.add_argument("--test_stats", type=str, default=None,
+                        help="Statistics file (stats_*.txt) of the tested run.")
+    parser.add_argument("--bins", type=int, default=50,
+                        help="Number of energy bins of the spectrum comparison.")
+    parser.add_argument("--energy_range", type=float, nargs=2, default=[449.68, 613.20],
+                        help="Energy range of the spectrum comparison in keV (default: energy window).")
+    parser.add_argument("--plot", type=str, default=None,
+                        help="Save a spectrum comparison plot to this file.")
+    args = parser.parse_args()
+    if (args.reference_stats is None) != (args.test_stats is None):
+        parser.error("--reference_stats and --test_stats go together")
+    return args
+
+
+# ==============================================
+# 2. Comparison
+# ==============================================
+def load_singles(path):
+    with uproot.open(path) as f:
+        return f["Singles5"].arrays(["TotalEnergyDeposit", "PostPosition_X",
+                                     "PostPosition_Y", "PostPosition_Z"], library="np")
+
+
+def read_stats(path):
+    """
+    Numeric values of a SimulationStatisticsActor file, by lowercase key.
+    Reads the 'pps   1234' text layout of OpenGATE 10, the older
+    '# PPS (Primary per sec) = 1234' layout and the json encoder.
+    """
+    with open(path, "r") as f:
+        text = f.read()
+    if text.lstrip().startswith("{"):
+        return {k.lower(): float(v["value"]) for k, v in json.loads(text).items()
+                if isinstance(v, dict) and isinstance(v.get("value"), (int, float))}
+    values = {}
+    for line in text.splitlines():
+        line = line.strip().lstrip("#")
+        key, sep, value = line.partition("=")
+        if not sep:
+            key, _, value = line.strip().partition(" ")
+        if not key.split() or not value.split():
+            continue
+        try:
+            values[key.split()[0].lower()] = float(value.split()[0])
+        except ValueError:
+            pass
+    return values
+
+
+def read_pps(path):
+    """Primaries per second of a run, from its statistics file."""
+    pps = read_stats(path).get("pps")
+    if not pps or pps <= 0:
+        raise ValueError(f"No primaries per second (PPS) in the statistics file {path}")
+    return pps
+
+
+def compare_spectra(e_ref, e_test, bins, energy_range):
+    """
+    Chi2 test of two histograms with different totals (shape only), and the
+    two-sample Kolmogorov-Smirnov distance. Energies in keV.
+    """
+    edges = np.linspace(*energy_range, bins + 1)
+    h_ref = np.histogram(e_ref, edges)[0].astype(float)
+    h_test = np.histogram(e_test, edges)[0].astype(float)
+    n_ref, n_test = h_ref.sum(), h_test.sum()
+    used = (h_ref + h_test) > 0
+    # chi2 for two unnormalized histograms (NIM A 614 (2010) 287, eq. 4)
+    chi2 = np.sum((np.sqrt(n_test / n_ref) * h_ref[used] - np.sqrt(n_ref / n_test) * h_test[used]) ** 2
+                  / (h_ref[used] + h_test[used]))
+    ndf = int(used.sum()) - 1
+    ks = stats.ks_2samp(e_ref, e_test)
+    return {"edges": edges, "h_ref": h_ref, "h_test": h_test, "chi2": chi2, "ndf": ndf,
+            "chi2_pvalue": stats.chi2.sf(chi2, ndf), "ks": ks.statistic, "ks_pvalue": ks.pvalue}
+
+
+def plot_spectra(result, path):
+    import matplotlib.pyplot as plt
+
+    edges = result["edges"]
+    fig, ax = plt.subplots(figsize=(7, 4.5))
+    ax.stairs(result["h_ref"] / result["h_ref"].sum(), edges, label="detailed")
+    ax.stairs(result["h_test"] / result["h_test"].sum(), edges, label="test")
+    ax.set_xlabel("Energy [keV]")
+    ax.set_ylabel("Fraction of singles")
+    ax.set_title(f"chi2/ndf = {result['chi2']:.1f}/{result['ndf']}, KS = {result['ks']:.4f}")
+    ax.legend()
+    fig.tight_layout()
+    fig.savefig(path, dpi=150)
+    print(f"📊 Saved spectrum comparison to {path}")
+
+
+def main():
+    args = parse_args()
+    ref, test = load_singles(args.reference), load_singles(args.test)
+    # energies are stored in MeV
+    e_ref = ref["TotalEnergyDeposit"] * 1000.0
+    e_test = test["TotalEnergyDeposit"] * 1000.0
+    n_ref, n_test = len(e_ref), len(e_test)
+    if n_ref == 0 or n_test == 0:
+        raise ValueError("One of the runs has no singles")
+
+    ratio = n_test / n_ref
+    ratio_err = ratio * np.sqrt(1.0 / n_ref + 1.0 / n_test)
+    print(f"Singles            : detailed {n_ref:,}  test {n_test:,}")
+    print(f"Count ratio        : {ratio:.4f} ± {ratio_err:.4f} ({(ratio - 1.0) / ratio_err:+.1f} sigma)")
+    print(f"Mean energy [keV]  : detailed {e_ref.mean():.2f} ± {e_ref.std() / np.sqrt(n_ref):.2f}  "
+          f"test {e_test.mean():.2f} ± {e_test.std() / np.sqrt(n_test):.2f}")
+    r_ref = np.hypot(ref["PostPosition_X"], ref["PostPosition_Y"])
+    r_test = np.hypot(test["PostPosition_X"], test["PostPosition_Y"])
+    print(f"Mean radius [mm]   : detailed {r_ref.mean():.2f}  test {r_test.mean():.2f}")
+    print(f"Axial RMS [mm]     : detailed {ref['PostPosition_Z'].std():.2f}  test {test['PostPosition_Z'].std():.2f}")
+
+    result = compare_spectra(e_ref, e_test, args.bins, args.energy_range)
+    print(f"Spectrum chi2/ndf  : {result['chi2']:.1f}/{result['ndf']} (p = {result['chi2_pvalue']:.3g})")
+    print(f"Spectrum KS        : {result['ks']:.4f} (p = {result['ks_pvalue']:.3g})")
+
+    speed_up = "-"
+    if args.reference_stats:
+        pps_ref, pps_test = read_pps(args.reference_stats), read_pps(args.test_stats)
+        speed_up = f"{pps_test / pps_ref:.2f}x"
+        print(f"Speed-up           : {speed_up} ({pps_ref:,.0f} -> {pps_test:,.0f} primaries/s)")
+
+    print(f"README row         : | {n_ref:,} / {n_test:,} | {ratio:.4f} ± {ratio_err:.4f} | "
+          f"{e_test.mean() - e_ref.mean():+.2f} | {result['chi2']:.1f}/{result['ndf']} | "
+          f"{result['ks']:.4f} | {speed_up} |")
+
+    if args.plot:
+        plot_spectra(result, args.plot)
+
+
+# ==============================================
+# Entry point
+# ==============================================
+if __name__ == "__main__":
+    main()
@@ -5,17 +5,26 @@
 import opengate as gate
 from pathlib import Path
 import opengate.contrib.pet.philipsvereos as pet_vereos
-from pet_helpers import add_vereos_digitizer_v1
 from opengate.geometry.utility import get_circular_repetition
 from opengate.sources.base import get_rad_yield
 
-# Import phantom functions
-from phantoms import (
-    add_multiple_hot_spheres_phantom,
-    add_simple_hot_sphere_phantom,
-    add_resolution_test_phantom,
-    add_cold_spheres_phantom
-)
+# Import the digitizer and phantom functions
+if __package__:
+    from .pet_helpers import add_vereos_digitizer_v1
+    from .phantoms import (
+        add_multiple_hot_spheres_phantom,
+        add_simple_hot_sphere_phantom,
+        add_resolution_test_phantom,
+        add_cold_spheres_phantom
+    )
+else:  # run as a script from this folder
+    from pet_helpers import add_vereos_digitizer_v1
+    from phantoms import (
+        add_multiple_hot_spheres_phantom,
+        add_simple_hot_sphere_phantom,
+        add_resolution_test_phantom,
+        add_cold_spheres_phantom
+    )
 
 if __name__ == "__main__":
     sim = gate.Simulation()